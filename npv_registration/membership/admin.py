@@ -3,7 +3,14 @@ from django.contrib import admin
 # Register your models here.
 # membership/admin.py
 from django.contrib import admin
-from .models import Member, MembershipCounter
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import (
+    ArchivedFile, Member, MembershipCounter, CertificateJob, CertificateBatch, EmailOutbox, IdempotencyRecord,
+    RevokedCertificate,
+)
+from .search import match_members
 
 
 @admin.register(Member)
@@ -36,33 +43,26 @@ class MemberAdmin(admin.ModelAdmin):
 
     get_full_name.short_description = 'Full Name'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Use the indexed member search instead of OR'd icontains lookups"""
+        if not search_term.strip():
+            return queryset, False
+        return match_members(queryset, search_term), False
+
     actions = ['regenerate_certificates']
 
     def regenerate_certificates(self, request, queryset):
-        from .certificate_generator import CertificateGenerator
-        import os
-        from django.conf import settings
-
-        for member in queryset:
-            try:
-                cert_generator = CertificateGenerator(member)
-                pdf_buffer, qr_path = cert_generator.save_certificate()
-
-                cert_filename = f'certificate_{member.membership_number}.pdf'
-                cert_path = os.path.join(settings.MEDIA_ROOT, 'certificates', cert_filename)
-
-                os.makedirs(os.path.dirname(cert_path), exist_ok=True)
-                with open(cert_path, 'wb') as f:
-                    f.write(pdf_buffer.read())
-
-                member.certificate = f'certificates/{cert_filename}'
-                member.qr_code = qr_path
-                member.save()
-
-            except Exception as e:
-                self.message_user(request, f'Error for {member.membership_number}: {str(e)}', level='error')
-
-        self.message_user(request, f'Successfully regenerated certificates for {queryset.count()} members.')
+        member_ids = list(queryset.values_list('pk', flat=True))
+        batch = CertificateBatch.objects.create(
+            description=f'Admin regeneration by {request.user} ({len(member_ids)} members)',
+            member_ids=member_ids,
+            total=len(member_ids),
+        )
+        url = reverse('admin:membership_certificatebatch_change', args=[batch.pk])
+        self.message_user(request, format_html(
+            'Queued certificate regeneration for {} members. <a href="{}">Track progress</a>.',
+            len(member_ids), url,
+        ))
 
     regenerate_certificates.short_description = 'Regenerate certificates for selected members'
 
@@ -70,4 +70,76 @@ class MemberAdmin(admin.ModelAdmin):
 @admin.register(MembershipCounter)
 class MembershipCounterAdmin(admin.ModelAdmin):
     list_display = ['category', 'last_number']
-    readonly_fields = ['category', 'last_number']
\ No newline at end of file
+    readonly_fields = ['category', 'last_number']
+
+
+@admin.register(CertificateJob)
+class CertificateJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'member', 'status', 'attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['status']
+    search_fields = ['member__membership_number']
+    raw_id_fields = ['member']
+    readonly_fields = ['locked_by', 'last_error', 'created_at', 'started_at', 'finished_at']
+
+
+@admin.register(CertificateBatch)
+class CertificateBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'description', 'status', 'progress', 'failed', 'created_at', 'finished_at']
+    list_filter = ['status']
+    exclude = ['member_ids']
+    readonly_fields = ['description', 'status', 'progress', 'total', 'processed', 'failed',
+                       'errors', 'locked_by', 'created_at', 'started_at', 'updated_at', 'finished_at']
+
+    def progress(self, obj):
+        return format_html(
+            '<progress value="{}" max="{}"></progress> {}/{} ({}%)',
+            obj.processed, obj.total or 1, obj.processed, obj.total, obj.percent_complete,
+        )
+
+    progress.short_description = 'Progress'
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'to', 'subject', 'status', 'attempts', 'run_after', 'sent_at']
+    list_filter = ['status', 'provider']
+    search_fields = ['to', 'member__membership_number']
+    raw_id_fields = ['member']
+    exclude = ['attachment']
+    readonly_fields = ['provider', 'locked_by', 'last_error', 'created_at', 'started_at', 'sent_at']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=EmailOutbox.STATUS_SENT).update(
+            status=EmailOutbox.STATUS_PENDING, run_after=timezone.now(), attempts=0, locked_by='',
+        )
+        self.message_user(request, f'Queued {updated} email(s) for sending.')
+
+    retry_now.short_description = 'Retry selected emails now'
+
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ['key', 'scope', 'caller', 'status', 'response_status', 'created_at', 'expires_at']
+    list_filter = ['status', 'scope']
+    search_fields = ['key', 'caller']
+    readonly_fields = ['key', 'scope', 'caller', 'fingerprint', 'status', 'response_status', 'response_body',
+                       'created_at', 'expires_at']
+
+
+@admin.register(ArchivedFile)
+class ArchivedFileAdmin(admin.ModelAdmin):
+    list_display = ['name', 'pack', 'offset', 'length', 'archived_at']
+    list_filter = ['pack']
+    search_fields = ['name']
+    readonly_fields = ['name', 'pack', 'offset', 'length', 'crc32', 'archived_at']
+
+
+@admin.register(RevokedCertificate)
+class RevokedCertificateAdmin(admin.ModelAdmin):
+    list_display = ['membership_number', 'reason', 'revoked_at']
+    search_fields = ['membership_number']
+    readonly_fields = ['revoked_at']
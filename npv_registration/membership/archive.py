@@ -0,0 +1,226 @@
+# membership/archive.py
+"""
+Pack files for the certificates of cold members.
+
+Most certificates are downloaded once, if ever. ``archive_certificates``
+appends old ones to a few large pack files under
+``MEDIA_ROOT/certificate_archive/`` and deletes the individual files, which
+saves an inode, a directory entry and a backup file per member.
+
+Packs are append-only. Each record is a small header (name length, data
+length, CRC-32), the storage name and the file's bytes, so a pack is
+self-describing; ``ArchivedFile`` rows index the data offset of each name.
+A batch is fsynced and indexed before its source files are deleted, so an
+interrupted run at worst leaves unindexed bytes at the end of a pack.
+
+Downloads map packs read-only with ``mmap`` and stream the requested byte
+range without extracting the file. A certificate regenerated later is
+written to the certificate storage again, which takes precedence; archiving
+it again appends a new copy and repoints the index.
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+
+from .fileserving import ranged_response
+from .models import ArchivedFile
+from .storage import certificate_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: one archiving process at a time is up to the operator
+    fcntl = None
+
+ARCHIVE_DIR = 'certificate_archive'
+MAGIC = b'NPVPACK1'
+# Name length, data length, CRC-32 of the data
+RECORD = struct.Struct('>HII')
+PACK_RE = re.compile(r'^pack-(\d+)\.pack$')
+CHUNK_SIZE = 64 * 1024
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def archive_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'CERTIFICATE_ARCHIVE_DIR', ARCHIVE_DIR))
+
+
+def max_pack_size():
+    return getattr(settings, 'CERTIFICATE_ARCHIVE_PACK_SIZE', 1024 ** 3)
+
+
+def pack_name(number):
+    return f'pack-{number:05d}.pack'
+
+
+def pack_path(pack):
+    return os.path.join(archive_root(), pack)
+
+
+def list_packs():
+    """Pack names, oldest first"""
+    try:
+        names = os.listdir(archive_root())
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if PACK_RE.match(name))
+
+
+def pack_map(pack, end):
+    """Shared read-only mmap of ``pack`` covering at least its first ``end`` bytes"""
+    path = pack_path(pack)
+    with _maps_lock:
+        mapped = _maps.get(path)
+        if mapped is None or len(mapped) < end:
+            # New pack, or it has grown since it was mapped. A replaced map is
+            # closed once responses still streaming from it are done.
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[path] = mapped
+        return mapped
+
+
+def read_range(entry, start, length):
+    """Yield ``length`` bytes of an archived file from ``start``, in chunks"""
+    mapped = pack_map(entry.pack, entry.offset + entry.length)
+    position = entry.offset + start
+    end = position + length
+    while position < end:
+        chunk_end = min(position + CHUNK_SIZE, end)
+        yield mapped[position:chunk_end]
+        position = chunk_end
+
+
+async def aread_range(entry, start, length):
+    """Async ``read_range``; the data is already in memory (or the page cache)"""
+    for chunk in read_range(entry, start, length):
+        yield chunk
+
+
+def find(name):
+    """``ArchivedFile`` for a storage name, or None"""
+    return ArchivedFile.objects.filter(name=name).first()
+
+
+async def afind(name):
+    return await ArchivedFile.objects.filter(name=name).afirst()
+
+
+def serve_archived(request, entry, filename, content_type='application/octet-stream', asynchronous=False):
+    """Stream an archived file from its pack, honouring conditional and range requests"""
+    reader = aread_range if asynchronous else read_range
+
+    def body(start, length):
+        return reader(entry, start, length)
+
+    etag = f'"{entry.crc32:08x}-{entry.length:x}"'
+    return ranged_response(request, body, entry.length, etag, entry.archived_at.timestamp(), filename, content_type)
+
+
+@contextmanager
+def archive_lock():
+    """Exclusive lock on the archive directory, held while appending"""
+    os.makedirs(archive_root(), exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(archive_root(), '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PackWriter:
+    """Append records to the newest pack, starting a new one when it is full.
+
+    Only use it while holding ``archive_lock()``.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or max_pack_size()
+        packs = list_packs()
+        self.file = None
+        self.open(packs[-1] if packs else pack_name(1))
+
+    def open(self, pack):
+        if self.file is not None:
+            self.close()
+        self.pack = pack
+        self.file = open(pack_path(pack), 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def append(self, name, data):
+        """Write one file; returns its unsaved ``ArchivedFile``"""
+        encoded = name.encode()
+        size = RECORD.size + len(encoded) + len(data)
+        if self.file.tell() > len(MAGIC) and self.file.tell() + size > self.max_size:
+            number = int(PACK_RE.match(self.pack).group(1))
+            self.open(pack_name(number + 1))
+
+        crc = zlib.crc32(data)
+        self.file.write(RECORD.pack(len(encoded), len(data), crc))
+        self.file.write(encoded)
+        offset = self.file.tell()
+        self.file.write(data)
+        return ArchivedFile(name=name, pack=self.pack, offset=offset, length=len(data), crc32=crc)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+        self.file = None
+
+
+def archive_files(names, storage=None, batch_size=500):
+    """Move the named files from ``storage`` into packs.
+
+    Returns a ``Counter`` of ``archived`` and ``missing`` (not in storage:
+    never written, or archived already).
+    """
+    storage = storage or certificate_storage()
+    names = iter(names)
+    counts = Counter()
+
+    with archive_lock():
+        writer = PackWriter()
+        try:
+            while batch := list(islice(names, batch_size)):
+                entries, modified = [], {}
+                for name in batch:
+                    try:
+                        modified[name] = storage.get_modified_time(name)
+                        with storage.open(name) as f:
+                            data = f.read()
+                    except FileNotFoundError:
+                        counts['missing'] += 1
+                        continue
+                    entries.append(writer.append(name, data))
+
+                writer.sync()
+                ArchivedFile.objects.bulk_create(
+                    entries, update_conflicts=True, unique_fields=['name'],
+                    update_fields=['pack', 'offset', 'length', 'crc32', 'archived_at'],
+                )
+                for entry in entries:
+                    # Leave a certificate regenerated since it was read
+                    if storage.get_modified_time(entry.name) == modified[entry.name]:
+                        storage.delete(entry.name)
+                counts['archived'] += len(entries)
+        finally:
+            writer.close()
+    return counts
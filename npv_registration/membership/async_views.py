@@ -0,0 +1,117 @@
+# membership/async_views.py
+"""
+Native async versions of the public read endpoints, for ASGI servers.
+
+DRF views are synchronous, so under uvicorn/daphne every request to them
+holds a thread. These views use the async ORM and cache APIs and stream
+files with an async iterator, so a slow QR scan or download does not tie up
+a thread while it waits. They return plain JSON (no browsable API) and are
+mounted under ``/api/async/`` next to the sync views; WSGI deployments can
+serve them too.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.renderers import JSONRenderer
+
+from . import archive
+from .certificate_cache import CERTIFICATE_FIELDS, get_certificate_name, lazy_certificates
+from .certificate_generator import certificate_name
+from .fileserving import serve_storage_file
+from .models import Member
+from .offline_verifier import TOKEN_PARAM
+from .query_budget import query_budget
+from .serializers import MemberSerializer
+from .signing import get_signed_verification
+from .storage import certificate_storage
+from .verification import aget_verification
+
+
+async def storage_exists(storage, name):
+    """``storage.exists`` without blocking the event loop on remote storages"""
+    if isinstance(storage, FileSystemStorage):
+        return storage.exists(name)
+    return await sync_to_async(storage.exists, thread_sensitive=False)(name)
+
+
+async def serve_certificate(request, storage, name, filename):
+    """``serve_storage_file`` without blocking the event loop on the path lookup and ``stat``"""
+    return await sync_to_async(serve_storage_file, thread_sensitive=False)(
+        request, storage, name, filename, content_type='application/pdf', asynchronous=True)
+
+
+def not_found(message):
+    return JsonResponse({'success': False, 'message': message}, status=404)
+
+
+@require_GET
+@query_budget('verify')
+async def verify_member(request, membership_number):
+    """Verify membership by membership number, or offline from a signed QR token (``?t=``)"""
+    token = request.GET.get(TOKEN_PARAM)
+    signed = await sync_to_async(get_signed_verification)(membership_number, token) if token else None
+    status_code, body = signed or await aget_verification(membership_number)
+    return HttpResponse(body, status=status_code, content_type='application/json')
+
+
+@require_GET
+@query_budget('download_certificate')
+async def download_certificate(request, membership_number):
+    """Download certificate PDF"""
+    filename = f'NPV_Certificate_{membership_number}.pdf'
+
+    if lazy_certificates():
+        member = await Member.objects.filter(
+            membership_number=membership_number
+        ).only(*CERTIFICATE_FIELDS).afirst()
+
+        if member is None:
+            return not_found('Member not found')
+
+        # Rendering is CPU bound; keep it off the event loop
+        name = await sync_to_async(get_certificate_name, thread_sensitive=False)(member)
+        return await serve_certificate(request, certificate_storage(), name, filename)
+
+    storage = certificate_storage()
+    name = certificate_name(membership_number)
+    try:
+        found = await storage_exists(storage, name)
+    except SuspiciousFileOperation:
+        found = False
+
+    if not found:
+        entry = await archive.afind(name)
+        if entry is not None:
+            return archive.serve_archived(request, entry, filename, content_type='application/pdf', asynchronous=True)
+
+        member = await Member.objects.filter(
+            membership_number=membership_number
+        ).only('certificate').afirst()
+
+        if member is None:
+            return not_found('Member not found')
+
+        stored = member.certificate.name if member.certificate else None
+        if not stored or stored == name or not await storage_exists(storage, stored):
+            entry = await archive.afind(stored) if stored and stored != name else None
+            if entry is None:
+                return not_found('Certificate not found')
+            return archive.serve_archived(request, entry, filename, content_type='application/pdf', asynchronous=True)
+        name = stored
+
+    return await serve_certificate(request, storage, name, filename)
+
+
+@require_GET
+@query_budget('member_detail')
+async def member_detail(request, membership_number):
+    """Get member details"""
+    try:
+        member = await Member.objects.aget(membership_number=membership_number)
+    except Member.DoesNotExist:
+        return JsonResponse({'detail': 'No Member matches the given query.'}, status=404)
+
+    data = MemberSerializer(member, context={'request': request}).data
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json')
@@ -0,0 +1,122 @@
+# membership/batch.py
+"""
+Render certificates for many members at once across a process pool.
+
+ReportLab and QR encoding are CPU bound, so batches are fanned out to worker
+processes instead of threads. Workers only render and write files; all
+database writes happen in the parent with ``bulk_update``.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+
+from .certificate_generator import write_certificate_files
+from .models import Member
+
+
+def _init_worker():
+    # Needed when the pool uses the spawn/forkserver start methods
+    django.setup()
+
+
+def _render_member(member):
+    """Render one member's certificate in a worker process"""
+    try:
+        cert_path, qr_path = write_certificate_files(member)
+    except Exception as e:
+        return member.pk, None, None, str(e) or e.__class__.__name__
+    return member.pk, cert_path, qr_path, None
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _apply_results(members, results):
+    for member, (pk, cert_path, qr_path, error) in zip(members, results):
+        if not error:
+            member.certificate, member.qr_code = cert_path, qr_path
+        yield member, error
+
+
+class CertificateRenderPool:
+    """Process pool for rendering certificates, reusable across batches.
+
+    Use as a context manager. With ``max_workers=1`` everything is rendered
+    in the current process.
+    """
+
+    def __init__(self, max_workers=None, chunksize=8):
+        self.max_workers = max_workers or default_workers()
+        self.chunksize = chunksize
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Worker processes are forked on first use and must not inherit
+            # open database connections
+            connections.close_all()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+        return self._executor
+
+    def render(self, members):
+        """Render certificates for ``members``.
+
+        Yields ``(member, error)`` in input order, with ``member.certificate``
+        and ``member.qr_code`` set for successfully rendered members. Nothing
+        is saved; use ``save_certificate_paths`` on the results.
+        """
+        members = list(members)
+        if self.max_workers == 1 or len(members) <= 1:
+            results = map(_render_member, members)
+        else:
+            results = self._get_executor().map(_render_member, members, chunksize=self.chunksize)
+        yield from _apply_results(members, results)
+
+
+def render_certificates(members, max_workers=None):
+    """Render certificates for ``members`` with a one-off pool"""
+    with CertificateRenderPool(max_workers) as pool:
+        yield from pool.render(members)
+
+
+def save_certificate_paths(members, batch_size=500):
+    """Store rendered certificate and QR code paths with one UPDATE per batch"""
+    Member.objects.bulk_update(members, ['certificate', 'qr_code'], batch_size=batch_size)
+
+
+def regenerate_certificates(member_ids, pool, chunk_size=200, progress=None):
+    """Re-render certificates for the given members.
+
+    Members are loaded ``chunk_size`` at a time, rendered on ``pool`` and
+    saved with one ``bulk_update`` per chunk. ``progress`` is called after
+    every chunk with ``(rendered, errors)`` for that chunk, where ``errors``
+    is a list of ``(membership_number, message)``.
+    """
+    member_ids = list(member_ids)
+    for start in range(0, len(member_ids), chunk_size):
+        members = Member.objects.filter(pk__in=member_ids[start:start + chunk_size])
+
+        rendered, errors = [], []
+        for member, error in pool.render(members):
+            if error:
+                errors.append((member.membership_number, error))
+            else:
+                rendered.append(member)
+        save_certificate_paths(rendered)
+
+        if progress is not None:
+            progress(rendered, errors)
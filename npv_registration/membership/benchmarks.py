@@ -0,0 +1,780 @@
+# membership/benchmarks.py
+"""
+Benchmarks for the membership hot paths, run through ``manage.py benchmark``.
+
+Every benchmark runs against its own throwaway test database (created from
+the configured ``default`` database, so SQLite locally or Postgres through
+``DATABASE_URL``), a temporary MEDIA_ROOT and the locmem email backend, so
+it never touches real members or sends real mail. ``seed_members`` fills the
+table with deterministic synthetic members (10k to 1M with ``--rows``).
+
+Results can be written as JSON and compared against a stored baseline;
+``compare`` flags metrics that got worse by more than a tolerance. Metric
+names say which way is better: ``*_per_sec`` is higher-is-better, and
+``*_ms``, ``*_kb``, ``*_mb`` and ``*seconds`` are lower-is-better.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import re
+import resource
+import shutil
+import signal
+import socket
+import socketserver
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .certificate_generator import CertificateGenerator, certificate_name
+from .jobs import run_pending_jobs
+from .numbering import CATEGORY_PREFIXES, format_membership_number, parse_membership_number
+from .storage import certificate_storage
+from .verification import get_cache
+
+COUNTIES = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Kiambu', 'Machakos', 'Kakamega', 'Nyeri']
+CATEGORIES = ['Ordinary Membership', 'Bronze Membership', 'Life Membership',
+              'Associate Membership', 'Group Membership', 'Honorary Membership']
+# Synthetic members register one minute apart from here
+SEED_EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+# Metrics where lower is better; ``*_per_sec`` is higher-is-better and
+# anything else (counts, settings) is not compared
+LOWER_IS_BETTER_RE = re.compile(r'(_ms|_kb|_mb|seconds)(_|$)')
+
+
+@contextmanager
+def benchmark_environment():
+    """Swap in a test database, temporary MEDIA_ROOT and locmem email backend"""
+    media_root = tempfile.mkdtemp(prefix='npv-bench-')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ALLOWED_HOSTS=['*'],
+            # Budgets are enforced by the tests; here they would only add overhead
+            QUERY_BUDGET_MODE='off',
+        ):
+            yield
+    finally:
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Django never closes an in-memory SQLite database, so the next
+            # benchmark would see this one's rows
+            call_command('flush', interactive=False, verbosity=0)
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def member_payload(i):
+    """Registration form data for the i-th synthetic member"""
+    return {
+        'surname': f'Surname{i}',
+        'other_names': f'Other Names {i}',
+        'id_passport': f'ID{i:08d}',
+        'phone': f'+2547{i:08d}',
+        'email': f'member{i}@example.com',
+        'gender': ['Male', 'Female', 'Other'][i % 3],
+        'dob': date(1960 + i % 40, 1 + i % 12, 1 + i % 28).isoformat(),
+        'special_interest': ['None', 'Youth', 'Women', 'PWD'][i % 4],
+        'county': COUNTIES[i % len(COUNTIES)],
+        'constituency': f'Constituency {i % 50}',
+        'ward': f'Ward {i % 200}',
+        'membership_category': CATEGORIES[i % len(CATEGORIES)],
+    }
+
+
+def sample_member(i=1):
+    """Unsaved synthetic member; its number and registration date follow from ``i``"""
+    from .models import Member
+
+    data = member_payload(i)
+    data['dob'] = date.fromisoformat(data['dob'])
+    # Categories cycle with i, so each prefix gets its own dense sequence
+    number = format_membership_number(CATEGORY_PREFIXES[data['membership_category']],
+                                      (i - 1) // len(CATEGORIES) + 1)
+    return Member(membership_number=number, registration_date=SEED_EPOCH + timedelta(minutes=i), **data)
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS to the current RSS, where the kernel allows it (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _rate(func, count):
+    """Calls per second of ``func`` over ``count`` calls"""
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - started)
+
+
+def bench_certificate(count=50):
+    """Certificates (PDF plus QR PNG) rendered per second by rendering mode"""
+    member = sample_member()
+    modes = {
+        'redraw_png': {'CERTIFICATE_TEMPLATE_CACHE': False, 'CERTIFICATE_QR_VECTOR': False},
+        'template_png': {'CERTIFICATE_TEMPLATE_CACHE': True, 'CERTIFICATE_QR_VECTOR': False},
+        'template_vector': {'CERTIFICATE_TEMPLATE_CACHE': True, 'CERTIFICATE_QR_VECTOR': True},
+    }
+    results = {}
+    for mode, options in modes.items():
+        with override_settings(**options):
+            render = lambda: CertificateGenerator(member).render()
+            render()  # warm up / compile the template
+            _reset_peak_rss()
+            results[mode] = {
+                'certificates': count,
+                'certs_per_sec': _rate(render, count),
+                'peak_rss_mb': _peak_rss_mb(),
+            }
+    return results
+
+
+def _register(client, start, count):
+    """POST ``count`` registrations and return the elapsed seconds"""
+    started = time.perf_counter()
+    for i in range(start, start + count):
+        response = client.post('/api/register/', member_payload(i), format='json')
+        if response.status_code not in (201, 202):
+            raise RuntimeError(f'Registration failed: {response.status_code} {response.data}')
+    return time.perf_counter() - started
+
+
+def bench_registration(count=50):
+    """Registration throughput with certificates rendered inline vs. queued"""
+    client = APIClient()
+    results = {}
+
+    with override_settings(CERTIFICATE_ASYNC=False):
+        elapsed = _register(client, 0, count)
+    results['sync'] = {
+        'requests': count,
+        'seconds': elapsed,
+        'requests_per_sec': count / elapsed,
+    }
+
+    with override_settings(CERTIFICATE_ASYNC=True):
+        elapsed = _register(client, count, count)
+        started = time.perf_counter()
+        while run_pending_jobs(batch_size=50):
+            pass
+        drained = time.perf_counter() - started
+    results['queued'] = {
+        'requests': count,
+        'seconds': elapsed,
+        'requests_per_sec': count / elapsed,
+        'worker_seconds': drained,
+        'worker_jobs_per_sec': count / drained,
+    }
+
+    return results
+
+
+def bench_download(count=50, file_size=2 * 1024 * 1024):
+    """Peak memory while downloading a certificate at growing concurrency.
+
+    Uses an oversized synthetic certificate so that buffering the whole file
+    per request would show up clearly in the traced peak.
+    """
+    membership_number = 'NPV/OM-001'
+    certificate_storage().save(certificate_name(membership_number), ContentFile(os.urandom(file_size)))
+    url = f'/api/certificate/{membership_number}/'
+
+    def download(requests):
+        client = Client()
+        for _ in range(requests):
+            response = client.get(url)
+            received = sum(len(chunk) for chunk in response.streaming_content)
+            response.close()
+            if received != file_size:
+                raise RuntimeError(f'Short download: {received} bytes')
+
+    results = {}
+    for concurrency in (1, 8, 32):
+        per_thread = max(count // concurrency, 1)
+        tracemalloc.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(download, [per_thread] * concurrency))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[f'concurrency_{concurrency}'] = {
+            'requests': per_thread * concurrency,
+            'requests_per_sec': per_thread * concurrency / elapsed,
+            'peak_kb': peak / 1024,
+            'peak_kb_per_concurrent_request': peak / 1024 / concurrency,
+        }
+    return results
+
+
+def _percentile(samples, pct):
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def _paced(func, count, rps):
+    """Call ``func`` ``count`` times at a fixed rate; return latencies in ms"""
+    interval = 1 / rps
+    latencies = []
+    next_at = time.perf_counter()
+    for _ in range(count):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+        next_at += interval
+    return latencies
+
+
+def bench_verify(count=1000, rps=500, members=200):
+    """p50/p99 latency of verify_member at a fixed request rate, cached vs. uncached"""
+    from .models import Member
+
+    seed_members(members)
+    numbers = list(Member.objects.values_list('membership_number', flat=True))
+    # One unknown number in ten, as from damaged or forged QR codes
+    numbers += [f'NPV/XX-{i:03d}' for i in range(len(numbers) // 10)]
+    client = Client()
+    cycle = itertools.cycle(numbers)
+
+    def verify():
+        number = next(cycle)
+        response = client.get(f'/api/verify/{number}/', HTTP_ACCEPT='application/json')
+        if response.status_code not in (200, 404):
+            raise RuntimeError(f'Verification failed: {response.status_code}')
+
+    modes = {
+        'uncached': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'cached': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                   'LOCATION': 'bench-verify'},
+    }
+    results = {}
+    # Unknown numbers would log a "Not Found" warning per request
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for mode, backend in modes.items():
+            caches = dict(settings.CACHES, verify=backend)
+            with override_settings(CACHES=caches, VERIFY_CACHE_ALIAS='verify'):
+                get_cache().clear()
+                for _ in numbers:
+                    verify()  # warm up
+                latencies = _paced(verify, count, rps)
+            results[mode] = {
+                'requests': count,
+                'target_rps': rps,
+                'p50_ms': _percentile(latencies, 50),
+                'p99_ms': _percentile(latencies, 99),
+            }
+    finally:
+        request_logger.setLevel(level)
+    return results
+
+
+def seed_members(rows, start=1, batch_size=5000):
+    """Bulk insert ``rows`` synthetic members numbered from ``start``.
+
+    Registration dates are kept (``auto_now_add`` would stamp them all with
+    the current time) and the number counters are moved past the seeded
+    numbers, so registrations afterwards do not collide with them.
+    """
+    from .models import Member, MembershipCounter
+
+    end = start + rows
+    field = Member._meta.get_field('registration_date')
+    field.auto_now_add = False
+    try:
+        for first in range(start, end, batch_size):
+            last = min(first + batch_size, end)
+            Member.objects.bulk_create([sample_member(i) for i in range(first, last)], batch_size=batch_size)
+    finally:
+        field.auto_now_add = True
+
+    # The last member of each category holds its highest number
+    for i in range(max(start, end - len(CATEGORIES)), end):
+        prefix, highest = parse_membership_number(sample_member(i).membership_number)
+        counter, _ = MembershipCounter.objects.get_or_create(category=prefix)
+        MembershipCounter.objects.filter(pk=counter.pk, last_number__lt=highest).update(last_number=highest)
+
+
+def bench_numbering(count=200, rows=1_000_000):
+    """Membership numbers allocated per second as the member table grows,
+    and the one-off cost of rebuilding a missing counter from the table"""
+    from .models import Member, MembershipCounter
+
+    sizes = [size for size in (10_000, 100_000, 1_000_000) if size < rows] + [rows]
+    member = Member(membership_category='Ordinary Membership')
+    results = {}
+    seeded = 0
+    for size in sizes:
+        seed_members(size - seeded, start=seeded + 1)
+        seeded = size
+
+        numbers_per_sec = _rate(member.generate_membership_number, count)
+        MembershipCounter.objects.filter(category='OM').delete()
+        started = time.perf_counter()
+        member.generate_membership_number()
+        rebuild = time.perf_counter() - started
+        results[f'members_{size}'] = {
+            'members': size,
+            'numbers_per_sec': numbers_per_sec,
+            'counter_rebuild_ms': rebuild * 1000,
+        }
+    return results
+
+
+def bench_list(count=20, rows=1_000_000):
+    """Member list page latency at increasing depth, keyset cursor vs. OFFSET"""
+    from .filters import LIST_FIELDS
+    from .models import Member
+    from .pagination import encode_cursor
+    from .serializers import MemberListSerializer
+
+    seed_members(rows)
+    page_size = 50
+    members = Member.objects.only(*LIST_FIELDS).order_by('-registration_date', '-pk')
+    client = Client()
+
+    def offset_page(offset):
+        return MemberListSerializer(members[offset:offset + page_size], many=True).data
+
+    results = {}
+    for fraction in (0, 0.1, 0.5, 0.9, 0.999):
+        depth = int((rows - page_size) * fraction)
+        url = f'/api/members/?page_size={page_size}'
+        if depth:
+            registration_date, pk = members.values_list('registration_date', 'pk')[depth - 1]
+            url += f'&cursor={encode_cursor(registration_date.isoformat(), pk)}'
+
+        keyset = _paced(lambda: client.get(url), count, rps=1000)
+        offset = _paced(lambda: offset_page(depth), count, rps=1000)
+        results[f'depth_{depth}'] = {
+            'keyset_p50_ms': _percentile(keyset, 50),
+            'keyset_p99_ms': _percentile(keyset, 99),
+            'offset_p50_ms': _percentile(offset, 50),
+        }
+    return results
+
+
+def bench_export(count=1, rows=100_000):
+    """Peak memory and rows/sec of a streamed export as the table grows.
+
+    ``count`` is the number of exports per table size.
+    """
+    from .exporters import available_formats, export_members
+    from .models import Member
+
+    results = {}
+    seeded = 0
+    for size in (rows // 10, rows):
+        seed_members(size - seeded, start=seeded + 1)
+        seeded = size
+        for file_format in available_formats():
+            tracemalloc.start()
+            started = time.perf_counter()
+            for _ in range(count):
+                written = sum(len(chunk) for chunk in export_members(Member.objects.all(), file_format))
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[f'{file_format}_{size}'] = {
+                'rows': size,
+                'rows_per_sec': size * count / elapsed,
+                'mb_written': written / 1024 / 1024,
+                'peak_kb': peak / 1024,
+            }
+    return results
+
+
+def bench_stats(count=20, rows=1_000_000):
+    """Dashboard stats from the MemberStat rollup vs. live GROUP BY queries"""
+    from .stats import get_stats, live_counts, reconcile
+
+    seed_members(rows)
+    reconcile()  # bulk_create in seed_members bypasses the signals
+
+    results = {}
+    for mode, read in (('rollup', get_stats), ('live', live_counts)):
+        latencies = _paced(read, count, rps=1000)
+        results[mode] = {
+            'members': rows,
+            'p50_ms': _percentile(latencies, 50),
+            'p99_ms': _percentile(latencies, 99),
+        }
+    return results
+
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept and discard messages"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost benchmark sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.received += 1
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@contextmanager
+def smtp_sink():
+    """Local SMTP server on a free port; yields the server (``.received``)"""
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPSinkHandler)
+    server.daemon_threads = True
+    server.received = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_email(count=200):
+    """Certificate emails per second to a local SMTP server: one connection
+    per message (the old send() path) vs. the outbox sender"""
+    from .emails import certificate_email
+    from .models import EmailOutbox, Member
+    from .outbox import OutboxSender, RateLimiter, queue_certificate_email
+
+    seed_members(count)
+    members = list(Member.objects.order_by('pk'))
+    pdf = CertificateGenerator(members[0]).render_pdf()
+
+    results = {}
+    with smtp_sink() as server, override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+        EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+    ):
+        started = time.perf_counter()
+        for member in members:
+            certificate_email(member, pdf).send(fail_silently=False)
+        elapsed = time.perf_counter() - started
+        results['connection_per_message'] = {'messages': count, 'messages_per_sec': count / elapsed}
+
+        started = time.perf_counter()
+        for member in members:
+            queue_certificate_email(member, pdf)
+        queued = time.perf_counter() - started
+
+        received = server.received
+        started = time.perf_counter()
+        with OutboxSender('benchmark', rate_limiter=RateLimiter({})) as sender:
+            while any(sender.send_pending(100)):
+                pass
+        elapsed = time.perf_counter() - started
+        if server.received - received != count:
+            raise RuntimeError(f'Sink received {server.received - received} of {count} messages')
+        results['outbox'] = {
+            'messages': EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENT).count(),
+            'queue_per_sec': count / queued,
+            'messages_per_sec': count / elapsed,
+        }
+    return results
+
+
+def _server_database():
+    """Database NAME a server subprocess can open: the test database, or a
+    file copy of it when SQLite runs the tests in memory"""
+    if connection.vendor != 'sqlite' or not connection.is_in_memory_db():
+        return connection.settings_dict['NAME']
+    connection.ensure_connection()
+    fd, path = tempfile.mkstemp(prefix='npv-bench-', suffix='.sqlite3')
+    os.close(fd)
+    target = sqlite3.connect(path)
+    connection.connection.backup(target)
+    target.close()
+    return path
+
+
+@contextmanager
+def gunicorn_server(worker_class, database, workers=4):
+    """Run ``manage.py benchmark_server`` on a free port; yields the port"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_server',
+        '--worker-class', worker_class, '--workers', str(workers),
+        '--bind', f'127.0.0.1:{port}', '--database', str(database),
+        '--media-root', str(settings.MEDIA_ROOT),
+    ], start_new_session=True)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'{worker_class} server exited with {process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'{worker_class} server did not start')
+                time.sleep(0.2)
+        yield port
+    finally:
+        # SIGINT is gunicorn's quick shutdown (SIGTERM logs every worker)
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            pass
+        # Workers can outlive the master; they share its process group
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+class _HTTPClient:
+    """Minimal HTTP/1.1 client; keeps the connection open when the server allows"""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """GET ``path``; returns the status code"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            self.writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: application/json\r\n\r\n'.encode())
+            head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+            headers = dict(line.split(': ', 1) for line in head.split('\r\n')[1:] if ': ' in line)
+            if 'content-length' in headers:
+                await self.reader.readexactly(int(headers['content-length']))
+            else:
+                await self.reader.read()
+            if 'content-length' not in headers or headers.get('connection') == 'close':
+                self.close()
+        except BaseException:
+            self.close()
+            raise
+        return int(head[9:12])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def _load(port, paths, requests, concurrency, timeout=30):
+    pending = itertools.islice(itertools.cycle(paths), requests)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        http = _HTTPClient(port)
+        for path in pending:
+            started = time.perf_counter()
+            try:
+                status_code = await asyncio.wait_for(http.get(path), timeout)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                status_code = None
+            if status_code != 200:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+        http.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'errors': errors,
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 50) if len(latencies) > 1 else 0.0,
+        'p99_ms': _percentile(latencies, 99) if len(latencies) > 1 else 0.0,
+    }
+
+
+def bench_asgi(count=2000, concurrency=256, workers=4, members=200, file_size=64 * 1024):
+    """Throughput and latency of the read endpoints at high concurrency:
+    gunicorn sync and gthread workers vs. uvicorn workers, the latter
+    serving both the sync (DRF) views and the async views.
+
+    Each mode runs ``manage.py benchmark_server`` as a subprocess with the
+    same number of workers against a copy of the benchmark database.
+    """
+    from .models import Member
+
+    seed_members(members)
+    numbers = list(Member.objects.values_list('membership_number', flat=True))
+    for number in numbers:
+        certificate_storage().save(certificate_name(number), ContentFile(os.urandom(file_size)))
+
+    endpoints = {
+        'verify': ('/api/verify/{}/', '/api/async/verify/{}/'),
+        'detail': ('/api/members/{}/', '/api/async/members/{}/'),
+        'certificate': ('/api/certificate/{}/', '/api/async/certificate/{}/'),
+    }
+    modes = [
+        ('gunicorn_sync', 'sync', False),
+        ('gunicorn_gthread', 'gthread', False),
+        ('uvicorn_sync_views', 'uvicorn', False),
+        ('uvicorn_async_views', 'uvicorn', True),
+    ]
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        modes = [mode for mode in modes if mode[1] != 'uvicorn']
+
+    database = _server_database()
+    results = {}
+    try:
+        for mode, worker_class, use_async in modes:
+            with gunicorn_server(worker_class, database, workers) as port:
+                for endpoint, urls in endpoints.items():
+                    paths = [urls[use_async].format(number) for number in numbers]
+                    # Warm every worker (imports, URL resolver, caches)
+                    asyncio.run(_load(port, paths, len(paths) * workers, concurrency))
+                    results[f'{mode}_{endpoint}'] = asyncio.run(_load(port, paths, count, concurrency))
+    finally:
+        if database != connection.settings_dict['NAME']:
+            os.remove(database)
+    return results
+
+
+def bench_verify_batch(count=2000, batch_sizes=(10, 100, 500), workers=1):
+    """Lookups/sec from one scanning station: a GET per scan vs. batched
+    POSTs to /api/verify/batch/, over a keep-alive connection to a gunicorn
+    server started afresh for each mode so every lookup misses the cache.
+    """
+    from .client import VerificationClient
+    from .models import Member
+
+    seed_members(count - count // 10)
+    numbers = list(Member.objects.values_list('membership_number', flat=True))
+    # One unknown number in ten, as from damaged or forged QR codes
+    numbers += [f'NPV/XX-{i:03d}' for i in range(count - len(numbers))]
+
+    modes = {'per_item_get': None, **{f'batch_{size}': size for size in batch_sizes}}
+    database = _server_database()
+    results = {}
+    try:
+        for mode, batch_size in modes.items():
+            with gunicorn_server('sync', database, workers) as port:
+                client = VerificationClient(f'http://127.0.0.1:{port}', batch_size=batch_size or 1)
+                client.verify('NPV/XX-WARMUP')
+                started = time.perf_counter()
+                if batch_size is None:
+                    verified = [client.verify(number) for number in numbers]
+                else:
+                    verified = client.verify_many(numbers)
+                elapsed = time.perf_counter() - started
+                client.close()
+            results[mode] = {
+                'lookups': len(numbers),
+                'requests': len(numbers) if batch_size is None else -(-len(numbers) // batch_size),
+                'verified': sum(result['verified'] for result in verified),
+                'lookups_per_sec': len(numbers) / elapsed,
+            }
+    finally:
+        if database != connection.settings_dict['NAME']:
+            os.remove(database)
+    return results
+
+
+BENCHMARKS = {
+    'asgi': bench_asgi,
+    'certificate': bench_certificate,
+    'download': bench_download,
+    'email': bench_email,
+    'export': bench_export,
+    'list': bench_list,
+    'numbering': bench_numbering,
+    'registration': bench_registration,
+    'stats': bench_stats,
+    'verify': bench_verify,
+    'verify_batch': bench_verify_batch,
+}
+
+
+def metric_direction(name):
+    """1 if higher is better, -1 if lower is better, 0 if not compared"""
+    if name.endswith('_per_sec'):
+        return 1
+    if LOWER_IS_BETTER_RE.search(name):
+        return -1
+    return 0
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare ``{benchmark: {mode: {metric: value}}}`` against a baseline.
+
+    Yields ``(benchmark, mode, metric, old, new, change, regressed)`` for
+    every metric present in both, where ``change`` is the relative change
+    and ``regressed`` means it got worse by more than ``tolerance``.
+    """
+    for benchmark, modes in results.items():
+        for mode, metrics in modes.items():
+            old_metrics = baseline.get(benchmark, {}).get(mode, {})
+            for metric, new in metrics.items():
+                direction = metric_direction(metric)
+                old = old_metrics.get(metric)
+                if not direction or not isinstance(old, (int, float)) or not old:
+                    continue
+                change = (new - old) / old
+                yield benchmark, mode, metric, old, new, change, change * direction < -tolerance
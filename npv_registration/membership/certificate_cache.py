@@ -0,0 +1,178 @@
+# membership/certificate_cache.py
+"""
+Lazily rendered certificates in a content-addressed, size-bounded cache.
+
+With ``CERTIFICATE_RENDER_MODE = 'lazy'`` certificates are not written at
+registration time. The first download renders the PDF into
+``certificate_storage()`` as ``certificate_cache/<hash>.pdf``, where the hash
+covers the fields printed on it plus the template version, so editing a
+member or the artwork simply produces a new entry. Concurrent requests for
+the same certificate in one process, or in processes sharing
+``CERTIFICATE_CACHE_LOCK_DIR``, render it once: renders take one of a fixed
+set of ``LOCK_STRIPES`` lock files, picked by the hash.
+
+On storages with local files the least recently used entries are evicted
+when the cache grows past ``CERTIFICATE_CACHE_MAX_BYTES``. Remote storages
+(S3) keep every entry; expire the ``certificate_cache/`` prefix with a bucket
+lifecycle rule instead.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from .certificate_generator import CertificateGenerator
+from .storage import certificate_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight within a process only
+    fcntl = None
+
+# Member fields printed on the certificate
+CERTIFICATE_FIELDS = ('surname', 'other_names', 'membership_category', 'membership_number',
+                      'registration_date', 'ward', 'constituency', 'county')
+
+CACHE_DIR = 'certificate_cache'
+LOCK_STRIPES = 64
+
+_stripe_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_eviction_lock = threading.Lock()
+_writes_since_eviction = 0
+
+
+def lazy_certificates():
+    return getattr(settings, 'CERTIFICATE_RENDER_MODE', 'eager') == 'lazy'
+
+
+def lock_dir():
+    return (getattr(settings, 'CERTIFICATE_CACHE_LOCK_DIR', None)
+            or os.path.join(tempfile.gettempdir(), 'npv-certificate-cache'))
+
+
+def content_key(member):
+    """Hash of everything that affects the rendered PDF"""
+    digest = hashlib.sha256()
+    parts = [str(getattr(member, field)) for field in CERTIFICATE_FIELDS]
+    parts += [
+        str(getattr(settings, 'CERTIFICATE_TEMPLATE_VERSION', '1')),
+        str(getattr(settings, 'CERTIFICATE_QR_VECTOR', True)),
+        str(getattr(settings, 'CERTIFICATE_QR_VERSION', None)),
+        str(getattr(settings, 'QR_SIGNING_KEY_ID', None)),
+    ]
+    digest.update('\x1f'.join(parts).encode())
+    return digest.hexdigest()
+
+
+def cache_name(key):
+    """Storage name of a cache entry"""
+    return f'{CACHE_DIR}/{key}.pdf'
+
+
+@contextmanager
+def _single_flight(key):
+    """Serialise renders of one cache entry across threads and processes"""
+    stripe = int(key[:8], 16) % LOCK_STRIPES
+    with _stripe_locks[stripe]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(lock_dir(), exist_ok=True)
+        with open(os.path.join(lock_dir(), f'{stripe}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _touch(storage, name):
+    """Record an access for LRU eviction without changing mtime (used for ETags)"""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        return
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except FileNotFoundError:
+        pass
+
+
+def get_certificate_name(member):
+    """Storage name of the member's cached certificate, rendering it if needed"""
+    global _writes_since_eviction
+
+    key = content_key(member)
+    name = cache_name(key)
+    storage = certificate_storage()
+    if storage.exists(name):
+        _touch(storage, name)
+        return name
+
+    with _single_flight(key):
+        # Another request may have rendered it while we waited
+        if storage.exists(name):
+            return name
+        name = storage.save(name, ContentFile(CertificateGenerator(member).render_pdf()))
+
+    with _eviction_lock:
+        _writes_since_eviction += 1
+        due = _writes_since_eviction >= getattr(settings, 'CERTIFICATE_CACHE_EVICT_INTERVAL', 100)
+        if due:
+            _writes_since_eviction = 0
+    if due:
+        evict()
+    return name
+
+
+def evict(max_bytes=None):
+    """Delete least recently used entries until the cache fits in ``max_bytes``.
+
+    Trims down to 90% of the limit so eviction does not run on every write.
+    Only storages keeping files on local disk are trimmed. Returns the
+    number of files removed.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'CERTIFICATE_CACHE_MAX_BYTES', 1024 ** 3)
+
+    storage = certificate_storage()
+    if not isinstance(storage, FileSystemStorage):
+        return 0
+
+    entries = []
+    total = 0
+    # Sharded names keep their top-level folder, so every entry is below here
+    for directory, _, files in os.walk(os.path.join(storage.location, CACHE_DIR)):
+        for filename in files:
+            if not filename.endswith('.pdf'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    target = max_bytes * 0.9
+    for atime, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -5,84 +5,229 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.colors import HexColor, black, gold
 from reportlab.lib.utils import ImageReader
 import qrcode
+import re
+from qrcode.exceptions import DataOverflowError
+from dataclasses import dataclass
 from io import BytesIO
 from datetime import datetime
-import os
 from django.conf import settings
+from django.core.files.base import ContentFile
+from .metrics import stage
+from .signing import signed_url
+from .storage import certificate_storage
+
+
+def draw_artwork(c, width, height):
+    """Draw the artwork shared by every certificate"""
+    # Colors
+    gold_color = HexColor('#FFD700')
+    dark_blue = HexColor('#003366')
+
+    # Draw border
+    c.setStrokeColor(gold_color)
+    c.setLineWidth(3)
+    c.rect(0.5 * inch, 0.5 * inch, width - 1 * inch, height - 1 * inch)
+
+    c.setLineWidth(1)
+    c.rect(0.6 * inch, 0.6 * inch, width - 1.2 * inch, height - 1.2 * inch)
+
+    # Title
+    c.setFont("Helvetica-Bold", 32)
+    c.setFillColor(dark_blue)
+    c.drawCentredString(width / 2, height - 1.5 * inch,
+                        "NATIONAL PEOPLE'S VOICE")
+
+    c.setFont("Helvetica", 18)
+    c.drawCentredString(width / 2, height - 1.9 * inch,
+                        '"Our Voice, Our Strength"')
+
+    # Certificate of Membership
+    c.setFont("Helvetica-Bold", 24)
+    c.setFillColor(gold_color)
+    c.drawCentredString(width / 2, height - 2.6 * inch,
+                        "CERTIFICATE OF MEMBERSHIP")
+
+    # Decorative line
+    c.setStrokeColor(gold_color)
+    c.setLineWidth(2)
+    c.line(width / 2 - 3 * inch, height - 2.8 * inch,
+           width / 2 + 3 * inch, height - 2.8 * inch)
+
+    # This certifies that
+    c.setFont("Helvetica", 14)
+    c.setFillColor(black)
+    c.drawCentredString(width / 2, height - 3.3 * inch,
+                        "This is to certify that")
+
+    # Membership details
+    c.setFont("Helvetica", 12)
+    details_y = height - 4.5 * inch
+    c.drawCentredString(width / 2, details_y,
+                        f"is a registered member of the National People's Voice Party")
+
+    # QR Code label
+    qr_size = 1.2 * inch
+    c.setFont("Helvetica", 8)
+    c.drawCentredString(1 * inch + qr_size / 2, 0.8 * inch,
+                        "Scan to Verify")
+
+    # Signature section
+    sig_y = 1.5 * inch
+    c.setStrokeColor(gold_color)
+    c.setLineWidth(1)
+
+    # Left signature
+    c.setFont("Helvetica", 10)
+    c.line(width - 5 * inch, sig_y, width - 3 * inch, sig_y)
+    c.drawCentredString(width - 4 * inch, sig_y - 0.2 * inch,
+                        "Party Leader")
+
+    # Right signature
+    c.line(width - 2.5 * inch, sig_y, width - 0.5 * inch, sig_y)
+    c.drawCentredString(width - 1.5 * inch, sig_y - 0.2 * inch,
+                        "Secretary General")
+
+    # Footer
+    c.setFont("Helvetica", 8)
+    c.setFillColor(HexColor('#666666'))
+    c.drawCentredString(width / 2, 0.7 * inch,
+                        "National People's Voice Party | www.npv.co.ke | nationalpeoplesvoice@gmail.com")
+
+
+@dataclass
+class CertificateResult:
+    """Output of a single certificate render pass"""
+    membership_number: str
+    pdf: bytes
+    qr_png: bytes
+    verification_url: str
+    qr_version: int
+    template_version: str
+
+
+_templates = {}
+FONT_RESOURCE_RE = re.compile(r'/F\d+\b')
+
+
+class CertificateTemplate:
+    """
+    The static certificate artwork, compiled once per process.
+
+    The artwork is drawn once on a scratch canvas and its content-stream
+    operators are kept. ``draw`` copies them into a form XObject the first
+    time a canvas uses it, renaming fonts to that document's resources, and
+    places the form on the page. Certificates therefore reuse the compiled
+    operators instead of re-running the drawing calls.
+    """
+
+    def __init__(self, width, height, version):
+        self.width, self.height = width, height
+        self.name = 'CertificateArtwork' + re.sub(r'\W', '_', version)
+        scratch = canvas.Canvas(BytesIO(), pagesize=(width, height))
+        draw_artwork(scratch, width, height)
+        self.code = '\n'.join(scratch._code)
+        # Font resource names are assigned per document
+        self.fonts = {internal: font for font, internal in scratch._doc.fontMapping.items()}
+
+    def draw(self, c):
+        if not c.hasForm(self.name):
+            names = {internal: c._doc.getInternalFontName(font) for internal, font in self.fonts.items()}
+            c.beginForm(self.name, 0, 0, self.width, self.height)
+            c._code.append(FONT_RESOURCE_RE.sub(lambda match: names[match.group()], self.code))
+            c.endForm()
+        c.doForm(self.name)
+
+
+def get_template(width, height):
+    """Template for the current CERTIFICATE_TEMPLATE_VERSION, cached per process"""
+    version = str(getattr(settings, 'CERTIFICATE_TEMPLATE_VERSION', '1'))
+    key = (version, width, height)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = CertificateTemplate(width, height, version)
+    return template
 
 
 class CertificateGenerator:
     def __init__(self, member):
         self.member = member
         self.width, self.height = landscape(A4)
+        self._qr = None
+        self._qr_png = None
+
+    @property
+    def verification_url(self):
+        # Carries a signed token when QR_SIGNING_KEY_ID is set
+        return signed_url(f"https://npv.co.ke/verify/{self.member.membership_number}", self.member)
+
+    def build_qr(self):
+        """Encode the verification URL once; reused by the PNG and the PDF"""
+        if self._qr is None:
+            version = getattr(settings, 'CERTIFICATE_QR_VERSION', None)
+            qr = qrcode.QRCode(
+                version=version or 1,
+                error_correction=qrcode.constants.ERROR_CORRECT_L,
+                box_size=10,
+                border=4,
+                mask_pattern=getattr(settings, 'CERTIFICATE_QR_MASK_PATTERN', None),
+            )
+            with stage('qr_encode'):
+                qr.add_data(self.verification_url)
+                try:
+                    # A fixed version skips the best-fit search
+                    qr.make(fit=not version)
+                except DataOverflowError:
+                    qr.version = None
+                    qr.make(fit=True)
+            self._qr = qr
+        return self._qr
+
+    def qr_png(self):
+        """QR code as PNG bytes, encoded at most once per generator"""
+        if self._qr_png is None:
+            qr = self.build_qr()
+            with stage('qr_png'):
+                img = qr.make_image(fill_color="black", back_color="white")
+                buffer = BytesIO()
+                img.save(buffer, format='PNG')
+            self._qr_png = buffer.getvalue()
+        return self._qr_png
 
     def generate_qr_code(self):
         """Generate QR code for verification"""
-        verification_url = f"https://npv.co.ke/verify/{self.member.membership_number}"
-
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(verification_url)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        # Save to BytesIO
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-
-        return buffer
-
-    def create_certificate(self):
-        """Create the membership certificate PDF"""
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=landscape(A4))
+        return BytesIO(self.qr_png())
+
+    def draw_qr(self, c, x, y, size):
+        """Draw the QR code, as vector modules or as the embedded PNG"""
+        if not getattr(settings, 'CERTIFICATE_QR_VECTOR', True):
+            c.drawImage(ImageReader(self.generate_qr_code()), x, y, size, size)
+            return
+
+        matrix = self.build_qr().get_matrix()
+        module = size / len(matrix)
+        path = c.beginPath()
+        for row, modules in enumerate(matrix):
+            top = y + size - (row + 1) * module
+            col = 0
+            # One rectangle per horizontal run of dark modules
+            while col < len(modules):
+                if not modules[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < len(modules) and modules[col]:
+                    col += 1
+                path.rect(x + start * module, top, (col - start) * module, module)
+        c.saveState()
+        c.setFillColor(black)
+        c.drawPath(path, stroke=0, fill=1)
+        c.restoreState()
 
-        # Colors
+    def draw_member(self, c):
+        """Draw the fields that differ between members"""
         gold_color = HexColor('#FFD700')
         dark_blue = HexColor('#003366')
 
-        # Draw border
-        c.setStrokeColor(gold_color)
-        c.setLineWidth(3)
-        c.rect(0.5 * inch, 0.5 * inch, self.width - 1 * inch, self.height - 1 * inch)
-
-        c.setLineWidth(1)
-        c.rect(0.6 * inch, 0.6 * inch, self.width - 1.2 * inch, self.height - 1.2 * inch)
-
-        # Title
-        c.setFont("Helvetica-Bold", 32)
-        c.setFillColor(dark_blue)
-        c.drawCentredString(self.width / 2, self.height - 1.5 * inch,
-                            "NATIONAL PEOPLE'S VOICE")
-
-        c.setFont("Helvetica", 18)
-        c.drawCentredString(self.width / 2, self.height - 1.9 * inch,
-                            '"Our Voice, Our Strength"')
-
-        # Certificate of Membership
-        c.setFont("Helvetica-Bold", 24)
-        c.setFillColor(gold_color)
-        c.drawCentredString(self.width / 2, self.height - 2.6 * inch,
-                            "CERTIFICATE OF MEMBERSHIP")
-
-        # Decorative line
-        c.setStrokeColor(gold_color)
-        c.setLineWidth(2)
-        c.line(self.width / 2 - 3 * inch, self.height - 2.8 * inch,
-               self.width / 2 + 3 * inch, self.height - 2.8 * inch)
-
-        # This certifies that
-        c.setFont("Helvetica", 14)
-        c.setFillColor(black)
-        c.drawCentredString(self.width / 2, self.height - 3.3 * inch,
-                            "This is to certify that")
-
         # Member Name
         c.setFont("Helvetica-Bold", 28)
         c.setFillColor(dark_blue)
@@ -101,9 +246,6 @@ class CertificateGenerator:
         c.setFillColor(black)
 
         details_y = self.height - 4.5 * inch
-        c.drawCentredString(self.width / 2, details_y,
-                            f"is a registered member of the National People's Voice Party")
-
         c.drawCentredString(self.width / 2, details_y - 0.3 * inch,
                             f"under {self.member.membership_category}")
 
@@ -125,54 +267,77 @@ class CertificateGenerator:
         c.drawCentredString(self.width / 2, details_y - 1.4 * inch,
                             f"Location: {location}")
 
-        # Generate and add QR code
-        qr_buffer = self.generate_qr_code()
-        qr_image = ImageReader(qr_buffer)
+        # Add QR code
         qr_size = 1.2 * inch
-        c.drawImage(qr_image, 1 * inch, 1 * inch, qr_size, qr_size)
-
-        # QR Code label
-        c.setFont("Helvetica", 8)
-        c.drawCentredString(1 * inch + qr_size / 2, 0.8 * inch,
-                            "Scan to Verify")
+        self.draw_qr(c, 1 * inch, 1 * inch, qr_size)
 
-        # Signature section
-        sig_y = 1.5 * inch
+    def render_pdf(self):
+        """Render the certificate PDF and return its bytes"""
+        buffer = BytesIO()
+        with stage('pdf_render'):
+            c = canvas.Canvas(buffer, pagesize=landscape(A4))
 
-        # Left signature
-        c.setFont("Helvetica", 10)
-        c.line(self.width - 5 * inch, sig_y, self.width - 3 * inch, sig_y)
-        c.drawCentredString(self.width - 4 * inch, sig_y - 0.2 * inch,
-                            "Party Leader")
+            if getattr(settings, 'CERTIFICATE_TEMPLATE_CACHE', True):
+                get_template(self.width, self.height).draw(c)
+            else:
+                c.saveState()
+                draw_artwork(c, self.width, self.height)
+                c.restoreState()
 
-        # Right signature
-        c.line(self.width - 2.5 * inch, sig_y, self.width - 0.5 * inch, sig_y)
-        c.drawCentredString(self.width - 1.5 * inch, sig_y - 0.2 * inch,
-                            "Secretary General")
+            self.draw_member(c)
 
-        # Footer
-        c.setFont("Helvetica", 8)
-        c.setFillColor(HexColor('#666666'))
-        c.drawCentredString(self.width / 2, 0.7 * inch,
-                            "National People's Voice Party | www.npv.co.ke | nationalpeoplesvoice@gmail.com")
+            c.showPage()
+            c.save()
 
-        c.showPage()
-        c.save()
+        return buffer.getvalue()
 
-        buffer.seek(0)
-        return buffer
+    def create_certificate(self):
+        """Create the membership certificate PDF"""
+        return BytesIO(self.render_pdf())
+
+    def render(self):
+        """Render the certificate and its QR code in a single pass"""
+        qr = self.build_qr()
+        return CertificateResult(
+            membership_number=self.member.membership_number,
+            pdf=self.render_pdf(),
+            qr_png=self.qr_png(),
+            verification_url=self.verification_url,
+            qr_version=qr.version,
+            template_version=getattr(settings, 'CERTIFICATE_TEMPLATE_VERSION', '1'),
+        )
 
     def save_certificate(self):
         """Generate and save certificate"""
-        pdf_buffer = self.create_certificate()
+        result = self.render()
+        qr_path = write_qr_code(self.member, result.qr_png)
+        return BytesIO(result.pdf), qr_path
+
+
+def write_qr_code(member, png):
+    """Store a member's QR code PNG and return its storage name"""
+    return certificate_storage().save(qr_code_name(member.membership_number), ContentFile(png))
+
+
+def certificate_name(membership_number):
+    """Certificate storage name for a membership number"""
+    return f'certificates/certificate_{membership_number}.pdf'
+
+
+def qr_code_name(membership_number):
+    """QR code storage name for a membership number"""
+    return f'qrcodes/qrcode_{membership_number}.png'
 
-        # Save QR code
-        qr_buffer = self.generate_qr_code()
-        qr_filename = f'qrcode_{self.member.membership_number}.png'
-        qr_path = os.path.join(settings.MEDIA_ROOT, 'qrcodes', qr_filename)
 
-        os.makedirs(os.path.dirname(qr_path), exist_ok=True)
-        with open(qr_path, 'wb') as f:
-            f.write(qr_buffer.read())
+def write_certificate_files(member, result=None):
+    """Render a member's certificate and QR code into certificate storage.
 
-        return pdf_buffer, f'qrcodes/{qr_filename}'
\ No newline at end of file
+    Returns the certificate and QR code storage names, ready to be assigned
+    to ``member.certificate`` and ``member.qr_code``. Pass an existing
+    ``CertificateResult`` to write it without rendering again.
+    """
+    result = result or CertificateGenerator(member).render()
+    with stage('file_write'):
+        qr_name = write_qr_code(member, result.qr_png)
+        cert_name = certificate_storage().save(certificate_name(member.membership_number), ContentFile(result.pdf))
+    return cert_name, qr_name
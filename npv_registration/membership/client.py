@@ -0,0 +1,137 @@
+# membership/client.py
+"""
+Client for scanning stations verifying membership numbers in batches.
+
+A gate scanning hundreds of certificates a minute spends most of its time
+on round trips if it sends one ``GET /api/verify/<number>/`` per scan.
+``VerificationClient.verify_many`` sends numbers to ``/api/verify/batch/``
+in chunks over one keep-alive connection, and ``ScanBatcher`` gathers scans
+arriving one at a time (from any number of threads) into such batches,
+waiting at most ``max_wait`` seconds for a batch to fill.
+
+Only the standard library is used, so this module can be copied onto a
+scanning station without installing Django.
+"""
+import http.client
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import quote, urlsplit
+
+BATCH_PATH = '/api/verify/batch/'
+# Must not exceed the server's VERIFY_BATCH_MAX_SIZE
+DEFAULT_BATCH_SIZE = 100
+
+
+class VerificationError(Exception):
+    """The server rejected a verification request"""
+
+
+class VerificationClient:
+    """Verify membership numbers over one keep-alive HTTP connection (not thread safe)"""
+
+    def __init__(self, base_url, batch_size=DEFAULT_BATCH_SIZE, timeout=10):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout=timeout)
+        self.prefix = url.path.rstrip('/')
+        self.batch_size = batch_size
+
+    def request(self, method, path, body=None):
+        """Send a request and return ``(status, parsed JSON body)``"""
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                self.connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, json.loads(response.read())
+            except (ConnectionError, http.client.BadStatusLine):
+                # The server closed the idle keep-alive connection; reconnect once
+                self.connection.close()
+                if attempt:
+                    raise
+
+    def verify(self, membership_number):
+        """Payload of ``GET /api/verify/<number>/``"""
+        return self.request('GET', f'/api/verify/{quote(membership_number)}/')[1]
+
+    def verify_many(self, membership_numbers):
+        """Payloads for ``membership_numbers`` in order, ``batch_size`` per request"""
+        numbers = list(membership_numbers)
+        results = []
+        for start in range(0, len(numbers), self.batch_size):
+            status, body = self.request('POST', BATCH_PATH, {
+                'membership_numbers': numbers[start:start + self.batch_size],
+            })
+            if status != 200:
+                raise VerificationError(body.get('message', f'HTTP {status}'))
+            results.extend(body['results'])
+        return results
+
+    def close(self):
+        self.connection.close()
+
+
+class ScanBatcher:
+    """Coalesce single scans into batch requests on a background thread.
+
+    ``verify(number)`` blocks until the batch holding the number has been
+    answered and returns that number's payload.
+    """
+
+    def __init__(self, client, max_batch=DEFAULT_BATCH_SIZE, max_wait=0.05):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='scan-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, membership_number):
+        """Queue a number; returns a ``Future`` for its payload"""
+        future = Future()
+        self.pending.put((membership_number, future))
+        return future
+
+    def verify(self, membership_number, timeout=None):
+        return self.submit(membership_number).result(timeout)
+
+    def next_batch(self):
+        """Block for one scan, then take more until the batch is full or ``max_wait`` passes"""
+        item = self.pending.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Closing: answer what we have, then stop
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while (batch := self.next_batch()) is not None:
+            try:
+                results = self.client.verify_many([number for number, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+    def close(self):
+        """Answer the scans already queued and stop the thread"""
+        self.pending.put(None)
+        self.thread.join()
@@ -0,0 +1,61 @@
+# membership/emails.py
+from django.core.mail import EmailMessage
+from django.conf import settings
+
+
+def certificate_email(member, pdf, connection=None):
+    """Certificate email for a member with the rendered PDF attached"""
+    subject = f'NPV Membership Certificate - {member.membership_number}'
+
+    message = f"""
+    Dear {member.get_full_name()},
+
+    Welcome to the National People's Voice Party!
+
+    Your membership registration has been successfully completed.
+
+    Membership Details:
+    - Membership Number: {member.membership_number}
+    - Category: {member.membership_category}
+    - Registration Date: {member.registration_date.strftime('%B %d, %Y')}
+
+    Please find your membership certificate attached to this email.
+
+    You can verify your membership at any time by scanning the QR code on your certificate
+    or visiting: https://npv.co.ke/verify/{member.membership_number}
+
+    Thank you for joining us in building a better Kenya!
+
+    "Our Voice, Our Strength"
+
+    Best regards,
+    National People's Voice Party
+
+    ---
+    Contact Us:
+    Email: nationalpeoplesvoice@gmail.com
+    Phone: +254-771-847-219
+    Website: www.npv.co.ke
+    """
+
+    email = EmailMessage(
+        subject=subject,
+        body=message,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[member.email],
+        connection=connection,
+    )
+
+    # Attach certificate
+    email.attach(certificate_filename(member), pdf, 'application/pdf')
+    return email
+
+
+def certificate_filename(member):
+    return f'NPV_Certificate_{member.membership_number}.pdf'
+
+
+def send_certificate_email(member, cert_path):
+    """Send certificate via email"""
+    with open(cert_path, 'rb') as f:
+        certificate_email(member, f.read()).send(fail_silently=False)
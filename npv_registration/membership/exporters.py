@@ -0,0 +1,160 @@
+# membership/exporters.py
+"""
+Streaming member exports as CSV, JSON Lines or Parquet.
+
+Rows are read with ``values_list(...).iterator(chunk_size)``, which uses a
+server-side cursor on Postgres, and encoded one chunk at a time, so memory
+stays flat however many members are exported. Parquet needs the optional
+``pyarrow`` package and is written one row group per chunk.
+"""
+import csv
+import io
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+from .models import Member
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export disabled
+    pyarrow = None
+
+# Columns that can be exported, in the default order
+EXPORT_FIELDS = [
+    field.name for field in Member._meta.concrete_fields if field.name != 'search_vector'
+]
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class ExportError(ValueError):
+    pass
+
+
+def available_formats():
+    return [name for name in FORMATS if name != 'parquet' or pyarrow is not None]
+
+
+def parse_fields(value):
+    """Validated column list from a comma separated string (default: all)"""
+    if not value:
+        return list(EXPORT_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ExportError(f'Unknown field(s): {", ".join(unknown)}')
+    return fields
+
+
+def export_rows(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of value tuples, ``chunk_size`` rows at a time"""
+    rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_csv(chunks, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def write_jsonl(chunks, fields):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in chunks:
+        yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in chunk).encode()
+
+
+def arrow_type(field):
+    if isinstance(field, (models.AutoField, models.BigAutoField, models.IntegerField)):
+        return pyarrow.int64()
+    if isinstance(field, models.DateTimeField):
+        return pyarrow.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are drained after each row group"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def write_parquet(chunks, fields):
+    schema = pyarrow.schema([
+        (name, arrow_type(Member._meta.get_field(name))) for name in fields
+    ])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        columns = list(zip(*chunk))
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema,
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'parquet': write_parquet,
+}
+
+
+def export_members(queryset, file_format='csv', fields=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the encoded export of ``queryset`` as byte strings"""
+    if file_format not in FORMATS:
+        raise ExportError(f'Unknown export format: {file_format}')
+    if file_format == 'parquet' and pyarrow is None:
+        raise ExportError('Parquet export requires the pyarrow package')
+    fields = fields or list(EXPORT_FIELDS)
+    return WRITERS[file_format](export_rows(queryset, fields, chunk_size), fields)
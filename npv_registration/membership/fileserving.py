@@ -0,0 +1,201 @@
+# membership/fileserving.py
+"""
+Serve certificate files without loading them into worker memory.
+
+Files are streamed with ``FileResponse`` (which lets the WSGI server use
+``os.sendfile``), or handed off to nginx/Apache with X-Accel-Redirect or
+X-Sendfile when ``CERTIFICATE_SENDFILE_MODE`` is set. Responses carry a
+strong ETag and Last-Modified, answer conditional GETs with 304 and support
+single byte ranges. X-Accel-Redirect maps only files below ``MEDIA_ROOT``;
+others are streamed by Django. ASGI views pass ``asynchronous=True`` to get an
+async iterator, which Django streams without holding a worker thread (a sync
+iterator would be read into memory in full under ASGI). Files in a storage
+without local paths (S3) are served by redirecting to the storage URL.
+"""
+import asyncio
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat):
+    """Strong ETag from the file's modification time and size"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """Parse a single ``bytes=start-end`` range.
+
+    Returns ``(start, end)`` inclusive, ``None`` if the header should be
+    ignored, or ``False`` if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multi-range requests get the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, mtime):
+    """Whether an If-Range precondition (if any) allows a partial response"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def media_relative_path(path):
+    """``path`` relative to ``MEDIA_ROOT`` with forward slashes, or None if it is outside"""
+    root = os.path.realpath(settings.MEDIA_ROOT or '.')
+    path = os.path.realpath(path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def can_sendfile(path):
+    """Whether the front-end server can be told to send ``path``"""
+    mode = getattr(settings, 'CERTIFICATE_SENDFILE_MODE', None)
+    if mode == 'x-accel-redirect':
+        # The internal location only maps MEDIA_ROOT
+        return media_relative_path(path) is not None
+    return bool(mode)
+
+
+async def aread_range(path, start, length):
+    """Async ``read_range``; the blocking reads run in the default executor"""
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def sendfile_response(path, content_type):
+    """Empty response telling the front-end server to send ``path``"""
+    mode = settings.CERTIFICATE_SENDFILE_MODE
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        relative = media_relative_path(path)
+        if relative is None:
+            raise ValueError(f'{path} is outside MEDIA_ROOT and has no X-Accel-Redirect location')
+        response['X-Accel-Redirect'] = settings.CERTIFICATE_SENDFILE_URL_PREFIX + relative
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = os.path.abspath(path)
+    else:
+        raise ValueError(f'Unknown CERTIFICATE_SENDFILE_MODE: {mode}')
+    return response
+
+
+def serve_file(request, path, filename, content_type='application/octet-stream', asynchronous=False):
+    """Stream ``path`` as an attachment, honouring conditional and range requests"""
+    stat = os.stat(path)
+    reader = aread_range if asynchronous else read_range
+
+    def body(start, length):
+        if start == 0 and length == stat.st_size and not asynchronous:
+            # Lets the WSGI server use os.sendfile
+            return open(path, 'rb')
+        return reader(path, start, length)
+
+    sendfile = None
+    if can_sendfile(path):
+        def sendfile():
+            return sendfile_response(path, content_type)
+
+    return ranged_response(request, body, stat.st_size, file_etag(stat), stat.st_mtime, filename,
+                           content_type, sendfile=sendfile)
+
+
+def ranged_response(request, body, size, etag, mtime, filename, content_type, sendfile=None):
+    """Attachment response for content of ``size`` bytes.
+
+    ``body(start, length)`` returns the bytes to send as a file object or a
+    (sync or async) iterator. ``sendfile()``, if given, returns a response
+    that hands the whole file to the front-end server instead.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=int(mtime))
+    if response is not None:
+        return response
+
+    if sendfile is not None:
+        # The front-end server handles ranges itself
+        response = sendfile()
+    else:
+        byte_range = None
+        if request.method == 'GET' and 'HTTP_RANGE' in request.META and if_range_matches(request, etag, mtime):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(body(start, length), status=206, content_type=content_type)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            content = body(0, size)
+            if hasattr(content, 'fileno'):
+                response = FileResponse(content, content_type=content_type)
+            else:
+                response = StreamingHttpResponse(content, content_type=content_type)
+                response['Content-Length'] = str(size)
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    return response
+
+
+def serve_storage_file(request, storage, name, filename, content_type='application/octet-stream', asynchronous=False):
+    """Serve ``name`` from ``storage``: streamed if it is on local disk, else redirected to its URL"""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        return HttpResponseRedirect(storage.url(name))
+    return serve_file(request, path, filename, content_type=content_type, asynchronous=asynchronous)
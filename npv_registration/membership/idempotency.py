@@ -0,0 +1,211 @@
+# membership/idempotency.py
+"""
+``Idempotency-Key`` support for POST endpoints.
+
+Clients on flaky networks retry a request with the same key. The first
+request runs the view and its response is stored in ``IdempotencyRecord``;
+a retry with the same key and body gets the stored response back (with
+``Idempotent-Replayed: true``) without running the view again. A retry that
+arrives while the original is still running waits for it - on Postgres on
+a session advisory lock for the key, elsewhere by polling the record - and
+gets a 409 if it is still running after ``IDEMPOTENCY_WAIT_TIMEOUT``.
+
+Keys are per caller: the authenticated user, or else the client address
+(``REMOTE_ADDR``, or the ``IDEMPOTENCY_CLIENT_HEADER`` a proxy sets), so one
+client cannot replay another's response by guessing its key. Reusing a key
+for a different request is a 422. Server errors are not stored, so the
+client can retry them with the same key.
+"""
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+
+def wait_timeout():
+    return getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10)
+
+
+def request_caller(request):
+    """Who sent the request: ``user:<pk>``, or ``ip:<client address>``"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    header = getattr(settings, 'IDEMPOTENCY_CLIENT_HEADER', None)
+    address = request.headers.get(header, '') if header else ''
+    # A proxy header may list several hops; the first is the client
+    address = address.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    return f'ip:{address}'[:64]
+
+
+def request_fingerprint(request):
+    """SHA-256 of the method, path and parsed body"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        # QueryDict (form data): keep repeated values
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f'{request.method}\x1f{request.path}\x1f{body}'.encode()).hexdigest()
+
+
+def lock_id(scope, caller, key):
+    """Signed 64-bit advisory lock id for a caller's key"""
+    digest = hashlib.sha256(f'{scope}\x1f{caller}\x1f{key}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+@contextmanager
+def key_lock(scope, caller, key, timeout):
+    """Hold a Postgres advisory lock on the key; yields whether it was acquired.
+
+    Other databases have no advisory locks, so this always yields True and
+    the record itself is the lock.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+
+    lock = lock_id(scope, caller, key)
+    with connection.cursor() as cursor:
+        try:
+            with transaction.atomic():
+                # Session-level lock: it outlives this transaction
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{int(timeout * 1000)}ms'])
+                cursor.execute('SELECT pg_advisory_lock(%s)', [lock])
+        except OperationalError:
+            # lock_timeout expired
+            yield False
+            return
+    try:
+        yield True
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [lock])
+
+
+def claim(scope, caller, key, fingerprint, exclusive):
+    """Insert a 'processing' record for the caller's key.
+
+    Returns ``(record, True)`` if this request now owns the key, or the
+    existing record and False. ``exclusive`` means the caller holds the
+    advisory lock, so a 'processing' record was left by a crashed request.
+    """
+    now = timezone.now()
+    record = IdempotencyRecord.objects.filter(scope=scope, caller=caller, key=key).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyRecord.objects.create(
+                    scope=scope, caller=caller, key=key, fingerprint=fingerprint,
+                    created_at=now, expires_at=now + key_ttl(),
+                ), True
+        except IntegrityError:
+            # Claimed concurrently
+            return None, False
+
+    stale = now - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_STALE_TIMEOUT', 300))
+    abandoned = record.status == IdempotencyRecord.STATUS_PROCESSING and (exclusive or record.created_at < stale)
+    if record.expires_at <= now or abandoned:
+        IdempotencyRecord.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+        return None, False
+    return record, False
+
+
+def complete(record, response):
+    record.status = IdempotencyRecord.STATUS_COMPLETED
+    record.response_status = response.status_code
+    record.response_body = response.data
+    record.save(update_fields=['status', 'response_status', 'response_body'])
+
+
+def replay(record):
+    return Response(record.response_body, status=record.response_status,
+                    headers={'Idempotent-Replayed': 'true'})
+
+
+def in_progress():
+    return Response({
+        'success': False,
+        'message': f'A request with this {HEADER} is still being processed'
+    }, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+
+
+def purge_expired():
+    """Delete records past their TTL; returns the number deleted"""
+    return IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+def idempotent(view):
+    """Honour ``Idempotency-Key`` on a DRF function view (apply below ``@api_view``)"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'success': False,
+                'message': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = request.path[:255]
+        caller = request_caller(request)
+        fingerprint = request_fingerprint(request)
+        timeout = wait_timeout()
+        deadline = time.monotonic() + timeout
+
+        with key_lock(scope, caller, key, timeout) as locked:
+            if not locked:
+                return in_progress()
+
+            while True:
+                record, created = claim(scope, caller, key, fingerprint, exclusive=connection.vendor == 'postgresql')
+                if created:
+                    break
+                if record is None:
+                    # Just claimed, expired or abandoned: look again
+                    continue
+                if record.fingerprint != fingerprint:
+                    return Response({
+                        'success': False,
+                        'message': f'{HEADER} was already used for a different request'
+                    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if record.status == IdempotencyRecord.STATUS_COMPLETED:
+                    return replay(record)
+                if time.monotonic() >= deadline:
+                    return in_progress()
+                time.sleep(POLL_INTERVAL)
+
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                record.delete()
+                raise
+
+            if response.status_code >= 500 or not hasattr(response, 'data'):
+                record.delete()
+            else:
+                complete(record, response)
+            return response
+
+    return wrapper
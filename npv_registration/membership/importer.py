@@ -0,0 +1,230 @@
+# membership/importer.py
+"""
+Bulk member import from CSV or JSON Lines files.
+
+Rows are validated with ``MemberImportSerializer`` and inserted in chunks:
+uniqueness checks cost one query per chunk, membership numbers are reserved
+per category with one counter update, and each chunk is written with a
+single ``bulk_create``.
+"""
+import csv
+import json
+import os
+import time
+
+from django.db import IntegrityError, transaction
+
+from .batch import save_certificate_paths
+from .models import CertificateJob, Member
+from .numbering import allocate_numbers, category_prefix, format_membership_number
+from .serializers import MemberImportSerializer
+from .stats import record_members
+
+
+def read_rows(path, file_format=None):
+    """Yield ``(line, row)`` pairs from a CSV or JSONL file.
+
+    Rows that cannot be parsed are yielded as ``(line, None)``.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            for line, row in enumerate(csv.DictReader(f), start=1):
+                yield line, row
+        else:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError:
+                    row = None
+                yield line, row if isinstance(row, dict) else None
+
+
+def clean_row(row):
+    """Strip whitespace and drop empty values so optional fields stay null"""
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ('', None):
+            continue
+        cleaned[key.strip()] = value
+    return cleaned
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = []
+        self.errors = []
+
+    def error(self, line, row, errors):
+        self.errors.append((line, (row or {}).get('id_passport', ''), errors))
+
+
+class MemberImporter:
+    """Validate and insert one chunk of rows at a time"""
+
+    def __init__(self, certificates='pool', render_pool=None, send_email=False):
+        self.certificates = certificates
+        self.render_pool = render_pool
+        self.send_email = send_email
+
+    def validate(self, rows, result):
+        """Validate rows, returning ``(line, Member)`` pairs for the valid ones"""
+        valid = []
+        for line, row in rows:
+            if row is None:
+                result.error(line, row, {'row': ['Could not parse row.']})
+                continue
+            serializer = MemberImportSerializer(data=clean_row(row))
+            if serializer.is_valid():
+                valid.append((line, Member(**serializer.validated_data)))
+            else:
+                result.error(line, row, serializer.errors)
+        return self.reject_duplicates(valid, result)
+
+    def reject_duplicates(self, valid, result):
+        """Drop rows whose ID or email is already registered or repeated in the chunk"""
+        id_numbers = {member.id_passport for line, member in valid}
+        emails = {member.email for line, member in valid if member.email}
+        taken_ids = set(Member.objects.filter(
+            id_passport__in=id_numbers
+        ).values_list('id_passport', flat=True))
+        taken_emails = set(Member.objects.filter(
+            email__in=emails
+        ).values_list('email', flat=True)) if emails else set()
+
+        unique = []
+        for line, member in valid:
+            errors = {}
+            if member.id_passport in taken_ids:
+                errors['id_passport'] = ['Member with this id passport already exists.']
+            if member.email and member.email in taken_emails:
+                errors['email'] = ['This email is already registered.']
+            if errors:
+                result.error(line, {'id_passport': member.id_passport}, errors)
+                continue
+            taken_ids.add(member.id_passport)
+            if member.email:
+                taken_emails.add(member.email)
+            unique.append((line, member))
+        return unique
+
+    def assign_numbers(self, members):
+        """Reserve membership numbers with one counter update per category"""
+        by_category = {}
+        for member in members:
+            by_category.setdefault(member.membership_category, []).append(member)
+
+        for category, category_members in by_category.items():
+            prefix = category_prefix(category)
+            numbers = allocate_numbers(category, len(category_members))
+            for member, number in zip(category_members, numbers):
+                member.membership_number = format_membership_number(prefix, number)
+
+    def insert(self, valid, result):
+        """Insert the chunk with ``bulk_create``, falling back to row-by-row
+        inserts if a concurrent registration makes the batch conflict"""
+        members = [member for line, member in valid]
+        try:
+            with transaction.atomic():
+                self.assign_numbers(members)
+                Member.objects.bulk_create(members)
+                # bulk_create sends no post_save signals
+                record_members(members)
+        except IntegrityError:
+            members = []
+            for line, member in valid:
+                member.membership_number = ''
+                try:
+                    with transaction.atomic():
+                        member.save()
+                except IntegrityError as e:
+                    result.error(line, {'id_passport': member.id_passport}, {'row': [str(e)]})
+                else:
+                    members.append(member)
+
+        if members and members[0].pk is None:
+            # Backends that cannot return primary keys from bulk inserts
+            pks = dict(Member.objects.filter(
+                membership_number__in=[member.membership_number for member in members]
+            ).values_list('membership_number', 'pk'))
+            for member in members:
+                member.pk = pks[member.membership_number]
+
+        result.created.extend(members)
+
+    def generate_certificates(self, members, result):
+        if self.certificates == 'queue':
+            CertificateJob.objects.bulk_create([
+                CertificateJob(member=member, send_email=self.send_email and bool(member.email))
+                for member in members
+            ])
+        elif self.certificates == 'pool':
+            rendered = []
+            for member, error in self.render_pool.render(members):
+                if error:
+                    result.error(None, {'id_passport': member.id_passport},
+                                 {'certificate': [f'{member.membership_number}: {error}']})
+                else:
+                    rendered.append(member)
+            save_certificate_paths(rendered)
+
+    def import_chunk(self, rows):
+        result = ImportResult()
+        valid = self.validate(rows, result)
+        if valid:
+            self.insert(valid, result)
+        if result.created and self.certificates != 'none':
+            self.generate_certificates(result.created, result)
+        return result
+
+
+class Checkpoint:
+    """Last fully imported line of a source file, stored as JSON"""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.line = 0
+        self.imported = 0
+        self.failed = 0
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        if data.get('source') != self.source:
+            return False
+        self.line, self.imported, self.failed = data['line'], data['imported'], data['failed']
+        return True
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': self.source, 'line': self.line,
+                       'imported': self.imported, 'failed': self.failed}, f)
+        os.replace(tmp_path, self.path)
+
+
+class RateMeter:
+    """Rows per second since the meter was started"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+
+    def add(self, rows):
+        self.rows += rows
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0.0
@@ -0,0 +1,279 @@
+# membership/jobs.py
+"""
+Database-backed job queue for certificate rendering and email delivery.
+
+Jobs are rows in ``CertificateJob`` (one member) and ``CertificateBatch``
+(bulk regeneration). Workers claim work with a conditional UPDATE on its
+status, so several ``certificate_worker`` processes can share one queue on
+both PostgreSQL and SQLite without extra infrastructure.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .batch import CertificateRenderPool, regenerate_certificates
+from .certificate_cache import get_certificate_name, lazy_certificates
+from .certificate_generator import CertificateGenerator, write_certificate_files
+from .emails import certificate_email
+from .idempotency import purge_expired
+from .metrics import stage
+from .models import CertificateBatch, CertificateJob
+from .outbox import OutboxSender, queue_certificate_email, requeue_stale_messages
+from .storage import certificate_storage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of expired idempotency records by an idle worker
+PURGE_INTERVAL = 300
+# Seconds between checks for jobs and emails left running by a dead worker
+REQUEUE_INTERVAL = 60
+
+
+def get_worker_id():
+    """Identify the current worker process in ``CertificateJob.locked_by``"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def retry_delay(attempts):
+    """Exponential backoff in seconds for the given number of failed attempts"""
+    base = getattr(settings, 'CERTIFICATE_JOB_RETRY_DELAY', 30)
+    maximum = getattr(settings, 'CERTIFICATE_JOB_MAX_RETRY_DELAY', 3600)
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+def enqueue_certificate_job(member, send_email=True):
+    """Queue certificate rendering (and email delivery) for a member"""
+    return CertificateJob.objects.create(
+        member=member,
+        send_email=send_email and bool(member.email),
+        max_attempts=getattr(settings, 'CERTIFICATE_JOB_MAX_ATTEMPTS', 5),
+    )
+
+
+def claim_jobs(worker_id, limit=10):
+    """Claim up to ``limit`` due jobs for this worker.
+
+    Candidates are read first and then claimed one by one with an UPDATE
+    guarded on ``status=pending``; a job another worker claimed in between
+    simply updates zero rows and is skipped.
+    """
+    now = timezone.now()
+    candidates = CertificateJob.objects.filter(
+        status=CertificateJob.STATUS_PENDING,
+        run_after__lte=now,
+    ).values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        updated = CertificateJob.objects.filter(
+            pk=pk, status=CertificateJob.STATUS_PENDING
+        ).update(
+            status=CertificateJob.STATUS_RUNNING,
+            locked_by=worker_id,
+            started_at=now,
+        )
+        if updated:
+            claimed.append(pk)
+
+    return list(CertificateJob.objects.filter(pk__in=claimed).select_related('member'))
+
+
+def deliver_certificate(member, send_email=True):
+    """Render the member's certificate and email it.
+
+    In lazy render mode nothing is written up front; the certificate is only
+    rendered (into the certificate cache) when it has to be emailed.
+    """
+    send_email = send_email and bool(member.email)
+
+    if lazy_certificates():
+        if send_email:
+            with certificate_storage().open(get_certificate_name(member), 'rb') as f:
+                email_certificate(member, f.read())
+        return
+
+    result = CertificateGenerator(member).render()
+    names = write_certificate_files(member, result)
+    # Registration stores the paths up front; only older rows need the UPDATE
+    if (member.certificate.name, member.qr_code.name) != names:
+        member.certificate, member.qr_code = names
+        member.save(update_fields=['certificate', 'qr_code'])
+
+    if send_email:
+        email_certificate(member, result.pdf)
+
+
+def email_certificate(member, pdf):
+    """Queue the certificate email in the outbox, or send it now if disabled"""
+    if getattr(settings, 'EMAIL_OUTBOX', True):
+        with stage('email_queue'):
+            queue_certificate_email(member, pdf)
+    else:
+        with stage('smtp'):
+            certificate_email(member, pdf).send(fail_silently=False)
+
+
+def run_job(job):
+    """Render the certificate for a claimed job and send the email"""
+    deliver_certificate(job.member, send_email=job.send_email)
+
+
+def process_job(job):
+    """Run a claimed job and record its outcome. Returns True on success."""
+    attempts = job.attempts + 1
+    try:
+        run_job(job)
+    except Exception as e:
+        logger.exception('Certificate job %s failed (attempt %s)', job.pk, attempts)
+        fields = {'attempts': attempts, 'last_error': str(e), 'locked_by': ''}
+        if attempts >= job.max_attempts:
+            fields.update(status=CertificateJob.STATUS_FAILED, finished_at=timezone.now())
+        else:
+            fields.update(
+                status=CertificateJob.STATUS_PENDING,
+                run_after=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+            )
+        CertificateJob.objects.filter(pk=job.pk).update(**fields)
+        return False
+
+    CertificateJob.objects.filter(pk=job.pk).update(
+        status=CertificateJob.STATUS_DONE,
+        attempts=attempts,
+        last_error='',
+        locked_by='',
+        finished_at=timezone.now(),
+    )
+    return True
+
+
+def claim_batch(worker_id):
+    """Claim the oldest pending certificate batch, or return None"""
+    candidates = CertificateBatch.objects.filter(
+        status=CertificateBatch.STATUS_PENDING
+    ).order_by('created_at').values_list('pk', flat=True)[:5]
+
+    for pk in candidates:
+        now = timezone.now()
+        updated = CertificateBatch.objects.filter(
+            pk=pk, status=CertificateBatch.STATUS_PENDING
+        ).update(
+            status=CertificateBatch.STATUS_RUNNING,
+            locked_by=worker_id,
+            started_at=now,
+            updated_at=now,
+            processed=0,
+            failed=0,
+            errors=[],
+        )
+        if updated:
+            return CertificateBatch.objects.get(pk=pk)
+    return None
+
+
+def process_batch(batch, pool, chunk_size=None):
+    """Regenerate every certificate in a claimed batch, recording progress"""
+    chunk_size = chunk_size or getattr(settings, 'CERTIFICATE_BATCH_CHUNK_SIZE', 200)
+    max_errors = 100
+    state = {'processed': 0, 'failed': 0, 'errors': []}
+
+    def progress(rendered, errors):
+        state['processed'] += len(rendered) + len(errors)
+        state['failed'] += len(errors)
+        state['errors'].extend(
+            f'{number}: {error}' for number, error in errors[:max_errors - len(state['errors'])]
+        )
+        CertificateBatch.objects.filter(pk=batch.pk).update(updated_at=timezone.now(), **state)
+
+    try:
+        regenerate_certificates(batch.member_ids, pool, chunk_size=chunk_size, progress=progress)
+    except Exception as e:
+        logger.exception('Certificate batch %s failed', batch.pk)
+        CertificateBatch.objects.filter(pk=batch.pk).update(
+            status=CertificateBatch.STATUS_FAILED,
+            errors=state['errors'] + [str(e)],
+            locked_by='',
+            finished_at=timezone.now(),
+        )
+        return False
+
+    CertificateBatch.objects.filter(pk=batch.pk).update(
+        status=CertificateBatch.STATUS_DONE,
+        locked_by='',
+        finished_at=timezone.now(),
+    )
+    return True
+
+
+def requeue_stale_jobs(timeout=None):
+    """Return work stuck in ``running`` (e.g. after a worker crash) to the queue"""
+    if timeout is None:
+        timeout = getattr(settings, 'CERTIFICATE_JOB_STALE_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    CertificateBatch.objects.filter(
+        status=CertificateBatch.STATUS_RUNNING,
+        updated_at__lt=cutoff,
+    ).update(status=CertificateBatch.STATUS_PENDING, locked_by='')
+    return CertificateJob.objects.filter(
+        status=CertificateJob.STATUS_RUNNING,
+        started_at__lt=cutoff,
+    ).update(status=CertificateJob.STATUS_PENDING, locked_by='')
+
+
+def run_pending_jobs(worker_id=None, batch_size=10):
+    """Claim and process one batch of jobs. Returns the number processed."""
+    worker_id = worker_id or get_worker_id()
+    jobs = claim_jobs(worker_id, limit=batch_size)
+    for job in jobs:
+        process_job(job)
+    return len(jobs)
+
+
+def run_worker(batch_size=10, sleep=1.0, once=False, stdout=None):
+    """Process jobs until interrupted, or until the queue is drained if ``once``.
+
+    Single-member jobs take priority; certificate batches are picked up
+    when no jobs are due. Each pass also sends due outbox emails over the
+    worker's persistent email connection. Work left running by a crashed
+    worker is requeued every ``REQUEUE_INTERVAL`` seconds, and idle workers
+    purge expired idempotency records.
+    """
+    worker_id = get_worker_id()
+    requeued_at = purged_at = float('-inf')
+
+    with CertificateRenderPool(getattr(settings, 'CERTIFICATE_BATCH_WORKERS', None)) as pool, \
+            OutboxSender(worker_id) as sender:
+        while True:
+            close_old_connections()
+            if time.monotonic() - requeued_at > REQUEUE_INTERVAL:
+                requeue_stale_jobs()
+                requeue_stale_messages()
+                requeued_at = time.monotonic()
+            processed = run_pending_jobs(worker_id, batch_size=batch_size)
+            if processed and stdout is not None:
+                stdout.write(f'Processed {processed} certificate job(s)')
+
+            sent, failed = sender.send_pending(getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100))
+            if (sent or failed) and stdout is not None:
+                stdout.write(f'Sent {sent} email(s), {failed} failed')
+            if processed or sent or failed:
+                continue
+
+            batch = claim_batch(worker_id)
+            if batch is not None:
+                process_batch(batch, pool)
+                if stdout is not None:
+                    stdout.write(f'Processed certificate batch {batch.pk}')
+                continue
+
+            if once:
+                return
+            if time.monotonic() - purged_at > PURGE_INTERVAL:
+                purge_expired()
+                purged_at = time.monotonic()
+            time.sleep(sleep)
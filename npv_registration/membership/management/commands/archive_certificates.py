@@ -0,0 +1,45 @@
+# membership/management/commands/archive_certificates.py
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from membership.archive import archive_files
+from membership.models import Member
+from membership.storage import certificate_storage
+
+
+class Command(BaseCommand):
+    help = 'Move certificates of members registered long ago into append-only pack files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=365,
+                            help='Archive members registered more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Certificates written and indexed per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the certificates that would be archived')
+
+    def handle(self, *args, **options):
+        storage = certificate_storage()
+        if not isinstance(storage, FileSystemStorage):
+            raise CommandError('Packs are only useful for certificates kept on local disk')
+
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        names = (
+            Member.objects.filter(registration_date__lt=cutoff)
+            .exclude(certificate='').exclude(certificate__isnull=True)
+            .order_by('pk').values_list('certificate', flat=True)
+            .iterator(chunk_size=2000)
+        )
+
+        if options['dry_run']:
+            count = sum(1 for name in names if storage.exists(name))
+            self.stdout.write(self.style.SUCCESS(f'Would archive {count} certificates'))
+            return
+
+        counts = archive_files(names, storage, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {counts["archived"]} certificates, {counts["missing"]} not in storage'
+        ))
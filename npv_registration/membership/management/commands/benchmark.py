@@ -0,0 +1,95 @@
+# membership/management/commands/benchmark.py
+import inspect
+import json
+import os
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from membership.benchmarks import BENCHMARKS, benchmark_environment, compare
+
+
+class Command(BaseCommand):
+    help = 'Run membership performance benchmarks against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*',
+                            help=f'Benchmarks to run: {", ".join(sorted(BENCHMARKS))} (default: all)')
+        parser.add_argument('--count', type=int,
+                            help='Number of operations per benchmark (default: per benchmark)')
+        parser.add_argument('--rows', type=int,
+                            help='Members to seed, for benchmarks that need a populated table '
+                                 '(list, numbering, stats, export)')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Write the results (with run metadata) to this JSON file')
+        parser.add_argument('--baseline', metavar='PATH',
+                            help='JSON file from an earlier --json run to compare against; '
+                                 'exits with an error if any metric regressed')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative change counted as a regression (default: 0.2)')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or sorted(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmark(s): {", ".join(sorted(unknown))}')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+
+        results = {}
+        for name in names:
+            benchmark = BENCHMARKS[name]
+            kwargs = {}
+            if options['count']:
+                kwargs['count'] = options['count']
+            if options['rows'] and 'rows' in inspect.signature(benchmark).parameters:
+                kwargs['rows'] = options['rows']
+            # A fresh database per benchmark, so seeded tables do not collide
+            with benchmark_environment():
+                results[name] = benchmark(**kwargs)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for mode, metrics in results[name].items():
+                line = ', '.join(f'{key}={value:.2f}' if isinstance(value, float) else f'{key}={value}'
+                                 for key, value in metrics.items())
+                self.stdout.write(f'  {mode}: {line}')
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'meta': self.metadata(options), 'results': results}, f, indent=2)
+            self.stdout.write(f'Results written to {options["json"]}')
+
+        if baseline is not None:
+            self.report(compare(results, baseline, options['tolerance']))
+
+    def metadata(self, options):
+        return {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'count': options['count'],
+            'rows': options['rows'],
+        }
+
+    def report(self, comparisons):
+        regressions = 0
+        self.stdout.write(self.style.MIGRATE_HEADING('compared with baseline'))
+        for benchmark, mode, metric, old, new, change, regressed in comparisons:
+            line = f'  {benchmark}.{mode}.{metric}: {old:.2f} -> {new:.2f} ({change:+.0%})'
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f'{line} REGRESSION'))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f'{regressions} metric(s) regressed beyond the tolerance')
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,65 @@
+# membership/management/commands/benchmark_server.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+
+class Command(BaseCommand):
+    help = 'Serve the project with gunicorn against a benchmark database (used by the "asgi" benchmark)'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-class', choices=sorted(WORKER_CLASSES), default='sync')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads per worker (gthread only)')
+        parser.add_argument('--bind', default='127.0.0.1:8000')
+        parser.add_argument('--database', required=True,
+                            help='Database NAME to serve instead of the configured one')
+        parser.add_argument('--media-root', help='MEDIA_ROOT to serve instead of the configured one')
+
+    def handle(self, *args, **options):
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise CommandError('benchmark_server requires gunicorn')
+
+        settings.DATABASES['default']['NAME'] = options['database']
+        connections['default'].settings_dict['NAME'] = options['database']
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, '127.0.0.1', 'localhost']
+        if options['media_root']:
+            settings.MEDIA_ROOT = options['media_root']
+        settings.QUERY_BUDGET_MODE = 'off'
+
+        worker_class = options['worker_class']
+        if worker_class == 'uvicorn':
+            from django.core.asgi import get_asgi_application
+            application = get_asgi_application()
+        else:
+            from django.core.wsgi import get_wsgi_application
+            application = get_wsgi_application()
+
+        config = {
+            'bind': options['bind'],
+            'workers': options['workers'],
+            'worker_class': WORKER_CLASSES[worker_class],
+            'threads': options['threads'] if worker_class == 'gthread' else 1,
+            'backlog': 4096,
+            'loglevel': 'warning',
+        }
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in config.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return application
+
+        Server().run()
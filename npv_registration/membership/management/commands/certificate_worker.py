@@ -0,0 +1,27 @@
+# membership/management/commands/certificate_worker.py
+from django.core.management.base import BaseCommand
+
+from membership.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Render certificates and send certificate emails from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of jobs to claim at a time')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue has been drained')
+
+    def handle(self, *args, **options):
+        try:
+            run_worker(
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                once=options['once'],
+                stdout=self.stdout if options['verbosity'] > 1 else None,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('Worker stopped')
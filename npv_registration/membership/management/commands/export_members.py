@@ -0,0 +1,48 @@
+# membership/management/commands/export_members.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership.exporters import DEFAULT_CHUNK_SIZE, EXPORT_FIELDS, FORMATS, ExportError, export_members, parse_fields
+from membership.filters import filter_members
+from membership.models import Member
+from rest_framework.exceptions import ValidationError
+
+
+class Command(BaseCommand):
+    help = 'Export members to CSV, JSON Lines or Parquet without loading the table into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv',
+                            help='Output format (parquet requires pyarrow)')
+        parser.add_argument('--output', '-o',
+                            help='Output file (default: stdout)')
+        parser.add_argument('--fields',
+                            help=f'Comma separated columns (default: {",".join(EXPORT_FIELDS)})')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Rows fetched from the database cursor per round trip')
+        parser.add_argument('--category', help='Membership category, by name or prefix')
+        parser.add_argument('--county')
+        parser.add_argument('--date-from', help='Registered on or after (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Registered on or before (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('category', 'county', 'date_from', 'date_to')}
+        try:
+            fields = parse_fields(options['fields'])
+            members = filter_members(Member.objects.all(), params)
+            chunks = export_members(members, options['format'], fields, options['chunk_size'])
+        except ExportError as e:
+            raise CommandError(str(e))
+        except ValidationError as e:
+            raise CommandError('; '.join(f'{key}: {value}' for key, value in e.detail.items()))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
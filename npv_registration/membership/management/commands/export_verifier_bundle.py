@@ -0,0 +1,25 @@
+# membership/management/commands/export_verifier_bundle.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership.signing import export_bundle
+
+
+class Command(BaseCommand):
+    help = ('Write the public QR signing keys and revocation Bloom filter for offline scanning '
+            'stations (the private keys are not included)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='JSON file to write')
+
+    def handle(self, *args, **options):
+        bundle = export_bundle()
+        if not bundle['keys']:
+            raise CommandError('QR_SIGNING_KEYS is empty')
+
+        with open(options['output'], 'w') as f:
+            json.dump(bundle, f)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(bundle["keys"])} public keys and the revocation list to {options["output"]}'
+        ))
@@ -0,0 +1,94 @@
+# membership/management/commands/import_members.py
+import csv
+import json
+import os
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership.batch import CertificateRenderPool
+from membership.importer import Checkpoint, MemberImporter, RateMeter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import members from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file with one member per row')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows validated and inserted per batch')
+        parser.add_argument('--certificates', choices=['pool', 'queue', 'none'], default='pool',
+                            help='Render certificates in a process pool, queue them for '
+                                 'certificate_worker, or skip them')
+        parser.add_argument('--workers', type=int,
+                            help='Certificate rendering processes (default: CPU count)')
+        parser.add_argument('--send-email', action='store_true',
+                            help='Email certificates to imported members (queue mode only)')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file (default: <path>.checkpoint.json)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the first row')
+        parser.add_argument('--errors',
+                            help='Per-row error report (default: <path>.errors.csv)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+        if options['send_email'] and options['certificates'] != 'queue':
+            raise CommandError('--send-email requires --certificates queue')
+
+        checkpoint = Checkpoint(options['checkpoint'] or f'{path}.checkpoint.json', path)
+        resumed = not options['restart'] and checkpoint.load()
+        if resumed:
+            self.stdout.write(f'Resuming after line {checkpoint.line}')
+
+        error_path = options['errors'] or f'{path}.errors.csv'
+        error_file = open(error_path, 'a' if resumed else 'w', newline='', encoding='utf-8')
+        error_writer = csv.writer(error_file)
+        if not resumed:
+            error_writer.writerow(['line', 'id_passport', 'errors'])
+
+        rows = read_rows(path, options['format'])
+        rows = ((line, row) for line, row in rows if line > checkpoint.line)
+        meter = RateMeter()
+
+        # No render pool unless certificates are rendered here
+        pool = CertificateRenderPool(options['workers']) if options['certificates'] == 'pool' else nullcontext()
+        try:
+            with pool as render_pool:
+                importer = MemberImporter(
+                    certificates=options['certificates'],
+                    render_pool=render_pool,
+                    send_email=options['send_email'],
+                )
+                while True:
+                    chunk = list(islice(rows, options['chunk_size']))
+                    if not chunk:
+                        break
+
+                    result = importer.import_chunk(chunk)
+                    for line, id_passport, errors in result.errors:
+                        error_writer.writerow([line or '', id_passport, json.dumps(errors)])
+                    error_file.flush()
+
+                    checkpoint.line = chunk[-1][0]
+                    checkpoint.imported += len(result.created)
+                    checkpoint.failed += len(result.errors)
+                    checkpoint.save()
+
+                    meter.add(len(chunk))
+                    self.stdout.write(
+                        f'Line {checkpoint.line}: {checkpoint.imported} imported, '
+                        f'{checkpoint.failed} errors, {meter.rate:.1f} rows/sec'
+                    )
+        finally:
+            error_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {checkpoint.imported} members with {checkpoint.failed} errors '
+            f'({meter.rate:.1f} rows/sec). Error report: {error_path}'
+        ))
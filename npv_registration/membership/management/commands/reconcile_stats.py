@@ -0,0 +1,24 @@
+# membership/management/commands/reconcile_stats.py
+from django.core.management.base import BaseCommand
+
+from membership.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the membership statistics rollup from the Member table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without changing anything')
+
+    def handle(self, *args, **options):
+        drift = reconcile(dry_run=options['dry_run'])
+        for (dimension, value), (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f'{dimension}={value!r}: {stored} -> {actual}')
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Statistics are up to date'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} stat rows out of date'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Corrected {len(drift)} stat rows'))
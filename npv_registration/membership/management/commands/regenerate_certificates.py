@@ -0,0 +1,69 @@
+# membership/management/commands/regenerate_certificates.py
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from membership.batch import CertificateRenderPool, regenerate_certificates
+from membership.models import CertificateBatch, Member
+from membership.numbering import CATEGORY_PREFIXES
+
+
+class Command(BaseCommand):
+    help = 'Regenerate member certificates in parallel across a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category',
+                            help='Membership category, by name or prefix (e.g. "Life Membership" or LM)')
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help='Only members registered on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--workers', type=int,
+                            help='Rendering processes (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Members rendered and saved per batch')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue a certificate batch for certificate_worker instead')
+
+    def get_member_ids(self, options):
+        members = Member.objects.all()
+        category = options['category']
+        if category:
+            prefixes = {prefix: name for name, prefix in CATEGORY_PREFIXES.items()}
+            category = prefixes.get(category.upper(), category)
+            if category not in CATEGORY_PREFIXES:
+                raise CommandError(f'Unknown membership category: {options["category"]}')
+            members = members.filter(membership_category=category)
+        if options['since']:
+            members = members.filter(registration_date__date__gte=options['since'])
+        return list(members.order_by('pk').values_list('pk', flat=True))
+
+    def handle(self, *args, **options):
+        member_ids = self.get_member_ids(options)
+        total = len(member_ids)
+
+        if options['background']:
+            batch = CertificateBatch.objects.create(
+                description=f'regenerate_certificates ({total} members)',
+                member_ids=member_ids,
+                total=total,
+            )
+            self.stdout.write(f'Queued certificate batch {batch.pk} for {total} members')
+            return
+
+        started = time.perf_counter()
+        state = {'processed': 0, 'failed': 0}
+
+        def progress(rendered, errors):
+            state['processed'] += len(rendered) + len(errors)
+            state['failed'] += len(errors)
+            for number, error in errors:
+                self.stderr.write(f'{number}: {error}')
+            rate = state['processed'] / (time.perf_counter() - started)
+            self.stdout.write(f'{state["processed"]}/{total} certificates ({rate:.1f}/sec)')
+
+        with CertificateRenderPool(options['workers']) as pool:
+            regenerate_certificates(member_ids, pool, chunk_size=options['chunk_size'], progress=progress)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Regenerated {state["processed"] - state["failed"]} certificates, {state["failed"]} failed'
+        ))
@@ -0,0 +1,33 @@
+# membership/management/commands/reshard_certificates.py
+from itertools import chain
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from membership.models import Member
+from membership.storage import certificate_storage, reshard
+
+
+class Command(BaseCommand):
+    help = 'Move certificate and QR code files from the flat MEDIA_ROOT layout into the certificate storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source',
+                            help='Directory holding the flat layout (default: MEDIA_ROOT)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count what would be moved without touching any file')
+        parser.add_argument('--delete-source', action='store_true',
+                            help='Remove source files after uploading them to a remote storage')
+
+    def handle(self, *args, **options):
+        source = options['source'] or str(settings.MEDIA_ROOT)
+        rows = Member.objects.values_list('certificate', 'qr_code').iterator(chunk_size=2000)
+        names = (name for name in chain.from_iterable(rows) if name)
+
+        counts = reshard(names, source, certificate_storage(),
+                         dry_run=options['dry_run'], delete_source=options['delete_source'])
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {counts["moved"]} files, {counts["present"]} already in place, {counts["missing"]} missing'
+        ))
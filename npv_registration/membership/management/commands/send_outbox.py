@@ -0,0 +1,41 @@
+# membership/management/commands/send_outbox.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from membership.jobs import get_worker_id
+from membership.outbox import OutboxSender, requeue_stale_messages
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox over a persistent connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of messages to claim at a time')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the outbox has been drained')
+
+    def handle(self, *args, **options):
+        requeue_stale_messages()
+        totals = [0, 0]
+        try:
+            with OutboxSender(get_worker_id()) as sender:
+                while True:
+                    close_old_connections()
+                    sent, failed = sender.send_pending(options['batch_size'])
+                    totals[0] += sent
+                    totals[1] += failed
+                    if sent or failed:
+                        if options['verbosity'] > 1:
+                            self.stdout.write(f'Sent {sent} email(s), {failed} failed')
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Outbox sender stopped')
+        self.stdout.write(f'Sent {totals[0]} email(s), {totals[1]} failed')
@@ -0,0 +1,357 @@
+# membership/metrics.py
+"""
+Request, database and stage timings, served on ``/metrics`` in the
+Prometheus text format.
+
+``MetricsMiddleware`` counts every request and, for a random
+``METRICS_SAMPLE_RATE`` share of them, records per view the request
+duration, the number of SQL queries and the time spent running them.
+Expensive steps are marked with ``stage()``::
+
+    with stage('pdf_render'):
+        ...
+
+A stage is timed when the request around it is sampled; outside a request
+(the certificate worker, management commands) each stage is sampled on its
+own. An unsampled request costs one random number and a counter update:
+queries go through an execute wrapper installed on each database
+connection, which returns straight away unless a sample is being taken.
+
+Every process keeps its metrics in memory. With ``METRICS_DIR`` set it also
+writes them to ``METRICS_DIR/metrics-<pid>.json``, at most every
+``METRICS_FLUSH_INTERVAL`` seconds and on exit, and ``/metrics`` adds up the
+files of all processes, so whichever gunicorn worker answers a scrape
+reports the whole server. Files of exited workers are kept (and a new
+process reusing a pid carries its totals on) so counters never go down;
+empty the directory on deploy.
+"""
+import atexit
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+FILE_RE = re.compile(r'^metrics-\d+\.json$')
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50, 100)
+
+Metric = namedtuple('Metric', 'kind help buckets')
+
+METRICS = {
+    'npv_requests_total': Metric(
+        'counter', 'Requests by view, method and status code', None),
+    'npv_request_duration_seconds': Metric(
+        'histogram', 'Duration of sampled requests by view', SECONDS_BUCKETS),
+    'npv_request_queries': Metric(
+        'histogram', 'SQL queries run by sampled requests by view', QUERY_BUCKETS),
+    'npv_request_query_duration_seconds': Metric(
+        'histogram', 'Time sampled requests spent in SQL queries by view', SECONDS_BUCKETS),
+    'npv_stage_duration_seconds': Metric(
+        'histogram', 'Duration of sampled stages (number allocation, PDF render, SMTP, ...)', SECONDS_BUCKETS),
+}
+
+# None outside a request, False in an unsampled request, else a Sample
+_sample = ContextVar('metrics_sample', default=None)
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def sample_rate():
+    return getattr(settings, 'METRICS_SAMPLE_RATE', 0.1)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush_interval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+
+class Sample:
+    """Queries run by one sampled request"""
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+class MetricStore:
+    """Counters and histograms of this process, keyed by name and labels.
+
+    A histogram is stored as its per-bucket counts (the last one is +Inf)
+    followed by the sum of the observed values.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.values = {}
+        self.flushed_at = time.monotonic()
+        # Totals left by an earlier process with our pid are picked up once
+        self.resumed = False
+
+    def _check_fork(self):
+        # A forked worker starts from zero rather than repeating its parent's counts
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            self.values[key] = self.values.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name].buckets
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [0] * (len(buckets) + 2)
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            self._check_fork()
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in self.values.items()}
+
+    def path(self):
+        return os.path.join(metrics_dir(), f'metrics-{self.pid}.json')
+
+    def maybe_flush(self):
+        if metrics_dir() and time.monotonic() - self.flushed_at >= flush_interval():
+            self.flush()
+
+    def flush(self):
+        """Write this process's metrics to its file in ``METRICS_DIR``"""
+        if not metrics_dir() or not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flushed_at = time.monotonic()
+            os.makedirs(metrics_dir(), exist_ok=True)
+            if not self.resumed:
+                self.resumed = True
+                previous = read_file(self.path())
+                with self.lock:
+                    merge(self.values, previous)
+            write_file(self.path(), self.snapshot())
+        finally:
+            self.flush_lock.release()
+
+
+store = MetricStore()
+atexit.register(store.flush)
+
+
+def merge(values, other):
+    """Add the metrics in ``other`` into ``values``"""
+    for key, value in other.items():
+        current = values.get(key)
+        if current is None:
+            values[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            for i, item in enumerate(value):
+                current[i] += item
+        else:
+            values[key] = current + value
+    return values
+
+
+def write_file(path, values):
+    rows = [[name, [list(label) for label in labels], value] for (name, labels), value in values.items()]
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            rows = json.load(f)
+    except (FileNotFoundError, ValueError):
+        # Gone, or not a metrics file
+        return {}
+    return {(name, tuple(tuple(label) for label in labels)): value
+            for name, labels, value in rows if name in METRICS}
+
+
+def collect():
+    """Metrics of every process writing to ``METRICS_DIR``, or of this one"""
+    directory = metrics_dir()
+    if not directory:
+        return store.snapshot()
+    store.flush()
+    values = {}
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return store.snapshot()
+    for name in names:
+        if FILE_RE.match(name):
+            merge(values, read_file(os.path.join(directory, name)))
+    return values
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render(values):
+    """Prometheus text exposition of collected metrics"""
+    lines = []
+    for name, metric in METRICS.items():
+        series = sorted((labels, value) for (key, labels), value in values.items() if key == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, value in series:
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            bounds = [_format_value(float(bound)) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """``GET /metrics`` for Prometheus"""
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+@contextmanager
+def stage(name):
+    """Time a named step of the work if it is being sampled"""
+    current = _sample.get()
+    if current is None:
+        timed = enabled() and random.random() < sample_rate()
+    else:
+        timed = current is not False
+    if not timed:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        store.observe('npv_stage_duration_seconds', (('stage', name),), time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting the queries of sampled requests"""
+    sample = _sample.get()
+    if not sample:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.query_seconds += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """Count requests and time a sample of them; put it first in ``MIDDLEWARE``"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        sample = Sample() if random.random() < sample_rate() else False
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _sample.reset(token)
+        self.record(request, response, sample, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        sample = Sample() if random.random() < sample_rate() else False
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sample.reset(token)
+        self.record(request, response, sample, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def record(request, response, sample, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        store.inc('npv_requests_total',
+                  (('view', view), ('method', request.method), ('status', str(response.status_code))))
+        if sample:
+            labels = (('view', view),)
+            store.observe('npv_request_duration_seconds', labels, elapsed)
+            store.observe('npv_request_queries', labels, sample.queries)
+            store.observe('npv_request_query_duration_seconds', labels, sample.query_seconds)
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Category prefixes when this migration was written (membership.numbering);
+# frozen here so later changes to the module cannot alter the migration
+PREFIXES = ['OM', 'BM', 'LM', 'AM', 'GM', 'HM']
+
+
+def highest_issued_number(Member, prefix):
+    """Highest ``NPV/<prefix>-<n>`` number issued, compared numerically"""
+    highest = 0
+    numbers = Member.objects.filter(
+        membership_number__startswith=f"NPV/{prefix}-"
+    ).values_list('membership_number', flat=True)
+    for membership_number in numbers.iterator():
+        try:
+            highest = max(highest, int(membership_number.rsplit('-', 1)[1]))
+        except ValueError:
+            pass
+    return highest
+
+
+def seed_counters(apps, schema_editor):
+    """Start each category counter at the highest number already issued"""
+    Member = apps.get_model('membership', 'Member')
+    MembershipCounter = apps.get_model('membership', 'MembershipCounter')
+
+    for prefix in PREFIXES:
+        counter, created = MembershipCounter.objects.get_or_create(category=prefix)
+        counter.last_number = max(counter.last_number, highest_issued_number(Member, prefix))
+        counter.save(update_fields=['last_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0002_certificatejob'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0004_certificatebatch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['-registration_date', '-id'], name='member_regdate_id'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['membership_category', '-registration_date', '-id'], name='member_category_regdate'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['county', '-registration_date', '-id'], name='member_county_regdate'),
+        ),
+    ]
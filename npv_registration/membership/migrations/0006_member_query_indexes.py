@@ -0,0 +1,61 @@
+from django.db import migrations, models
+
+# Columns in MemberAdmin.search_fields
+SEARCH_COLUMNS = ['surname', 'other_names', 'membership_number', 'id_passport', 'phone', 'email']
+
+# Columns searched by prefix where trigram indexes are unavailable
+PREFIX_COLUMNS = ['surname', 'other_names', 'phone']
+
+
+def create_search_indexes(apps, schema_editor):
+    """Trigram GIN indexes on Postgres, case-insensitive B-tree elsewhere.
+
+    ``icontains`` compiles to ``UPPER(col::text) LIKE UPPER(%s)`` on Postgres,
+    so the trigram indexes are built on that expression. SQLite can only use
+    an index for prefix ``LIKE``, and only on a NOCASE index.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            schema_editor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS member_{column}_trgm '
+                f'ON membership_member USING gin (UPPER({column}::text) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite':
+        for column in PREFIX_COLUMNS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS member_{column}_nocase '
+                f'ON membership_member ({column} COLLATE NOCASE)'
+            )
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for column in SEARCH_COLUMNS:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS member_{column}_trgm')
+    elif vendor == 'sqlite':
+        for column in PREFIX_COLUMNS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS member_{column}_nocase')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('membership', '0005_member_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['email'], name='member_email'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['county', 'constituency', 'ward'], name='member_location'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,58 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Names weigh most, then identifiers (punctuation split out, and the phone
+# number also in its local 07... form), then email
+SEARCH_TRIGGER = r"""
+CREATE OR REPLACE FUNCTION membership_member_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple',
+            coalesce(NEW.surname, '') || ' ' || coalesce(NEW.other_names, '')), 'A') ||
+        setweight(to_tsvector('simple', regexp_replace(
+            coalesce(NEW.membership_number, '') || ' ' || coalesce(NEW.id_passport, '') || ' ' ||
+            coalesce(NEW.phone, '') || ' ' || regexp_replace(coalesce(NEW.phone, ''), '^\+?254', '0'),
+            '[^[:alnum:]]+', ' ', 'g')), 'B') ||
+        setweight(to_tsvector('simple', regexp_replace(coalesce(NEW.email, ''), '[^[:alnum:]]+', ' ', 'g')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER membership_member_search_vector
+    BEFORE INSERT OR UPDATE ON membership_member
+    FOR EACH ROW EXECUTE FUNCTION membership_member_search_vector();
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    """Keep search_vector current on Postgres, whichever code path writes the row"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(SEARCH_TRIGGER)
+    # Fire the trigger for existing members, then index
+    schema_editor.execute('UPDATE membership_member SET search_vector = NULL')
+    schema_editor.execute('CREATE INDEX member_search_vector ON membership_member USING gin (search_vector)')
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS member_search_vector')
+    schema_editor.execute('DROP TRIGGER IF EXISTS membership_member_search_vector ON membership_member')
+    schema_editor.execute('DROP FUNCTION IF EXISTS membership_member_search_vector()')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0006_member_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
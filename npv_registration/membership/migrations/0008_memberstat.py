@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+from membership.stats import live_counts
+
+
+def seed_stats(apps, schema_editor):
+    """Build the rollup for members registered before it existed"""
+    Member = apps.get_model('membership', 'Member')
+    MemberStat = apps.get_model('membership', 'MemberStat')
+    MemberStat.objects.bulk_create([
+        MemberStat(dimension=dimension, value=value, count=count)
+        for (dimension, value), count in live_counts(Member.objects.all()).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0007_member_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=20)),
+                ('value', models.CharField(blank=True, max_length=200)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'value'), name='memberstat_dimension_value')],
+            },
+        ),
+        migrations.RunPython(seed_stats, migrations.RunPython.noop),
+    ]
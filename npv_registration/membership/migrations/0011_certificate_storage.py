@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:42
+
+import membership.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0010_idempotencyrecord'),
+    ]
+
+    # Storage is not a database attribute, but SQLite would rebuild the table
+    # for the AlterField and lose the raw NOCASE indexes from 0006
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='member',
+                name='certificate',
+                field=models.FileField(blank=True, null=True, storage=membership.storage.certificate_storage, upload_to='certificates/'),
+            ),
+            migrations.AlterField(
+                model_name='member',
+                name='qr_code',
+                field=models.ImageField(blank=True, null=True, storage=membership.storage.certificate_storage, upload_to='qrcodes/'),
+            ),
+        ]),
+    ]
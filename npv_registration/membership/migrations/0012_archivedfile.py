@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0011_certificate_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('pack', models.CharField(max_length=64)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('crc32', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
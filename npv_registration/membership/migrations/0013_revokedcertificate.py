@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0012_archivedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedCertificate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('membership_number', models.CharField(max_length=20, unique=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('revoked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0013_revokedcertificate'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencyrecord',
+            name='idempotency_scope_key',
+        ),
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='caller',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencyrecord',
+            constraint=models.UniqueConstraint(fields=('scope', 'caller', 'key'), name='idempotency_scope_caller_key'),
+        ),
+    ]
@@ -1,8 +1,15 @@
 # membership/models.py
+import uuid
+
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from datetime import datetime
 
+from .storage import certificate_storage
+
 
 class Member(models.Model):
     GENDER_CHOICES = [
@@ -54,13 +61,27 @@ class Member(models.Model):
     registration_date = models.DateTimeField(auto_now_add=True)
 
     # Certificate
-    certificate = models.FileField(upload_to='certificates/', blank=True, null=True)
-    qr_code = models.ImageField(upload_to='qrcodes/', blank=True, null=True)
+    certificate = models.FileField(upload_to='certificates/', storage=certificate_storage, blank=True, null=True)
+    qr_code = models.ImageField(upload_to='qrcodes/', storage=certificate_storage, blank=True, null=True)
+
+    # Maintained by a database trigger on Postgres, unused elsewhere
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ['-registration_date']
         verbose_name = 'Member'
         verbose_name_plural = 'Members'
+        indexes = [
+            # Keyset pagination and the filtered listings
+            models.Index(fields=['-registration_date', '-id'], name='member_regdate_id'),
+            models.Index(fields=['membership_category', '-registration_date', '-id'],
+                         name='member_category_regdate'),
+            models.Index(fields=['county', '-registration_date', '-id'], name='member_county_regdate'),
+            # Duplicate email check on registration and location lookups
+            models.Index(fields=['email'], name='member_email'),
+            models.Index(fields=['county', 'constituency', 'ward'], name='member_location'),
+            # Search indexes are vendor specific, see migrations 0006 and 0007
+        ]
 
     def __str__(self):
         return f"{self.surname} {self.other_names} - {self.membership_number}"
@@ -68,6 +89,18 @@ class Member(models.Model):
     def get_full_name(self):
         return f"{self.surname} {self.other_names}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        from .stats import STAT_FIELDS
+
+        instance = super().from_db(db, field_names, values)
+        # The stat rows the member counts towards, so a save can move the
+        # counts without reading the row again (see membership.signals)
+        instance._stat_values = {
+            field: value for field, value in zip(field_names, values) if field in STAT_FIELDS
+        }
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.membership_number:
             self.membership_number = self.generate_membership_number()
@@ -75,38 +108,214 @@ class Member(models.Model):
 
     def generate_membership_number(self):
         """Generate membership number based on category"""
-        category_map = {
-            'Ordinary Membership': 'OM',
-            'Bronze Membership': 'BM',
-            'Life Membership': 'LM',
-            'Associate Membership': 'AM',
-            'Group Membership': 'GM',
-            'Honorary Membership': 'HM',
-        }
-
-        prefix = f"NPV/{category_map.get(self.membership_category, 'OM')}"
+        from .numbering import get_allocator
 
-        # Get the last member with this category
-        last_member = Member.objects.filter(
-            membership_number__startswith=prefix
-        ).order_by('-membership_number').first()
-
-        if last_member and last_member.membership_number:
-            try:
-                last_number = int(last_member.membership_number.split('-')[-1])
-                new_number = last_number + 1
-            except (ValueError, IndexError):
-                new_number = 1
-        else:
-            new_number = 1
-
-        return f"{prefix}-{new_number:03d}"
+        return get_allocator().next_number(self.membership_category)
 
 
 class MembershipCounter(models.Model):
-    """Track membership numbers for each category"""
+    """Track the last membership number issued for each category prefix"""
     category = models.CharField(max_length=50, unique=True)
     last_number = models.IntegerField(default=0)
 
     def __str__(self):
-        return f"{self.category}: {self.last_number}"
\ No newline at end of file
+        return f"{self.category}: {self.last_number}"
+
+
+class MemberStat(models.Model):
+    """Running member count for one value of a dashboard dimension"""
+    dimension = models.CharField(max_length=20)
+    value = models.CharField(max_length=200, blank=True)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value'], name='memberstat_dimension_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.value}: {self.count}"
+
+
+class CertificateJob(models.Model):
+    """Queued certificate rendering and email delivery for a member"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='certificate_jobs')
+    # Unguessable id for the public status URL
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    send_email = models.BooleanField(default=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='certjob_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"Certificate job {self.pk} for {self.member_id} ({self.status})"
+
+
+class CertificateBatch(models.Model):
+    """Background regeneration of certificates for a set of members"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    description = models.CharField(max_length=200, blank=True)
+    member_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = 'Certificate batches'
+
+    def __str__(self):
+        return self.description or f"Certificate batch {self.pk}"
+
+    @property
+    def percent_complete(self):
+        return int(100 * self.processed / self.total) if self.total else 100
+
+
+class EmailOutbox(models.Model):
+    """Outgoing email waiting to be sent (or retried) by the outbox sender"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    member = models.ForeignKey(Member, on_delete=models.SET_NULL, blank=True, null=True,
+                               related_name='emails')
+    to = models.EmailField()
+    provider = models.CharField(max_length=100, blank=True)
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    from_email = models.CharField(max_length=200, blank=True)
+    attachment_name = models.CharField(max_length=200, blank=True)
+    # Cleared once the message has been sent
+    attachment = models.BinaryField(blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        verbose_name = 'Outbox email'
+        verbose_name_plural = 'Email outbox'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='outbox_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+
+class IdempotencyRecord(models.Model):
+    """Stored response for a request sent with an ``Idempotency-Key`` header"""
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+
+    key = models.CharField(max_length=255)
+    # Request path the key was used on
+    scope = models.CharField(max_length=255)
+    # Who used it: 'user:<pk>' or 'ip:<client address>'
+    caller = models.CharField(max_length=64, default='')
+    # Hash of the request body, to reject a key reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PROCESSING)
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'caller', 'key'], name='idempotency_scope_caller_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.caller} {self.key} ({self.status})"
+
+
+class ArchivedFile(models.Model):
+    """Location of a certificate moved into a pack file (see ``membership.archive``)"""
+    # Certificate storage name, e.g. certificates/certificate_NPV/OM-001.pdf
+    name = models.CharField(max_length=255, unique=True)
+    pack = models.CharField(max_length=64)
+    # Byte offset and length of the file's data within the pack
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    crc32 = models.BigIntegerField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.pack}@{self.offset})"
+
+
+class RevokedCertificate(models.Model):
+    """Membership number whose signed QR codes must no longer verify"""
+    membership_number = models.CharField(max_length=20, unique=True)
+    reason = models.CharField(max_length=200, blank=True)
+    revoked_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.membership_number} (revoked)"
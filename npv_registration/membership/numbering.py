@@ -0,0 +1,218 @@
+# membership/numbering.py
+"""
+Membership number allocation backed by ``MembershipCounter``.
+
+Each category prefix (``OM``, ``BM``, ...) has one counter row. Numbers are
+taken with a single atomic ``UPDATE ... RETURNING`` where the database
+supports it, or an UPDATE followed by a read under the row lock otherwise,
+so issuing a number is O(1) and safe when several workers register members
+at the same time.
+
+With ``MEMBERSHIP_NUMBER_BLOCK_SIZE`` above 1 each process reserves a block of
+numbers at once and hands them out locally. That saves a round trip per
+registration at the cost of numbers being issued out of order across
+processes, and unused numbers being skipped when a process exits.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+
+from .models import Member, MembershipCounter
+
+CATEGORY_PREFIXES = {
+    'Ordinary Membership': 'OM',
+    'Bronze Membership': 'BM',
+    'Life Membership': 'LM',
+    'Associate Membership': 'AM',
+    'Group Membership': 'GM',
+    'Honorary Membership': 'HM',
+}
+
+
+def category_prefix(category):
+    """Short code used in membership numbers for a membership category"""
+    return CATEGORY_PREFIXES.get(category, 'OM')
+
+
+def format_membership_number(prefix, number):
+    return f"NPV/{prefix}-{number:03d}"
+
+
+def parse_membership_number(membership_number):
+    """Split ``NPV/OM-012`` into ``('OM', 12)``. Returns None if malformed."""
+    try:
+        head, number = membership_number.rsplit('-', 1)
+        return head.split('/', 1)[1], int(number)
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def highest_issued_number(members, prefix):
+    """Highest number issued for a prefix, compared numerically.
+
+    ``members`` is a Member queryset or manager.
+    """
+    highest = 0
+    numbers = members.filter(
+        membership_number__startswith=f"NPV/{prefix}-"
+    ).values_list('membership_number', flat=True)
+    for membership_number in numbers.iterator():
+        parsed = parse_membership_number(membership_number)
+        if parsed:
+            highest = max(highest, parsed[1])
+    return highest
+
+
+def _ensure_counter(prefix):
+    """Create the counter for a prefix, seeded from existing members"""
+    try:
+        with transaction.atomic():
+            MembershipCounter.objects.get_or_create(
+                category=prefix,
+                defaults={'last_number': highest_issued_number(Member.objects, prefix)},
+            )
+    except IntegrityError:
+        # Another worker created it first
+        pass
+
+
+@contextmanager
+def _atomic(conn):
+    """``transaction.atomic`` that also works on unregistered connections"""
+    if conn is connections[conn.alias]:
+        with transaction.atomic(using=conn.alias):
+            yield
+        return
+
+    conn.set_autocommit(False)
+    try:
+        yield
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.set_autocommit(True)
+
+
+def _update_returning(conn):
+    """Whether the database supports ``UPDATE ... RETURNING``"""
+    if conn.vendor == 'postgresql':
+        return True
+    if conn.vendor == 'sqlite':
+        return conn.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _reserve(conn, prefix, count):
+    """Advance the counter by ``count`` and return the new last number"""
+    table = conn.ops.quote_name(MembershipCounter._meta.db_table)
+
+    with conn.cursor() as cursor:
+        if _update_returning(conn):
+            cursor.execute(
+                f"UPDATE {table} SET last_number = last_number + %s "
+                f"WHERE category = %s RETURNING last_number",
+                [count, prefix],
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        # The UPDATE takes the row lock, so the SELECT in the same
+        # transaction reads our own increment
+        with _atomic(conn):
+            cursor.execute(
+                f"UPDATE {table} SET last_number = last_number + %s WHERE category = %s",
+                [count, prefix],
+            )
+            if not cursor.rowcount:
+                return None
+            cursor.execute(f"SELECT last_number FROM {table} WHERE category = %s", [prefix])
+            return cursor.fetchone()[0]
+
+
+def allocate_numbers(category, count=1):
+    """Reserve ``count`` consecutive numbers for a category.
+
+    Returns a ``range`` of the reserved integers. The counter is updated on
+    the default connection, so a reservation made inside a transaction is
+    rolled back with it and no number is wasted.
+    """
+    prefix = category_prefix(category)
+    # The wrapper itself, not the ``django.db.connection`` proxy, so that
+    # ``_atomic`` recognises it as the registered connection
+    conn = connections[DEFAULT_DB_ALIAS]
+    last = _reserve(conn, prefix, count)
+    if last is None:
+        _ensure_counter(prefix)
+        last = _reserve(conn, prefix, count)
+    return range(last - count + 1, last + 1)
+
+
+class MembershipNumberAllocator:
+    """Issue membership numbers, optionally from per-process reserved blocks.
+
+    Blocks are reserved on a dedicated autocommit connection, so a block
+    handed out locally stays reserved even if the registration that needed
+    it rolls back.
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _block_connection(self):
+        if self._connection is None:
+            self._connection = connections.create_connection(DEFAULT_DB_ALIAS)
+            # Only used while holding self._lock
+            self._connection.inc_thread_sharing()
+        return self._connection
+
+    def _reserve_block(self, category, prefix):
+        conn = self._block_connection()
+        last = _reserve(conn, prefix, self.block_size)
+        if last is None:
+            # No counter yet: create it, then fall back to a single number
+            # for this call since the new row may not be committed yet
+            _ensure_counter(prefix)
+            return iter(allocate_numbers(category))
+        return iter(range(last - self.block_size + 1, last + 1))
+
+    def next_number(self, category):
+        """Allocate the next membership number for a category"""
+        prefix = category_prefix(category)
+
+        if self.block_size <= 1:
+            return format_membership_number(prefix, allocate_numbers(category)[0])
+
+        with self._lock:
+            number = next(self._blocks.get(prefix, iter(())), None)
+            if number is None:
+                self._blocks[prefix] = self._reserve_block(category, prefix)
+                number = next(self._blocks[prefix])
+        return format_membership_number(prefix, number)
+
+    def close(self):
+        """Drop any locally held numbers and close the block connection"""
+        with self._lock:
+            self._blocks.clear()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator():
+    """Process-wide allocator for the configured block size"""
+    block_size = getattr(settings, 'MEMBERSHIP_NUMBER_BLOCK_SIZE', 1)
+    with _allocators_lock:
+        if block_size not in _allocators:
+            _allocators[block_size] = MembershipNumberAllocator(block_size)
+        return _allocators[block_size]
@@ -0,0 +1,234 @@
+# membership/offline_verifier.py
+"""
+Signed certificate QR codes and their offline verification.
+
+With ``QR_SIGNING_KEY_ID`` set, the verification URL in a certificate's QR
+code carries a token after the membership number::
+
+    https://npv.co.ke/verify/NPV/OM-001?t=k1.OM.20250101.q7Zp0m3x.<signature>
+
+The token holds the signing key id, the category prefix, the registration
+date and a 48-bit hash of the member's name, followed by an Ed25519
+signature over those fields and the membership number. Only the server holds
+the private keys; scanning stations get the public keys, which check a scan
+without asking the server but cannot sign one. The name is only hashed, so
+the code can confirm the name printed on the certificate without carrying
+it.
+
+Several keys can be valid at once: to rotate, sign with a new key id and
+keep the old key for verification until its certificates are regenerated.
+Revoked membership numbers are shipped as a Bloom filter; a miss proves a
+number is not revoked, a hit only means "possibly revoked" and has to be
+confirmed online.
+
+Apart from the optional ``cryptography`` package (needed to sign or check
+tokens) only the standard library is used, so scanning stations can run
+this module without Django.
+"""
+import base64
+import hashlib
+import hmac
+import math
+import os
+import re
+import struct
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:  # Signed QR codes disabled
+    Ed25519PrivateKey = None
+
+TOKEN_PARAM = 't'
+KEY_BYTES = 32
+NAME_HASH_BYTES = 6
+VERIFY_PATH_RE = re.compile(r'/verify/(?P<number>.+?)/?$')
+
+# Why a token did not verify
+MALFORMED = 'malformed'
+UNSIGNED = 'unsigned'
+UNKNOWN_KEY = 'unknown key'
+BAD_SIGNATURE = 'bad signature'
+POSSIBLY_REVOKED = 'possibly revoked'
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def name_hash(full_name):
+    """Short hash of a name, ignoring case and spacing"""
+    normalised = ' '.join(full_name.split()).casefold()
+    return b64encode(hashlib.sha256(normalised.encode()).digest()[:NAME_HASH_BYTES])
+
+
+def _require_cryptography():
+    if Ed25519PrivateKey is None:
+        raise RuntimeError('Signed QR codes require the cryptography package')
+
+
+def generate_key():
+    """A new private signing key, encoded for ``QR_SIGNING_KEYS``"""
+    _require_cryptography()
+    return b64encode(os.urandom(KEY_BYTES))
+
+
+@lru_cache(maxsize=None)
+def _private_key(key):
+    _require_cryptography()
+    return Ed25519PrivateKey.from_private_bytes(b64decode(key))
+
+
+@lru_cache(maxsize=None)
+def _public_key(key):
+    _require_cryptography()
+    return Ed25519PublicKey.from_public_bytes(b64decode(key))
+
+
+@lru_cache(maxsize=None)
+def public_key(key):
+    """The public key, for verifiers, of an encoded private key"""
+    return b64encode(_private_key(key).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw))
+
+
+def _message(membership_number, fields):
+    return '\x1f'.join([membership_number, *fields]).encode()
+
+
+def sign(key_id, key, membership_number, prefix, issued, full_name):
+    """Token for a certificate issued on the date ``issued``, signed with a private key"""
+    fields = [key_id, prefix, issued.strftime('%Y%m%d'), name_hash(full_name)]
+    signature = _private_key(key).sign(_message(membership_number, fields))
+    return '.'.join([*fields, b64encode(signature)])
+
+
+@dataclass
+class Verification:
+    """Outcome of checking a token"""
+    membership_number: str
+    # The signature matches a known key
+    valid: bool
+    reason: str = ''
+    key_id: str = ''
+    prefix: str = ''
+    issued: Optional[date] = None
+    name_hash: str = ''
+    possibly_revoked: bool = False
+
+    @property
+    def verified(self):
+        return self.valid and not self.possibly_revoked
+
+    def matches_name(self, full_name):
+        """Whether ``full_name`` is the name the certificate was signed for"""
+        return self.valid and hmac.compare_digest(self.name_hash, name_hash(full_name))
+
+
+def check(membership_number, token, keys, revocations=None):
+    """Verify ``token`` for ``membership_number`` with ``keys`` ({key id: public key})"""
+    parts = token.split('.')
+    if len(parts) != 5:
+        return Verification(membership_number, False, MALFORMED)
+    key_id, prefix, issued, digest, signature = parts
+    key = keys.get(key_id)
+    if key is None:
+        return Verification(membership_number, False, UNKNOWN_KEY, key_id=key_id)
+    try:
+        _public_key(key).verify(b64decode(signature), _message(membership_number, parts[:4]))
+    except (InvalidSignature, ValueError):
+        return Verification(membership_number, False, BAD_SIGNATURE, key_id=key_id)
+    try:
+        issued = datetime.strptime(issued, '%Y%m%d').date()
+    except ValueError:
+        return Verification(membership_number, False, MALFORMED, key_id=key_id)
+
+    result = Verification(membership_number, True, key_id=key_id, prefix=prefix, issued=issued, name_hash=digest)
+    if revocations is not None and membership_number in revocations:
+        result.possibly_revoked = True
+        result.reason = POSSIBLY_REVOKED
+    return result
+
+
+def parse_url(url):
+    """``(membership_number, token)`` from a scanned verification URL; either may be None"""
+    parts = urlsplit(url)
+    match = VERIFY_PATH_RE.search(unquote(parts.path))
+    token = parse_qs(parts.query).get(TOKEN_PARAM, [None])[0]
+    return (match.group('number') if match else None), token
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter of strings that serialises to bytes"""
+    HEADER = struct.Struct('>IB')
+
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001):
+        """Filter sized for ``capacity`` items at the given false positive rate"""
+        capacity = max(capacity, 1)
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        return cls(bits, max(1, round(bits / capacity * math.log(2))))
+
+    def positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.bits, self.hashes) + bytes(self.data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bits, hashes = cls.HEADER.unpack_from(data)
+        return cls(bits, hashes, data[cls.HEADER.size:])
+
+
+class OfflineVerifier:
+    """Check scanned QR codes without network access.
+
+    ``bundle`` is the JSON written by ``manage.py export_verifier_bundle``;
+    its keys are public keys.
+    """
+
+    def __init__(self, keys, revocations=None):
+        self.keys = keys
+        self.revocations = revocations
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        revocations = bundle.get('revocations')
+        if revocations:
+            revocations = BloomFilter.from_bytes(b64decode(revocations))
+        return cls(bundle['keys'], revocations or None)
+
+    def verify(self, membership_number, token):
+        return check(membership_number, token, self.keys, self.revocations)
+
+    def verify_url(self, url):
+        membership_number, token = parse_url(url)
+        if membership_number is None or token is None:
+            return Verification(membership_number or '', False, UNSIGNED)
+        return self.verify(membership_number, token)
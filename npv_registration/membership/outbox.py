@@ -0,0 +1,235 @@
+# membership/outbox.py
+"""
+Email outbox: certificate emails are stored in ``EmailOutbox`` and sent by
+the worker over one persistent SMTP connection.
+
+Queueing an email is a single INSERT, so registration never waits on SMTP.
+The sender claims due messages in batches and hands each batch to one
+``send_messages()`` call on an open connection, throttles each recipient
+provider (domain) to the rate in ``EMAIL_OUTBOX_RATE_LIMITS``, and retries
+failures with exponential backoff.
+
+Messages are fed to the backend one at a time, so each is marked sent as
+soon as the backend asks for the next one (Django's backends send messages
+in order as they iterate over them) and a crash mid-batch resends at most
+one message.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .emails import certificate_email
+from .metrics import stage
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def provider_for(address):
+    """Rate-limit bucket for a recipient, e.g. 'gmail.com'"""
+    return address.rpartition('@')[2].lower()
+
+
+def queue_email(message, member=None):
+    """Store a single-recipient EmailMessage with at most one (PDF) attachment"""
+    to = message.to[0]
+    name, content = message.attachments[0][:2] if message.attachments else ('', None)
+    return EmailOutbox.objects.create(
+        member=member,
+        to=to,
+        provider=provider_for(to),
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email or '',
+        attachment_name=name,
+        attachment=content,
+        max_attempts=getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5),
+    )
+
+
+def queue_certificate_email(member, pdf):
+    """Queue the certificate email with the already rendered PDF attached"""
+    return queue_email(certificate_email(member, pdf), member=member)
+
+
+def build_message(row, connection=None):
+    message = EmailMessage(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email or None,
+        to=[row.to],
+        connection=connection,
+    )
+    if row.attachment_name:
+        message.attach(row.attachment_name, bytes(row.attachment), 'application/pdf')
+    return message
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', 60)
+    maximum = getattr(settings, 'EMAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+def claim_messages(worker_id, limit=100):
+    """Claim up to ``limit`` due messages (same guarded UPDATE as certificate jobs)"""
+    now = timezone.now()
+    candidates = list(EmailOutbox.objects.filter(
+        status=EmailOutbox.STATUS_PENDING,
+        run_after__lte=now,
+    ).values_list('pk', flat=True)[:limit])
+
+    EmailOutbox.objects.filter(pk__in=candidates, status=EmailOutbox.STATUS_PENDING).update(
+        status=EmailOutbox.STATUS_SENDING,
+        locked_by=worker_id,
+        started_at=now,
+    )
+    return list(EmailOutbox.objects.filter(
+        pk__in=candidates, status=EmailOutbox.STATUS_SENDING, locked_by=worker_id, started_at=now,
+    ))
+
+
+def requeue_stale_messages(timeout=None):
+    """Return messages stuck in 'sending' (e.g. after a crash) to the queue"""
+    if timeout is None:
+        timeout = getattr(settings, 'EMAIL_OUTBOX_STALE_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return EmailOutbox.objects.filter(
+        status=EmailOutbox.STATUS_SENDING, started_at__lt=cutoff,
+    ).update(status=EmailOutbox.STATUS_PENDING, locked_by='')
+
+
+def round_robin(groups):
+    """a1, b1, a2, b2, a3 ... from lists [a1, a2, a3], [b1, b2]"""
+    groups = list(groups)
+    for i in range(max(map(len, groups), default=0)):
+        for group in groups:
+            if i < len(group):
+                yield group[i]
+
+
+class RateLimiter:
+    """Token bucket per provider; rates are messages per second"""
+
+    def __init__(self, rates=None):
+        if rates is None:
+            rates = getattr(settings, 'EMAIL_OUTBOX_RATE_LIMITS', {})
+        self.rates = rates
+        self.buckets = {}
+
+    def rate(self, provider):
+        return self.rates.get(provider, self.rates.get('*'))
+
+    def wait(self, provider):
+        rate = self.rate(provider)
+        if not rate:
+            return
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(provider, (rate, now))
+        tokens = min(rate, tokens + (now - updated) * rate)
+        if tokens < 1:
+            time.sleep((1 - tokens) / rate)
+            now = time.monotonic()
+            tokens = 1
+        self.buckets[provider] = (tokens - 1, now)
+
+
+class OutboxSender:
+    """Sends claimed outbox messages over one reused email connection"""
+
+    def __init__(self, worker_id, connection=None, rate_limiter=None):
+        self.worker_id = worker_id
+        self.connection = connection or get_connection()
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    def send_pending(self, limit=100):
+        """Send one batch of due messages. Returns ``(sent, failed)``."""
+        rows = claim_messages(self.worker_id, limit)
+        if not rows:
+            return 0, 0
+
+        # Interleave providers so one throttled domain does not stall the rest
+        by_provider = defaultdict(list)
+        for row in rows:
+            by_provider[row.provider].append(row)
+        queue = list(round_robin(by_provider.values()))
+        sent = failed = 0
+        while queue:
+            handed = []
+            try:
+                with stage('smtp'):
+                    self.connection.open()
+                    accepted = self.connection.send_messages(self.messages(queue, handed))
+            except Exception as e:
+                # Only the message being sent failed; the ones before it are marked sent
+                row = handed[-1] if handed else queue[0]
+                logger.exception('Outbox email %s to %s failed', row.pk, row.to)
+                self.record_failure(row, e)
+                sent += max(len(handed) - 1, 0)
+                failed += 1
+                # The SMTP session may be unusable; reconnect for the rest of the batch
+                self.close()
+            else:
+                if handed and accepted == len(handed):
+                    self.mark_sent(handed[-1])
+                    sent += len(handed)
+                else:
+                    # A backend failing silently: the last message may not have gone out
+                    row = handed[-1] if handed else queue[0]
+                    self.record_failure(row, RuntimeError('Message was not accepted'))
+                    sent += max(len(handed) - 1, 0)
+                    failed += 1
+            del queue[:max(len(handed), 1)]
+        return sent, failed
+
+    def messages(self, queue, handed):
+        """Yield ``queue`` as messages, marking each sent when the backend moves past it"""
+        for row in queue:
+            if handed:
+                self.mark_sent(handed[-1])
+            self.rate_limiter.wait(row.provider)
+            handed.append(row)
+            yield build_message(row, self.connection)
+
+    def mark_sent(self, row):
+        EmailOutbox.objects.filter(pk=row.pk).update(
+            status=EmailOutbox.STATUS_SENT,
+            sent_at=timezone.now(),
+            locked_by='',
+            attachment=None,
+        )
+
+    def record_failure(self, row, error):
+        attempts = row.attempts + 1
+        fields = {'attempts': attempts, 'last_error': str(error), 'locked_by': ''}
+        if attempts >= row.max_attempts:
+            fields['status'] = EmailOutbox.STATUS_FAILED
+        else:
+            fields.update(
+                status=EmailOutbox.STATUS_PENDING,
+                run_after=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+            )
+        EmailOutbox.objects.filter(pk=row.pk).update(**fields)
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            logger.warning('Could not close the email connection', exc_info=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def send_outbox(worker_id, limit=100, connection=None):
+    """Drain due messages once; returns ``(sent, failed)``"""
+    with OutboxSender(worker_id, connection) as sender:
+        return sender.send_pending(limit)
@@ -0,0 +1,151 @@
+# membership/pagination.py
+"""
+Keyset pagination for member listings.
+
+Pages are addressed by an opaque cursor holding the
+``(registration_date, id)`` (or ``(rank, id)`` for search) of the last row on
+the previous page, so fetching page 10,000 costs the same index range scan as
+fetching page 1 (no ``OFFSET``). Rows are returned newest first, matching
+``Member.Meta.ordering``, with ``id`` breaking ties between members
+registered in the same instant.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(value, pk, reverse=False):
+    position = {'v': value, 'i': pk}
+    if reverse:
+        position['r'] = 1
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(value, id, reverse)`` or raise ``NotFound``"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return position['v'], int(position['i']), bool(position.get('r'))
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise NotFound('Invalid cursor')
+
+
+class KeysetPagination(BasePagination):
+    """Descending pagination on ``(order_field, id)``, newest registrations first"""
+    order_field = 'registration_date'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def cursor_value(self, row):
+        """JSON-serializable ``order_field`` value of a row"""
+        return getattr(row, self.order_field).isoformat()
+
+    def parse_cursor_value(self, value):
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 50
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return min(requested, self.max_page_size) if requested > 0 else page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        field = self.order_field
+        cursor = request.query_params.get(self.cursor_query_param)
+        reverse = False
+        if cursor:
+            value, pk, reverse = decode_cursor(cursor)
+            value = self.parse_cursor_value(value)
+            # The plain range condition lets the planner seek the index
+            if reverse:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__gt': value}) | Q(pk__gt=pk),
+                    **{f'{field}__gte': value},
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__lt': value}) | Q(pk__lt=pk),
+                    **{f'{field}__lte': value},
+                )
+
+        if reverse:
+            queryset = queryset.order_by(field, 'pk')
+        else:
+            queryset = queryset.order_by(f'-{field}', '-pk')
+
+        # One extra row tells us whether there is another page
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = bool(cursor) if not reverse else has_more
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   encode_cursor(self.cursor_value(last), last.pk))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        first = self.page[0]
+        return replace_query_param(url, self.cursor_query_param,
+                                   encode_cursor(self.cursor_value(first), first.pk, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(KeysetPagination):
+    """Best match first, on the ``rank`` annotation added by ``search_members``"""
+    order_field = 'rank'
+
+    def cursor_value(self, row):
+        return row.rank
+
+    def parse_cursor_value(self, value):
+        if not isinstance(value, (int, float)):
+            raise NotFound('Invalid cursor')
+        return value
@@ -0,0 +1,177 @@
+# membership/query_budget.py
+"""
+Query budgets: the most SQL queries an endpoint may run per request.
+
+Views declare their budget by name::
+
+    @api_view(['GET'])
+    @query_budget('verify')
+    def verify_member(request, membership_number):
+        ...
+
+``query_budget`` also works as a context manager, with a name or a plain
+number. The budgets live in ``BUDGETS``; ``QUERY_BUDGETS`` in settings
+overrides them by name. Queries are counted through a database execute
+wrapper, in async views too, and transaction control statements (BEGIN,
+SAVEPOINT, ...) are not counted, so a budget means the same on SQLite and
+Postgres.
+
+What happens on an overrun depends on ``QUERY_BUDGET_MODE``: ``'log'``
+(the default) logs a warning, ``'strict'`` raises ``QueryBudgetExceeded``
+and ``'off'`` does not count at all. Tests turn on strict mode with
+``enforce_query_budgets()``, so an N+1 query or an extra ``exists()``
+fails the build without ever turning a request into a 500 in production.
+Either way the report lists every query with the lines of project code that
+ran it.
+"""
+import logging
+import os
+import re
+import sys
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.test.utils import override_settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Queries per request. Registration: ID and email uniqueness checks, the
+# number counter, the member INSERT, one upsert for the statistics rows and
+# the certificate job or outbox email (5 to 6). The worst case is the first
+# registration in a category: a missing number counter is rebuilt with a
+# failed UPDATE, a scan of the issued numbers, a get_or_create and the
+# UPDATE again, plus a SELECT where UPDATE ... RETURNING is not available.
+BUDGETS = {
+    'register': 11,
+    # The member; for a signed QR code the revocation list when it is not
+    # cached (and the member only with QR_VERIFY_ONLINE)
+    'verify': 2,
+    'member_list': 1,
+    'member_detail': 1,
+    # The member (lazy render mode, or a file missing from storage) and the archive index
+    'download_certificate': 2,
+}
+
+TRANSACTION_RE = re.compile(r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|START TRANSACTION)\b', re.I)
+STACK_DEPTH = 3
+MAX_SQL_LENGTH = 500
+_IGNORED_FILES = {__file__, metrics.__file__}
+
+_active = ContextVar('query_budgets', default=())
+
+
+class QueryBudgetExceeded(Exception):
+    """More queries ran than the budget allows (``QUERY_BUDGET_MODE = 'strict'``)"""
+
+
+def budget_mode():
+    return getattr(settings, 'QUERY_BUDGET_MODE', 'log')
+
+
+def budgets():
+    return {**BUDGETS, **getattr(settings, 'QUERY_BUDGETS', {})}
+
+
+def query_origin():
+    """The innermost lines of project code on the stack, innermost first"""
+    root = str(settings.BASE_DIR) + os.sep
+    origin = []
+    frame = sys._getframe(2)
+    while frame is not None and len(origin) < STACK_DEPTH:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and filename not in _IGNORED_FILES and 'site-packages' not in filename:
+            origin.append(f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return origin
+
+
+class QueryBudget:
+    """Count the queries run inside a block and compare them with a budget.
+
+    ``budget`` is a name from ``budgets()`` or a number. As a decorator
+    (of sync or async functions) each call gets its own count.
+    """
+
+    def __init__(self, budget, mode=None):
+        self.budget = budget
+        self.mode = mode
+        self.queries = []
+
+    @property
+    def name(self):
+        return self.budget if isinstance(self.budget, str) else 'block'
+
+    @property
+    def limit(self):
+        return budgets()[self.budget] if isinstance(self.budget, str) else self.budget
+
+    def __enter__(self):
+        self.queries = []
+        self.token = None
+        if (self.mode or budget_mode()) != 'off':
+            self.token = _active.set(_active.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is None:
+            return
+        _active.reset(self.token)
+        if exc_type is None and len(self.queries) > self.limit:
+            report = self.report()
+            if (self.mode or budget_mode()) == 'strict':
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+
+    def __call__(self, func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with QueryBudget(self.budget, self.mode):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with QueryBudget(self.budget, self.mode):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    def report(self):
+        lines = [f'Query budget "{self.name}" exceeded: {len(self.queries)} queries, budget {self.limit}']
+        for i, (sql, origin) in enumerate(self.queries, 1):
+            if len(sql) > MAX_SQL_LENGTH:
+                sql = sql[:MAX_SQL_LENGTH] + '...'
+            lines.append(f'  {i}. {sql}')
+            lines.extend(f'       at {line}' for line in origin or ['(no project code on the stack)'])
+        return '\n'.join(lines)
+
+
+def query_budget(budget, mode=None):
+    """Decorator or context manager enforcing a query budget (see module docstring)"""
+    return QueryBudget(budget, mode)
+
+
+def enforce_query_budgets():
+    """Strict mode for a test case or block: overruns raise ``QueryBudgetExceeded``"""
+    return override_settings(QUERY_BUDGET_MODE='strict')
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper recording queries for the active budgets"""
+    active = _active.get()
+    if active and not TRANSACTION_RE.match(sql):
+        entry = (sql, query_origin())
+        for budget in active:
+            budget.queries.append(entry)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
@@ -0,0 +1,76 @@
+# membership/registration.py
+"""
+Member registration as a single transaction.
+
+The membership number is allocated and the member inserted - certificate
+and QR code paths included - in one ``transaction.atomic`` block, so a
+failed registration rolls the number counter back with it and no number is
+burned. Writing certificate files and sending email cannot be rolled back,
+so they run from ``transaction.on_commit`` once the member exists. If
+rendering fails at that point the member stays registered and a
+certificate job is queued to retry it.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .certificate_cache import lazy_certificates
+from .certificate_generator import certificate_name, qr_code_name
+from .jobs import deliver_certificate, enqueue_certificate_job
+from .metrics import stage
+from .models import CertificateJob, Member
+from .numbering import get_allocator
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Registration:
+    """A registered member and what happened to its certificate"""
+    member: Optional[Member] = None
+    # Set when the certificate was queued for the worker
+    job: Optional[CertificateJob] = None
+    delivered: bool = False
+
+
+def deliver(registration):
+    """Render, write and email the certificate; queue a job if that fails"""
+    member = registration.member
+    try:
+        deliver_certificate(member)
+    except Exception:
+        logger.exception('Certificate delivery for %s failed, queued for retry', member.membership_number)
+        registration.job = enqueue_certificate_job(member)
+    else:
+        registration.delivered = True
+
+
+def register(serializer, asynchronous=None):
+    """Save a validated ``MemberSerializer`` and deliver the certificate.
+
+    With ``asynchronous`` (default ``CERTIFICATE_ASYNC``) the certificate
+    job is inserted in the same transaction; otherwise the certificate is
+    delivered once the transaction commits.
+    """
+    if asynchronous is None:
+        asynchronous = getattr(settings, 'CERTIFICATE_ASYNC', False)
+    registration = Registration()
+
+    with transaction.atomic():
+        with stage('allocate_number'):
+            number = get_allocator().next_number(serializer.validated_data['membership_category'])
+        fields = {'membership_number': number}
+        if not lazy_certificates():
+            fields.update(certificate=certificate_name(number), qr_code=qr_code_name(number))
+        with stage('save_member'):
+            registration.member = serializer.save(**fields)
+
+        if asynchronous:
+            registration.job = enqueue_certificate_job(registration.member)
+        else:
+            transaction.on_commit(lambda: deliver(registration))
+
+    return registration
@@ -0,0 +1,85 @@
+# membership/search.py
+"""
+Member search by name, phone, ID/passport, membership number or email.
+
+On Postgres every member carries a ``search_vector`` kept up to date by a
+database trigger (migration 0007), so prefix matching is a GIN index lookup,
+and typos in names are caught by pg_trgm word similarity on the trigram
+indexes from migration 0006. Other databases fall back to case-insensitive
+prefix matching.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Upper
+
+SEARCH_FIELDS = ('surname', 'other_names', 'membership_number', 'id_passport', 'phone', 'email')
+
+# Name columns matched with typo tolerance
+FUZZY_FIELDS = ('surname', 'other_names')
+
+MIN_TERM_LENGTH = 2
+
+
+def search_terms(term):
+    """Lower-cased words of a search string, e.g. 'NPV/OM-001' -> npv, om, 001"""
+    return re.findall(r'\w+', term.lower())
+
+
+def prefix_query(words):
+    # Words only contain \w characters, so they are safe in a raw tsquery
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config='simple')
+
+
+def _postgres_matches(queryset, term, words):
+    queryset = queryset.alias(**{f'{field}_upper': Upper(field) for field in FUZZY_FIELDS})
+    matches = Q(search_vector=prefix_query(words))
+    for field in FUZZY_FIELDS:
+        matches |= Q(**{f'{field}_upper__trigram_word_similar': term.upper()})
+    return queryset.filter(matches)
+
+
+def _any_field_startswith(value):
+    return Q(*[Q(**{f'{field}__istartswith': value}) for field in SEARCH_FIELDS], _connector=Q.OR)
+
+
+def _prefix_matches(queryset, term, words):
+    # The whole term as typed (e.g. NPV/OM-00), or every word starting some field
+    every_word = Q(*[_any_field_startswith(word) for word in words])
+    return queryset.filter(_any_field_startswith(term) | every_word)
+
+
+def match_members(queryset, term):
+    """Filter ``queryset`` to members matching ``term`` (unordered)"""
+    term = term.strip()
+    words = search_terms(term)
+    if not words:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        return _postgres_matches(queryset, term, words)
+    return _prefix_matches(queryset, term, words)
+
+
+def search_members(queryset, term):
+    """Matching members annotated with a ``rank`` (higher is better)"""
+    term = term.strip()
+    queryset = match_members(queryset, term)
+    words = search_terms(term)
+
+    if connection.vendor == 'postgresql':
+        rank = SearchRank(F('search_vector'), prefix_query(words))
+        for field in FUZZY_FIELDS:
+            rank += TrigramWordSimilarity(term, field)
+        # float8, so cursor values round-trip exactly
+        return queryset.annotate(rank=Cast(rank, FloatField()))
+
+    first = words[0]
+    return queryset.annotate(rank=Case(
+        When(Q(membership_number__iexact=term) | Q(id_passport__iexact=term), then=Value(3.0)),
+        When(surname__istartswith=first, then=Value(2.0)),
+        When(other_names__istartswith=first, then=Value(1.5)),
+        default=Value(1.0),
+        output_field=FloatField(),
+    ))
@@ -7,7 +7,7 @@ from datetime import date
 class MemberSerializer(serializers.ModelSerializer):
     class Meta:
         model = Member
-        fields = '__all__'
+        exclude = ['search_vector']
         read_only_fields = ['membership_number', 'registration_date', 'certificate', 'qr_code']
 
     def validate_dob(self, value):
@@ -47,6 +47,21 @@ class MemberSerializer(serializers.ModelSerializer):
         return value
 
 
+class MemberImportSerializer(MemberSerializer):
+    """
+    Row validation for bulk imports.
+
+    Uniqueness of ``id_passport`` and ``email`` is checked once per chunk by
+    the ``import_members`` command instead of with queries for every row.
+    """
+
+    class Meta(MemberSerializer.Meta):
+        extra_kwargs = {'id_passport': {'validators': []}}
+
+    def validate_email(self, value):
+        return value
+
+
 class MemberListSerializer(serializers.ModelSerializer):
     """Simplified serializer for listing members"""
     full_name = serializers.SerializerMethodField()
@@ -0,0 +1,61 @@
+# membership/signals.py
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import signing, stats, verification
+from .models import Member
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def invalidate_verification(sender, instance, **kwargs):
+    """Drop the cached verification payload (or cached 404) for the member.
+
+    Only once the change commits: a verification running meanwhile still
+    reads (and may cache) the old row, which this then clears.
+    """
+    number = instance.membership_number
+    transaction.on_commit(lambda: verification.invalidate(number))
+
+
+def stat_values(instance, update_fields=None):
+    """Loaded stat field values of ``instance``, limited to the saved fields"""
+    return {
+        field: value for field, value in instance.__dict__.items()
+        if field in stats.STAT_FIELDS and (update_fields is None or field in update_fields)
+    }
+
+
+@receiver(post_save, sender=Member)
+def update_stats(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Move the member's stat counts once the save commits.
+
+    The previous values come from what was loaded from the database (see
+    ``Member.from_db``); an instance that was not loaded is not counted
+    again and is left to ``reconcile_stats``.
+    """
+    if raw:
+        return
+    saved = stat_values(instance, update_fields)
+    previous = getattr(instance, '_stat_values', None)
+    if created:
+        stats.apply_on_commit(Counter(stats.member_keys(instance)))
+    elif previous is not None:
+        stats.apply_on_commit(stats.change_deltas(previous, saved))
+    instance._stat_values = {**(previous or {}), **saved}
+
+
+@receiver(post_delete, sender=Member)
+def uncount_member(sender, instance, **kwargs):
+    deltas = Counter(stats.member_keys(instance))
+    stats.apply_on_commit(Counter({key: -count for key, count in deltas.items()}))
+
+
+@receiver(post_delete, sender=Member)
+def revoke_certificate(sender, instance, **kwargs):
+    """Signed QR codes verify without the database; revoke a deleted member's"""
+    if instance.membership_number and signing.verify_keys():
+        signing.revoke(instance.membership_number, reason='Member deleted')
@@ -0,0 +1,186 @@
+# membership/signing.py
+"""
+Server side of the signed QR codes described in ``membership.offline_verifier``.
+
+New certificates are signed with the private key that ``QR_SIGNING_KEY_ID``
+names in ``QR_SIGNING_KEYS`` ({key id: private key}); signing is off while
+it is unset. Retired keys only need their public key, in ``QR_VERIFY_KEYS``
+({key id: public key}). Only public keys leave the server
+(``export_bundle``). ``verify_member``
+checks a token passed as ``?t=``: forged ones are rejected and valid ones
+are answered from the token's own fields (number, category, registration
+date), both without a database or cache lookup. ``QR_VERIFY_ONLINE`` opts in
+to answering valid scans with the full verification payload instead.
+
+Each process keeps the set of revoked numbers (``RevokedCertificate``) in
+memory for ``QR_REVOCATION_REFRESH`` seconds. The set is also kept that long
+in the verification cache, which ``revoke`` clears, so with a shared cache
+the table is read about once per interval for all workers and a revocation
+reaches them within that time. Scanning stations get the same numbers as a
+Bloom filter.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import RevokedCertificate
+from .numbering import CATEGORY_PREFIXES, parse_membership_number
+from .offline_verifier import (
+    BAD_SIGNATURE, BloomFilter, TOKEN_PARAM, b64encode, check, public_key, sign,
+)
+from .verification import dump, get_cache, get_verification
+
+logger = logging.getLogger(__name__)
+
+REVOCATIONS_CACHE_KEY = 'membership:revocations'
+PREFIX_CATEGORIES = {prefix: category for category, prefix in CATEGORY_PREFIXES.items()}
+
+_revocations = None
+_revocations_loaded_at = 0.0
+_revocations_lock = threading.Lock()
+
+INVALID = {
+    'success': False,
+    'verified': False,
+    'message': 'QR code signature is invalid'
+}
+
+REVOKED = {
+    'success': False,
+    'verified': False,
+    'message': 'Certificate has been revoked'
+}
+
+
+class UnknownSigningKey(ImproperlyConfigured):
+    """``QR_SIGNING_KEY_ID`` names a key missing from ``QR_SIGNING_KEYS``"""
+
+
+def signing_keys():
+    return getattr(settings, 'QR_SIGNING_KEYS', None) or {}
+
+
+def signing_key_id():
+    return getattr(settings, 'QR_SIGNING_KEY_ID', None)
+
+
+def verify_keys():
+    """``QR_VERIFY_KEYS`` plus the public keys of ``QR_SIGNING_KEYS``, {key id: public key}"""
+    keys = dict(getattr(settings, 'QR_VERIFY_KEYS', None) or {})
+    keys.update((key_id, public_key(key)) for key_id, key in signing_keys().items())
+    return keys
+
+
+def member_token(member):
+    """Token for the member's certificate, or None when signing is off"""
+    key_id = signing_key_id()
+    if not key_id:
+        return None
+    key = signing_keys().get(key_id)
+    if key is None:
+        raise UnknownSigningKey(f'QR_SIGNING_KEY_ID {key_id!r} is not in QR_SIGNING_KEYS')
+    prefix = (parse_membership_number(member.membership_number) or ('',))[0]
+    return sign(key_id, key, member.membership_number, prefix,
+                member.registration_date.date(), member.get_full_name())
+
+
+def signed_url(url, member):
+    """``url`` with the member's token appended, if signing is on"""
+    try:
+        token = member_token(member)
+    except UnknownSigningKey:
+        # The certificate still verifies online without a token
+        logger.exception('Certificate QR code for %s left unsigned', member.membership_number)
+        return url
+    return f'{url}?{TOKEN_PARAM}={token}' if token else url
+
+
+def build_revocations(numbers):
+    revocations = BloomFilter.for_capacity(max(len(numbers), 1000))
+    for number in numbers:
+        revocations.add(number)
+    return revocations
+
+
+def revoked_numbers():
+    """This process's set of revoked membership numbers"""
+    global _revocations, _revocations_loaded_at
+    refresh = getattr(settings, 'QR_REVOCATION_REFRESH', 60)
+    with _revocations_lock:
+        if _revocations is None or time.monotonic() - _revocations_loaded_at > refresh:
+            cache = get_cache()
+            numbers = cache.get(REVOCATIONS_CACHE_KEY)
+            if numbers is None:
+                numbers = frozenset(RevokedCertificate.objects.values_list('membership_number', flat=True))
+                cache.set(REVOCATIONS_CACHE_KEY, numbers, refresh)
+            _revocations = numbers
+            _revocations_loaded_at = time.monotonic()
+        return _revocations
+
+
+def reset_revocations():
+    """Reload the revoked numbers from the table on next use, in every process"""
+    global _revocations
+    get_cache().delete(REVOCATIONS_CACHE_KEY)
+    with _revocations_lock:
+        _revocations = None
+
+
+def revoke(membership_number, reason=''):
+    """Stop the member's signed QR codes from verifying"""
+    RevokedCertificate.objects.get_or_create(membership_number=membership_number, defaults={'reason': reason})
+    transaction.on_commit(reset_revocations)
+
+
+def export_bundle():
+    """Public keys and revocation filter for ``OfflineVerifier.from_bundle``"""
+    numbers = list(RevokedCertificate.objects.values_list('membership_number', flat=True))
+    return {
+        'keys': verify_keys(),
+        'revocations': b64encode(build_revocations(numbers).to_bytes()),
+    }
+
+
+def signed_payload(result):
+    """Verification payload built from a valid token's fields"""
+    return {
+        'success': True,
+        'verified': True,
+        'signed': True,
+        'data': {
+            'membership_number': result.membership_number,
+            'category': PREFIX_CATEGORIES.get(result.prefix, ''),
+            'registration_date': result.issued.strftime('%B %d, %Y'),
+        }
+    }
+
+
+def get_signed_verification(membership_number, token):
+    """``(status_code, json_bytes)`` for a signed scan, or None to look it up instead.
+
+    Tokens that are malformed or signed with an unknown key fall back to the
+    regular lookup; a wrong signature is rejected.
+    """
+    keys = verify_keys()
+    if not keys:
+        return None
+    result = check(membership_number, token, keys, revoked_numbers())
+    if result.reason == BAD_SIGNATURE:
+        return 403, dump(INVALID)
+    if not result.valid:
+        return None
+    if result.possibly_revoked:
+        # An exact set here, unlike a scanning station's Bloom filter
+        return 410, dump(REVOKED)
+    if not getattr(settings, 'QR_VERIFY_ONLINE', False):
+        return 200, dump(signed_payload(result))
+
+    # The same payload as an unsigned scan (name, county, ...), marked signed
+    status_code, body = get_verification(membership_number)
+    if status_code != 200:
+        return status_code, body
+    return 200, body[:-1] + b',"signed":true}'
@@ -0,0 +1,198 @@
+# membership/stats.py
+"""
+Pre-aggregated membership counts for dashboards.
+
+``MemberStat`` holds one row per (dimension, value), e.g. ('county',
+'Nairobi'), kept current by the ``Member`` signals in ``membership.signals``
+and by ``record_members`` for bulk inserts. The signals apply their deltas
+once the saving transaction commits, so a registration does not hold locks
+on the few hot stat rows (and with them the number counter) while it
+finishes. Writes that bypass both (``QuerySet.update``, raw SQL, a crash
+between commit and the update) are corrected by the ``reconcile_stats``
+command, which rebuilds the table with ``GROUP BY``.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Member, MemberStat
+
+# Dimension name -> Member field
+DIMENSIONS = {
+    'county': 'county',
+    'constituency': 'constituency',
+    'ward': 'ward',
+    'category': 'membership_category',
+    'gender': 'gender',
+    'special_interest': 'special_interest',
+    'day': 'registration_date',
+}
+
+# Fields whose changes move a member between stat rows
+STAT_FIELDS = set(DIMENSIONS.values())
+
+CACHE_KEY = 'membership:stats'
+
+
+def _day(value):
+    return timezone.localdate(value).isoformat() if value else ''
+
+
+def _day_key(day):
+    return day.isoformat() if day else ''
+
+
+def stat_key(dimension, value):
+    """``(dimension, value)`` of the stat row a field value counts towards"""
+    return dimension, _day(value) if dimension == 'day' else value or ''
+
+
+def member_keys(values):
+    """``(dimension, value)`` pairs a member counts towards.
+
+    ``values`` is a Member or a dict of its field values.
+    """
+    get = values.get if isinstance(values, dict) else lambda field: getattr(values, field)
+    return [stat_key(dimension, get(field)) for dimension, field in DIMENSIONS.items()]
+
+
+def change_deltas(old, new):
+    """Deltas moving a member from ``old`` to ``new`` field values (dicts).
+
+    Fields missing from either dict (deferred and never loaded) are
+    treated as unchanged.
+    """
+    deltas = Counter()
+    for dimension, field in DIMENSIONS.items():
+        if field in old and field in new:
+            before, after = stat_key(dimension, old[field]), stat_key(dimension, new[field])
+            if before != after:
+                deltas[before] -= 1
+                deltas[after] += 1
+    return deltas
+
+
+def _upsert_deltas(rows):
+    """Add ``[(dimension, value, delta)]`` to the stat rows in one statement"""
+    table = connection.ops.quote_name(MemberStat._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (dimension, value, count, updated_at) VALUES {values} "
+            f"ON CONFLICT (dimension, value) DO UPDATE SET "
+            f"count = {table}.count + EXCLUDED.count, updated_at = EXCLUDED.updated_at",
+            [param for row in rows for param in (*row, now)],
+        )
+
+
+def apply_deltas(deltas):
+    """Add ``{(dimension, value): delta}`` to the stat rows"""
+    # Sorted, so concurrent writers lock the rows in the same order
+    rows = [(dimension, value, delta) for (dimension, value), delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    if connection.vendor in ('postgresql', 'sqlite'):
+        # INSERT ... ON CONFLICT DO UPDATE creates missing rows in the same statement
+        _upsert_deltas(rows)
+        return
+
+    for dimension, value, delta in rows:
+        updated = MemberStat.objects.filter(dimension=dimension, value=value).update(count=F('count') + delta)
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                MemberStat.objects.create(dimension=dimension, value=value, count=delta)
+        except IntegrityError:
+            # Created concurrently
+            MemberStat.objects.filter(dimension=dimension, value=value).update(count=F('count') + delta)
+
+
+def apply_on_commit(deltas):
+    """``apply_deltas`` once the current transaction commits (now outside one)"""
+    if any(deltas.values()):
+        transaction.on_commit(lambda: apply_deltas(deltas))
+
+
+def record_members(members, sign=1):
+    """Count (or with ``sign=-1`` uncount) members inserted without signals"""
+    deltas = Counter()
+    for member in members:
+        for key in member_keys(member):
+            deltas[key] += sign
+    apply_deltas(deltas)
+
+
+def live_counts(members=None):
+    """``{(dimension, value): count}`` aggregated from the Member table"""
+    counts = Counter()
+    members = (Member.objects if members is None else members).order_by()
+    for dimension, field in DIMENSIONS.items():
+        if dimension == 'day':
+            rows = members.annotate(key=TruncDate(field)).values('key').annotate(n=Count('pk'))
+            for row in rows:
+                counts[dimension, _day_key(row['key'])] += row['n']
+        else:
+            # NULL and '' are both counted as ''
+            for row in members.values(field).annotate(n=Count('pk')):
+                counts[dimension, row[field] or ''] += row['n']
+    return counts
+
+
+def reconcile(dry_run=False):
+    """Rebuild MemberStat from live counts; returns the keys that were off"""
+    with transaction.atomic():
+        expected = live_counts()
+        stored = {
+            (dimension, value): (pk, count)
+            for pk, dimension, value, count in
+            MemberStat.objects.select_for_update().values_list('pk', 'dimension', 'value', 'count')
+        }
+        drift = {}
+        for key in expected.keys() | stored.keys():
+            before, after = stored.get(key, (None, 0))[1], expected.get(key, 0)
+            if before != after:
+                drift[key] = (before, after)
+        if dry_run or not drift:
+            return drift
+
+        stale = [stored[key][0] for key in drift if key not in expected]
+        MemberStat.objects.filter(pk__in=stale).delete()
+        MemberStat.objects.bulk_create(
+            [MemberStat(dimension=dimension, value=value, count=expected[dimension, value])
+             for dimension, value in drift if (dimension, value) in expected],
+            update_conflicts=True,
+            unique_fields=['dimension', 'value'],
+            update_fields=['count'],
+        )
+    cache.delete(CACHE_KEY)
+    return drift
+
+
+def get_stats(dimensions=None):
+    """Counts per dimension, e.g. ``{'total': 10, 'county': {'Nairobi': 4, ...}}``"""
+    dimensions = list(dimensions or DIMENSIONS)
+    stats = {dimension: {} for dimension in dimensions}
+    for dimension, value, count in (MemberStat.objects
+                                    .filter(dimension__in=dimensions, count__gt=0)
+                                    .order_by('dimension', 'value')
+                                    .values_list('dimension', 'value', 'count')):
+        stats[dimension][value] = count
+
+    total = MemberStat.objects.filter(dimension='category').values_list('count', flat=True)
+    return {'total': sum(total), **stats}
+
+
+def cached_stats():
+    """``get_stats()`` for all dimensions, cached for ``STATS_CACHE_TIMEOUT`` seconds"""
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = get_stats()
+        cache.set(CACHE_KEY, stats, getattr(settings, 'STATS_CACHE_TIMEOUT', 60))
+    return stats
@@ -0,0 +1,253 @@
+# membership/storage.py
+"""
+Storage backends for certificate PDFs and QR codes.
+
+All certificate files go through ``certificate_storage()`` (the
+``"certificates"`` entry in ``STORAGES``). File names stay the same in the
+database (``certificates/certificate_NPV/OM-001.pdf``); the backends place
+them under hash-sharded prefixes, e.g. ``certificates/3f/a2/...``, so no
+directory ends up holding millions of files.
+
+``ShardedFileSystemStorage`` writes to a temporary file and renames it into
+place, so readers never see a half-written certificate. Files still in the
+old flat layout are found until ``reshard_certificates`` has moved them.
+``S3CertificateStorage`` keeps them in an S3-compatible bucket (AWS, MinIO)
+and needs the optional ``boto3`` package.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from collections import Counter
+from functools import cached_property
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # S3 storage disabled
+    boto3 = None
+
+STORAGE_ALIAS = 'certificates'
+
+
+def certificate_storage():
+    """Storage for certificate and QR code files"""
+    return storages[STORAGE_ALIAS]
+
+
+def shard_name(name, depth=2, width=2):
+    """``certificates/x/y.pdf`` -> ``certificates/<h1>/<h2>/x/y.pdf``.
+
+    The shards are the leading hex digits of a SHA-1 of the whole name, so
+    files spread evenly over ``16 ** (depth * width)`` directories per
+    top-level folder.
+    """
+    top, sep, rest = name.partition('/')
+    if not sep:
+        top, rest = '', name
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    shards = [digest[i * width:(i + 1) * width] for i in range(depth)]
+    return '/'.join([part for part in [top] if part] + shards + [rest])
+
+
+@deconstructible(path='membership.storage.ShardedFileSystemStorage')
+class ShardedFileSystemStorage(FileSystemStorage):
+    """Local storage with hash-sharded directories and atomic writes"""
+
+    def __init__(self, depth=2, width=2, legacy_fallback=True, **kwargs):
+        # Certificate names are deterministic; regenerating replaces the file
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+        self.depth = depth
+        self.width = width
+        self.legacy_fallback = legacy_fallback
+
+    def sharded_path(self, name):
+        """Absolute path of ``name`` in the sharded layout"""
+        return super().path(shard_name(name, self.depth, self.width))
+
+    def legacy_path(self, name):
+        """Absolute path of ``name`` in the old flat layout"""
+        return super().path(name)
+
+    def path(self, name):
+        path = self.sharded_path(name)
+        if self.legacy_fallback and not os.path.exists(path):
+            legacy = self.legacy_path(name)
+            if os.path.exists(legacy):
+                return legacy
+        return path
+
+    def _save(self, name, content):
+        path = self.sharded_path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        # A rewritten legacy file now lives in the sharded layout
+        legacy = self.legacy_path(name)
+        if legacy != path and os.path.isfile(legacy):
+            os.remove(legacy)
+        return name
+
+    def url(self, name):
+        physical = os.path.relpath(self.path(name), self.location)
+        return super().url(physical.replace(os.sep, '/'))
+
+
+@deconstructible(path='membership.storage.S3CertificateStorage')
+class S3CertificateStorage(Storage):
+    """Certificates in an S3-compatible bucket; needs ``boto3``.
+
+    Objects are keyed ``<prefix><sharded name>``. S3 only exposes an object
+    once it has been uploaded in full, so writes are atomic as well.
+    ``url()`` returns a presigned GET URL valid for ``querystring_expire``
+    seconds.
+    """
+
+    def __init__(self, bucket=None, prefix='', endpoint_url=None, region_name=None,
+                 access_key=None, secret_key=None, querystring_expire=3600, depth=2, width=2):
+        if boto3 is None:
+            raise ImproperlyConfigured('S3CertificateStorage requires the boto3 package')
+        if not bucket:
+            raise ImproperlyConfigured('S3CertificateStorage needs a bucket')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.querystring_expire = querystring_expire
+        self.depth = depth
+        self.width = width
+
+    @cached_property
+    def client(self):
+        return boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            region_name=self.region_name,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+        )
+
+    def key(self, name):
+        return self.prefix + shard_name(name, self.depth, self.width)
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def _open(self, name, mode='rb'):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name) from e
+            raise
+        # Stream the body rather than reading the whole object into memory
+        f = File(response['Body'], name=name)
+        f.size = response['ContentLength']
+        return f
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(content, self.bucket, self.key(name), ExtraArgs={'ContentType': content_type})
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Overwrite, like ShardedFileSystemStorage
+        return name
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self._head(name)['LastModified']
+
+    def url(self, name):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name)},
+            ExpiresIn=self.querystring_expire,
+        )
+
+
+def reshard(names, source, storage=None, dry_run=False, delete_source=False):
+    """Move files named ``names`` from the flat layout under ``source`` into ``storage``.
+
+    On ``ShardedFileSystemStorage`` files are renamed in place (copied if
+    ``source`` is on another filesystem); other storages get an upload and
+    the source file is kept unless ``delete_source``. Returns a ``Counter``
+    of ``moved``, ``present`` and ``missing``.
+    """
+    storage = storage or certificate_storage()
+    counts = Counter()
+    for name in names:
+        src = os.path.join(source, name)
+        if isinstance(storage, ShardedFileSystemStorage):
+            present = os.path.exists(storage.sharded_path(name))
+        else:
+            present = storage.exists(name)
+
+        if present:
+            counts['present'] += 1
+            continue
+        if not os.path.isfile(src):
+            counts['missing'] += 1
+            continue
+        counts['moved'] += 1
+        if dry_run:
+            continue
+
+        remove_source = delete_source
+        if isinstance(storage, ShardedFileSystemStorage):
+            dest = storage.sharded_path(name)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                os.replace(src, dest)
+                continue
+            except OSError:
+                # Different filesystem: copy, then remove the source
+                remove_source = True
+        with open(src, 'rb') as f:
+            storage.save(name, File(f))
+        if remove_source and os.path.exists(src):
+            os.remove(src)
+    return counts
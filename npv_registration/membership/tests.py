@@ -1,3 +1,1626 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import qrcode
+from asgiref.sync import sync_to_async
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+from . import archive, certificate_cache, certificate_generator
+from .batch import CertificateRenderPool
+from .benchmarks import bench_verify, compare, member_payload, seed_members
+from .certificate_generator import CertificateGenerator, certificate_name, qr_code_name, write_certificate_files
+from .client import ScanBatcher
+from .fileserving import serve_file, serve_storage_file
+from .importer import Checkpoint, ImportResult, MemberImporter
+from .jobs import (
+    claim_batch, claim_jobs, enqueue_certificate_job, process_batch, process_job, requeue_stale_jobs, retry_delay,
+)
+from .models import (
+    ArchivedFile, CertificateBatch, CertificateJob, EmailOutbox, IdempotencyRecord, Member, MembershipCounter, MemberStat,
+)
+from .outbox import RateLimiter, queue_certificate_email, send_outbox
+from .query_budget import QueryBudgetExceeded, enforce_query_budgets, query_budget
+from .numbering import MembershipNumberAllocator, allocate_numbers, parse_membership_number
+from .offline_verifier import BloomFilter, Ed25519PrivateKey, OfflineVerifier, b64encode, parse_url
+from . import metrics, signing, stats, verification
+from .stats import get_stats
+from . import storage as storage_module
+from .storage import S3CertificateStorage, ShardedFileSystemStorage, certificate_storage, reshard, shard_name
+from .verification import get_cache
+
+
+def make_member(i, **fields):
+    """Unsaved member with valid data for the i-th test member"""
+    data = {
+        'surname': f'Surname{i}',
+        'other_names': f'Other {i}',
+        'id_passport': f'ID{i:08d}',
+        'phone': f'+2547{i:08d}',
+        'gender': 'Female',
+        'dob': date(1990, 1, 1),
+        'special_interest': 'None',
+        'county': 'Nairobi',
+        'constituency': 'Westlands',
+        'ward': 'Parklands',
+        'membership_category': 'Ordinary Membership',
+    }
+    data.update(fields)
+    return Member(**data)
+
+
+class MembershipNumberTests(TestCase):
+    def test_numbers_are_sequential_per_category(self):
+        first = make_member(1)
+        first.save()
+        second = make_member(2)
+        second.save()
+        life = make_member(3, membership_category='Life Membership')
+        life.save()
+
+        self.assertEqual(first.membership_number, 'NPV/OM-001')
+        self.assertEqual(second.membership_number, 'NPV/OM-002')
+        self.assertEqual(life.membership_number, 'NPV/LM-001')
+
+    def test_numbers_past_999_compare_numerically(self):
+        make_member(1, membership_number='NPV/OM-999').save()
+        make_member(2, membership_number='NPV/OM-1000').save()
+        MembershipCounter.objects.all().delete()
+
+        member = make_member(3)
+        member.save()
+
+        self.assertEqual(member.membership_number, 'NPV/OM-1001')
+
+    def test_update_then_select_without_returning(self):
+        with mock.patch('membership.numbering._update_returning', return_value=False):
+            members = [make_member(i) for i in (1, 2)]
+            for member in members:
+                member.save()
+
+        self.assertEqual([member.membership_number for member in members], ['NPV/OM-001', 'NPV/OM-002'])
+        self.assertEqual(MembershipCounter.objects.get(category='OM').last_number, 2)
+
+    def test_block_allocator_reserves_ahead(self):
+        allocator = MembershipNumberAllocator(block_size=10)
+        try:
+            numbers = [allocator.next_number('Bronze Membership') for _ in range(3)]
+        finally:
+            allocator.close()
+
+        self.assertEqual(numbers, ['NPV/BM-001', 'NPV/BM-002', 'NPV/BM-003'])
+        self.assertEqual(MembershipCounter.objects.get(category='BM').last_number, 10)
+
+
+class MembershipNumberStressTests(TransactionTestCase):
+    threads = 16
+    per_thread = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('In-memory SQLite cannot be written from several threads')
+
+    def _run_threads(self, target):
+        def run(i):
+            try:
+                return target(i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return [result for chunk in pool.map(run, range(self.threads)) for result in chunk]
+
+    def test_concurrent_allocations_are_unique_and_gapless(self):
+        allocate_numbers('Ordinary Membership')
+        numbers = self._run_threads(
+            lambda i: [allocate_numbers('Ordinary Membership')[0] for _ in range(self.per_thread)]
+        )
+
+        total = self.threads * self.per_thread
+        self.assertEqual(sorted(numbers), list(range(2, total + 2)))
+
+    def test_concurrent_registrations_get_unique_numbers(self):
+        MembershipCounter.objects.create(category='OM')
+
+        def register(i):
+            members = []
+            for j in range(self.per_thread):
+                member = make_member(i * self.per_thread + j)
+                member.save()
+                members.append(member.membership_number)
+            return members
+
+        numbers = self._run_threads(register)
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(Member.objects.count(), len(numbers))
+
+    def test_concurrent_block_allocators_do_not_overlap(self):
+        allocate_numbers('Group Membership')
+
+        def allocate(i):
+            allocator = MembershipNumberAllocator(block_size=8)
+            try:
+                return [parse_membership_number(allocator.next_number('Group Membership'))[1]
+                        for _ in range(self.per_thread)]
+            finally:
+                allocator.close()
+
+        numbers = self._run_threads(allocate)
+
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertNotIn(1, numbers)
+
+
+@override_settings(CERTIFICATE_JOB_RETRY_DELAY=30, CERTIFICATE_JOB_MAX_RETRY_DELAY=100)
+class CertificateJobTests(TestCase):
+    def make_job(self, i, **fields):
+        member = make_member(i)
+        member.save()
+        job = enqueue_certificate_job(member)
+        if fields:
+            CertificateJob.objects.filter(pk=job.pk).update(**fields)
+            job.refresh_from_db()
+        return job
+
+    def test_claim_takes_due_jobs_once(self):
+        due = self.make_job(1)
+        self.make_job(2, run_after=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual([job.pk for job in claim_jobs('worker-1')], [due.pk])
+        self.assertEqual(claim_jobs('worker-2'), [])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.locked_by), (CertificateJob.STATUS_RUNNING, 'worker-1'))
+
+    def test_failures_back_off_then_fail(self):
+        self.assertEqual([retry_delay(n) for n in (1, 2, 3, 4)], [30, 60, 100, 100])
+        job = self.make_job(1, max_attempts=2)
+
+        with mock.patch('membership.jobs.run_job', side_effect=RuntimeError('SMTP down')), \
+                self.assertLogs('membership.jobs', 'ERROR'):
+            [job] = claim_jobs('worker-1')
+            started = timezone.now()
+            self.assertFalse(process_job(job))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.locked_by), (CertificateJob.STATUS_PENDING, 1, ''))
+            self.assertGreaterEqual(job.run_after, started + timedelta(seconds=30))
+            self.assertEqual(claim_jobs('worker-1'), [])
+
+            CertificateJob.objects.update(run_after=timezone.now())
+            [job] = claim_jobs('worker-1')
+            self.assertFalse(process_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (CertificateJob.STATUS_FAILED, 2))
+        self.assertEqual(job.last_error, 'SMTP down')
+
+    def test_stale_jobs_are_requeued(self):
+        stale = self.make_job(1, status=CertificateJob.STATUS_RUNNING, locked_by='dead:1',
+                              started_at=timezone.now() - timedelta(minutes=20))
+        running = self.make_job(2, status=CertificateJob.STATUS_RUNNING, locked_by='alive:1',
+                                started_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(timeout=600), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_by), (CertificateJob.STATUS_PENDING, ''))
+        self.assertEqual(running.status, CertificateJob.STATUS_RUNNING)
+        self.assertEqual([job.pk for job in claim_jobs('worker-1')], [stale.pk])
+
+    def test_status_is_looked_up_by_token(self):
+        job = self.make_job(1, status=CertificateJob.STATUS_FAILED, last_error='smtp.example.com refused')
+
+        response = self.client.get(f'/api/jobs/{job.token}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], 'failed')
+        self.assertNotIn('smtp.example.com', response.content.decode())
+        self.assertEqual(self.client.get(f'/api/jobs/{job.pk}/').status_code, 404)
+
+
+class CertificateBatchTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.members = [make_member(i) for i in range(1, 4)]
+        for member in self.members:
+            member.save()
+
+    def test_claim_and_process_batch(self):
+        batch = CertificateBatch.objects.create(member_ids=[member.pk for member in self.members],
+                                                total=len(self.members))
+
+        claimed = claim_batch('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.locked_by),
+                         (batch.pk, CertificateBatch.STATUS_RUNNING, 'worker-1'))
+        self.assertIsNone(claim_batch('worker-2'))
+
+        broken = self.members[1].pk
+        real_write = write_certificate_files
+
+        def write(member):
+            if member.pk == broken:
+                raise RuntimeError('font missing')
+            return real_write(member)
+
+        with mock.patch('membership.batch.write_certificate_files', write), CertificateRenderPool(1) as pool:
+            self.assertTrue(process_batch(claimed, pool, chunk_size=2))
+
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.processed, batch.failed, batch.locked_by),
+                         (CertificateBatch.STATUS_DONE, 3, 1, ''))
+        self.assertEqual(batch.errors, [f'{self.members[1].membership_number}: font missing'])
+        certificates = dict(Member.objects.values_list('pk', 'certificate'))
+        self.assertEqual(certificates[self.members[0].pk], certificate_name(self.members[0].membership_number))
+        self.assertEqual(certificates[broken], '')
+        self.assertTrue(certificate_storage().exists(certificate_name(self.members[2].membership_number)))
+
+
+class CertificateCacheTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=media_root, CERTIFICATE_RENDER_MODE='lazy',
+                                  CERTIFICATE_CACHE_LOCK_DIR=lock_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_concurrent_requests_render_once(self):
+        member = make_member(1)
+        member.save()
+        renders = []
+
+        def render_pdf(generator):
+            renders.append(generator.member.membership_number)
+            time.sleep(0.05)
+            return b'%PDF-cached'
+
+        with mock.patch.object(CertificateGenerator, 'render_pdf', render_pdf), \
+                ThreadPoolExecutor(max_workers=8) as pool:
+            names = list(pool.map(lambda _: certificate_cache.get_certificate_name(member), range(8)))
+
+        self.assertEqual(renders, [member.membership_number])
+        self.assertEqual(set(names), {certificate_cache.cache_name(certificate_cache.content_key(member))})
+        with certificate_storage().open(names[0]) as f:
+            self.assertEqual(f.read(), b'%PDF-cached')
+
+    def test_eviction_drops_least_recently_used(self):
+        storage = certificate_storage()
+        names = [certificate_cache.cache_name(f'{i:064x}') for i in range(4)]
+        for i, name in enumerate(names):
+            storage.save(name, ContentFile(b'x' * 100))
+            path = storage.path(name)
+            os.utime(path, (1000 + i, os.stat(path).st_mtime))
+        # Reading an entry makes it the most recently used
+        certificate_cache._touch(storage, names[0])
+
+        self.assertEqual(certificate_cache.evict(max_bytes=300), 2)
+        self.assertEqual([storage.exists(name) for name in names], [True, False, False, True])
+        self.assertEqual(certificate_cache.evict(max_bytes=300), 0)
+
+
+class CertificateRenderTests(TestCase):
+    def test_qr_code_is_encoded_once(self):
+        member = make_member(1)
+        member.save()
+
+        for vector in (True, False):
+            with self.subTest(vector=vector), self.settings(CERTIFICATE_QR_VECTOR=vector), \
+                    mock.patch('qrcode.QRCode.add_data', autospec=True,
+                               side_effect=qrcode.QRCode.add_data) as add_data, \
+                    mock.patch('qrcode.QRCode.make_image', autospec=True,
+                               side_effect=qrcode.QRCode.make_image) as make_image:
+                result = CertificateGenerator(member).render()
+
+            add_data.assert_called_once()
+            make_image.assert_called_once()
+            self.assertTrue(result.pdf.startswith(b'%PDF'))
+            self.assertTrue(result.qr_png.startswith(b'\x89PNG'))
+            self.assertEqual(add_data.call_args.args[1], result.verification_url)
+
+
+@skipUnless(PdfReader, 'pypdf is not installed')
+class CertificateTemplateTests(TestCase):
+    def render(self, member, template):
+        with self.settings(CERTIFICATE_TEMPLATE_CACHE=template):
+            pdf = PdfReader(io.BytesIO(CertificateGenerator(member).render_pdf()))
+        return [' '.join(page.extract_text().split()) for page in pdf.pages]
+
+    def test_template_matches_redrawn_certificate(self):
+        member = make_member(1)
+        member.save()
+
+        redrawn = self.render(member, template=False)
+        cached = self.render(member, template=True)
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(cached, redrawn)
+        for text in ("NATIONAL PEOPLE'S VOICE", 'Secretary General', member.get_full_name().upper(),
+                     member.membership_number):
+            self.assertIn(text, cached[0])
+
+    def test_artwork_is_drawn_once_per_process(self):
+        member = make_member(1)
+        member.save()
+
+        with mock.patch.dict('membership.certificate_generator._templates', clear=True), \
+                mock.patch('membership.certificate_generator.draw_artwork',
+                           side_effect=certificate_generator.draw_artwork) as draw_artwork:
+            first = self.render(member, template=True)
+            second = self.render(member, template=True)
+
+        draw_artwork.assert_called_once()
+        self.assertEqual(first, second)
+
+
+class FileServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.media_root, CERTIFICATE_SENDFILE_MODE=None,
+                                  CERTIFICATE_SENDFILE_URL_PREFIX='/protected/')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.content = bytes(range(256)) * 4
+        self.path = self.write(os.path.join(self.media_root, 'certificates', 'a.pdf'))
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        return path
+
+    def serve(self, path=None, **headers):
+        request = RequestFactory().get('/', headers=headers)
+        response = serve_file(request, path or self.path, 'a.pdf', content_type='application/pdf')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_ranges_and_conditional_requests(self):
+        response, body = self.serve()
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+        partial, body = self.serve(range='bytes=100-199')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(body, self.content[100:200])
+
+        self.assertEqual(self.serve(range='bytes=-10')[1], self.content[-10:])
+        self.assertEqual(self.serve(if_none_match=response['ETag'])[0].status_code, 304)
+
+        unsatisfiable, _ = self.serve(range=f'bytes={len(self.content)}-')
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_x_accel_redirect_only_maps_media_root(self):
+        with self.settings(CERTIFICATE_SENDFILE_MODE='x-accel-redirect'):
+            response, body = self.serve()
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/certificates/a.pdf')
+            self.assertEqual(body, b'')
+
+            outside = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, outside, ignore_errors=True)
+            response, body = self.serve(self.write(os.path.join(outside, 'a.pdf')))
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(body, self.content)
+
+
+class BenchmarkTests(TestCase):
+    def test_seeded_members_keep_their_dates_and_counters(self):
+        seed_members(12)
+
+        dates = list(Member.objects.order_by('pk').values_list('registration_date', flat=True))
+        self.assertEqual(dates, sorted(set(dates)))
+        self.assertLess(dates[-1], timezone.now())
+
+        member = make_member(100)
+        member.save()
+        self.assertEqual(member.membership_number, 'NPV/OM-003')
+
+    def test_compare_flags_regressions_by_direction(self):
+        baseline = {'verify': {'cached': {'p50_ms': 1.0, 'requests_per_sec': 100.0, 'requests': 20}}}
+        results = {'verify': {'cached': {'p50_ms': 1.5, 'requests_per_sec': 150.0, 'requests': 40}}}
+
+        regressed = {metric: flag for _, _, metric, *_, flag in compare(results, baseline)}
+
+        self.assertEqual(regressed, {'p50_ms': True, 'requests_per_sec': False})
+
+    def test_verify_benchmark_restores_request_logging(self):
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        self.addCleanup(request_logger.setLevel, level)
+        request_logger.setLevel(logging.INFO)
+
+        results = bench_verify(count=20, rps=1000, members=10)
+
+        self.assertEqual(request_logger.level, logging.INFO)
+        self.assertTrue(all(metrics['requests'] == 20 for metrics in results.values()))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        overrides = self.settings(
+            MEDIA_ROOT=media_root,
+            METRICS_DIR=self.metrics_dir,
+            METRICS_SAMPLE_RATE=1,
+            CERTIFICATE_ASYNC=False,
+            CERTIFICATE_RENDER_MODE='eager',
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.object(metrics, 'store', metrics.MetricStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_registration_queries_and_stages_are_exported(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/register/', member_payload(1), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+        text = self.client.get('/metrics').content.decode()
+
+        self.assertIn('npv_requests_total{view="register",method="POST",status="201"} 1', text)
+        self.assertIn('npv_request_queries_count{view="register"} 1', text)
+        queries = re.search(r'npv_request_queries_sum\{view="register"\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 2)
+        for name in ('validate', 'allocate_number', 'save_member', 'qr_encode', 'pdf_render', 'file_write'):
+            self.assertIn(f'npv_stage_duration_seconds_count{{stage="{name}"}} 1', text)
+
+    def test_scrape_adds_up_worker_files(self):
+        labels = (('view', 'verify'), ('method', 'GET'), ('status', '200'))
+        metrics.store.inc('npv_requests_total', labels, 2)
+        metrics.write_file(os.path.join(self.metrics_dir, 'metrics-1.json'), {
+            ('npv_requests_total', labels): 3,
+            ('npv_stage_duration_seconds', (('stage', 'smtp'),)): [0] * 8 + [1] + [0] * 6 + [0.4],
+        })
+
+        text = metrics.render(metrics.collect())
+
+        self.assertIn('npv_requests_total{view="verify",method="GET",status="200"} 5', text)
+        self.assertIn('npv_stage_duration_seconds_bucket{stage="smtp",le="0.25"} 0', text)
+        self.assertIn('npv_stage_duration_seconds_bucket{stage="smtp",le="0.5"} 1', text)
+        self.assertIn('npv_stage_duration_seconds_sum{stage="smtp"} 0.4', text)
+
+
+@enforce_query_budgets()
+class QueryBudgetTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = self.settings(
+            MEDIA_ROOT=media_root,
+            CERTIFICATE_ASYNC=False,
+            CERTIFICATE_RENDER_MODE='lazy',
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+        MembershipCounter.objects.update_or_create(category='OM', defaults={'last_number': 0})
+
+    def test_endpoints_stay_within_budget(self):
+        payload = member_payload(1)
+        payload['membership_category'] = 'Ordinary Membership'
+        # The first registration also inserts every statistics row; the
+        # certificate email is queued once the registration commits
+        response = self.client.post('/api/register/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        number = response.json()['data']['membership_number']
+
+        for url in (f'/api/verify/{number}/', '/api/members/', f'/api/members/{number}/',
+                    f'/api/certificate/{number}/', f'/api/async/certificate/{number}/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_first_registration_in_a_category_stays_within_budget(self):
+        # No number counter and no statistics rows yet
+        MembershipCounter.objects.all().delete()
+        for index, async_mode in enumerate((False, True), 1):
+            with self.subTest(async_mode=async_mode), self.settings(CERTIFICATE_ASYNC=async_mode):
+                payload = member_payload(index)
+                payload['membership_category'] = 'Life Membership' if async_mode else 'Bronze Membership'
+                response = self.client.post('/api/register/', payload, content_type='application/json')
+                self.assertIn(response.status_code, (201, 202))
+
+    def test_overrun_reports_queries_and_origins(self):
+        make_member(1).save()
+
+        with self.settings(QUERY_BUDGETS={'verify': 0}), self.assertRaises(QueryBudgetExceeded) as raised:
+            self.client.get('/api/verify/NPV/OM-001/')
+
+        report = str(raised.exception)
+        self.assertIn('Query budget "verify" exceeded: 1 queries, budget 0', report)
+        self.assertIn('FROM "membership_member"', report)
+        self.assertRegex(report, r'at membership/verification\.py:\d+ in ')
+
+    def test_default_mode_logs_instead_of_failing_the_request(self):
+        make_member(1).save()
+
+        with self.settings(QUERY_BUDGET_MODE='log', QUERY_BUDGETS={'verify': 0}), \
+                self.assertLogs('membership.query_budget', 'WARNING'):
+            response = self.client.get('/api/verify/NPV/OM-001/')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_log_mode_warns(self):
+        with self.assertLogs('membership.query_budget', 'WARNING') as logs:
+            with query_budget(0, mode='log'):
+                Member.objects.count()
+        self.assertIn('Query budget "block" exceeded', logs.output[0])
+
+
+class VerificationCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_hits_skip_the_database(self):
+        member = make_member(1)
+        member.save()
+        url = f'/api/verify/{member.membership_number}/'
+
+        first = self.client.get(url, HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(0):
+            second = self.client.get(url, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first.json()['data']['full_name'], member.get_full_name())
+
+    def test_unknown_numbers_are_cached_until_registered(self):
+        url = '/api/verify/NPV/OM-001/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_member(1).save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_save_and_delete_invalidate(self):
+        member = make_member(1)
+        member.save()
+        url = f'/api/verify/{member.membership_number}/'
+        self.client.get(url)
+
+        member.county = 'Mombasa'
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+        self.assertEqual(self.client.get(url).json()['data']['county'], 'Mombasa')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            member.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_verify_during_an_uncommitted_update(self):
+        member = make_member(1)
+        member.save()
+        number = member.membership_number
+        stale = verification.get_verification(number)
+
+        member.county = 'Mombasa'
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+            # Other requests still see (and would re-cache) the committed row
+            # until the update commits
+            self.assertEqual(get_cache().get(verification.cache_key(number)), stale)
+
+        body = self.client.get(f'/api/verify/{number}/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(body['data']['county'], 'Mombasa')
+
+
+
+class BatchVerificationTests(TestCase):
+    url = '/api/verify/batch/'
+
+    def setUp(self):
+        get_cache().clear()
+        for i in range(1, 4):
+            make_member(i).save()
+
+    def post(self, numbers):
+        return self.client.post(self.url, {'membership_numbers': numbers}, content_type='application/json',
+                                HTTP_ACCEPT='application/json')
+
+    def test_results_in_input_order_with_one_query(self):
+        numbers = ['NPV/OM-003', 'NPV/XX-001', 'NPV/OM-001', 'NPV/OM-003']
+        with self.assertNumQueries(1):
+            response = self.post(numbers)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['count'], body['verified']), (4, 3))
+        self.assertEqual([r.get('data', {}).get('membership_number') for r in body['results']],
+                         ['NPV/OM-003', None, 'NPV/OM-001', 'NPV/OM-003'])
+        # Same payloads as the single endpoint, now served from its cache
+        with self.assertNumQueries(0):
+            single = self.client.get('/api/verify/NPV/OM-001/', HTTP_ACCEPT='application/json')
+        self.assertEqual(single.json(), body['results'][2])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post(numbers).content, response.content)
+
+    def test_rejects_bad_or_oversized_batches(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post(['NPV/OM-001', 1]).status_code, 400)
+        with self.settings(VERIFY_BATCH_MAX_SIZE=2):
+            self.assertEqual(self.post(['NPV/OM-001'] * 3).status_code, 400)
+
+    def test_scan_batcher_coalesces_scans(self):
+        class RecordingClient:
+            batches = []
+
+            def verify_many(self, numbers):
+                self.batches.append(numbers)
+                return [{'number': number} for number in numbers]
+
+        batcher = ScanBatcher(RecordingClient(), max_batch=3, max_wait=0.5)
+        futures = [batcher.submit(f'NPV/OM-{i:03d}') for i in range(1, 6)]
+        batcher.close()
+
+        self.assertEqual([f.result()['number'] for f in futures], [f'NPV/OM-{i:03d}' for i in range(1, 6)])
+        self.assertEqual([len(batch) for batch in RecordingClient.batches], [3, 2])
+
+
+
+SIGNING_KEYS = {'k1': b64encode(b'\x01' * 32), 'k2': b64encode(b'\x02' * 32)}
+
+
+@skipUnless(Ed25519PrivateKey, 'cryptography is not installed')
+@override_settings(QR_SIGNING_KEYS=SIGNING_KEYS, QR_SIGNING_KEY_ID='k1')
+class SignedQRTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        signing.reset_revocations()
+        self.addCleanup(signing.reset_revocations)
+        self.member = make_member(1)
+        self.member.save()
+
+    def scan(self, url):
+        number, token = parse_url(url)
+        return self.client.get(f'/api/verify/{number}/', {'t': token}, HTTP_ACCEPT='application/json')
+
+    def test_signed_scan_skips_the_database(self):
+        url = CertificateGenerator(self.member).verification_url
+        self.assertEqual(parse_url(url)[0], self.member.membership_number)
+        signing.revoked_numbers()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.scan(url.replace('.OM.', '.LM.')).status_code, 403)
+            response = self.scan(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'success': True,
+            'verified': True,
+            'signed': True,
+            'data': {
+                'membership_number': self.member.membership_number,
+                'category': self.member.membership_category,
+                'registration_date': self.member.registration_date.strftime('%B %d, %Y'),
+            }
+        })
+        self.assertFalse(get_cache().get(verification.cache_key(self.member.membership_number)))
+
+        # The revoked numbers are shared through the cache
+        signing.reset_revocations()
+        signing.revoked_numbers()
+        with mock.patch.object(signing, '_revocations', None), self.assertNumQueries(0):
+            self.assertEqual(self.scan(url).status_code, 200)
+
+    def test_online_lookup_is_opt_in(self):
+        url = CertificateGenerator(self.member).verification_url
+        unsigned = self.client.get(f'/api/verify/{self.member.membership_number}/').json()
+
+        with self.settings(QR_VERIFY_ONLINE=True):
+            response = self.scan(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {**unsigned, 'signed': True})
+        self.assertEqual(response.json()['data']['county'], self.member.county)
+
+    def test_bundle_holds_public_keys_only(self):
+        bundle = signing.export_bundle()
+        self.assertEqual(set(bundle['keys']), {'k1', 'k2'})
+        self.assertFalse(set(bundle['keys'].values()) & set(SIGNING_KEYS.values()))
+
+        # A public key cannot sign a token the verifier accepts
+        url = CertificateGenerator(self.member).verification_url
+        forged = url.replace(parse_url(url)[1], signing.sign(
+            'k1', bundle['keys']['k1'], self.member.membership_number, 'OM',
+            self.member.registration_date.date(), self.member.get_full_name()))
+        self.assertEqual(OfflineVerifier.from_bundle(bundle).verify_url(forged).reason, 'bad signature')
+
+    def test_unknown_signing_key_leaves_the_url_unsigned(self):
+        with self.settings(QR_SIGNING_KEY_ID='k9'):
+            with self.assertRaises(signing.UnknownSigningKey):
+                signing.member_token(self.member)
+            with self.assertLogs('membership.signing', 'ERROR'):
+                url = CertificateGenerator(self.member).verification_url
+        self.assertEqual(url, f'https://npv.co.ke/verify/{self.member.membership_number}')
+
+    def test_tampered_and_rotated_tokens(self):
+        url = CertificateGenerator(self.member).verification_url
+        self.assertEqual(self.scan(url.replace('.OM.', '.LM.')).status_code, 403)
+
+        with self.settings(QR_SIGNING_KEY_ID='k2'):
+            rotated = CertificateGenerator(self.member).verification_url
+        self.assertIn('?t=k2.', rotated)
+        self.assertEqual(self.scan(rotated).status_code, 200)
+        self.assertEqual(self.scan(url).status_code, 200)
+
+        # Retired key: verifies with only its public key configured
+        retired = {'k1': signing.public_key(SIGNING_KEYS['k1'])}
+        with self.settings(QR_SIGNING_KEYS={'k2': SIGNING_KEYS['k2']}, QR_VERIFY_KEYS=retired):
+            response = self.scan(url)
+            self.assertEqual(signing.export_bundle()['keys']['k1'], retired['k1'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['signed'])
+
+        # Dropped key: falls back to the database lookup
+        with self.settings(QR_SIGNING_KEYS={'k2': SIGNING_KEYS['k2']}):
+            response = self.scan(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('signed', response.json())
+
+    def test_deleted_member_is_revoked(self):
+        url = CertificateGenerator(self.member).verification_url
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.delete()
+
+        self.assertEqual(self.scan(url).status_code, 410)
+        verifier = OfflineVerifier.from_bundle(json.loads(json.dumps(signing.export_bundle())))
+        self.assertTrue(verifier.verify_url(url).possibly_revoked)
+
+    def test_offline_verifier(self):
+        url = CertificateGenerator(self.member).verification_url
+        verifier = OfflineVerifier.from_bundle(json.loads(json.dumps(signing.export_bundle())))
+
+        result = verifier.verify_url(url)
+        self.assertTrue(result.verified)
+        self.assertTrue(result.matches_name(f'  {self.member.get_full_name().lower()} '))
+        self.assertFalse(result.matches_name('Someone Else'))
+        self.assertEqual(verifier.verify_url(url.replace('.OM.', '.LM.')).reason, 'bad signature')
+        self.assertEqual(verifier.verify_url('https://npv.co.ke/verify/NPV/OM-001').reason, 'unsigned')
+
+    def test_bloom_filter_false_positive_rate(self):
+        revocations = BloomFilter.for_capacity(1000, error_rate=0.01)
+        for i in range(1000):
+            revocations.add(f'NPV/OM-{i:03d}')
+        revocations = BloomFilter.from_bytes(revocations.to_bytes())
+
+        self.assertTrue(all(f'NPV/OM-{i:03d}' in revocations for i in range(1000)))
+        false_positives = sum(f'NPV/LM-{i:03d}' in revocations for i in range(10000))
+        self.assertLess(false_positives, 200)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.member = make_member(1)
+        self.member.save()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    async def test_verify_matches_sync_view(self):
+        url = f'/api/verify/{self.member.membership_number}/'
+        expected = await self.async_client.get(url, headers={'accept': 'application/json'})
+        response = await self.async_client.get(f'/api/async{url[4:]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+
+        response = await self.async_client.get('/api/async/verify/NPV/XX-001/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_member_detail(self):
+        response = await self.async_client.get(f'/api/async/members/{self.member.membership_number}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['membership_number'], self.member.membership_number)
+        self.assertNotIn('search_vector', response.json())
+
+        response = await self.async_client.get('/api/async/members/NPV/XX-001/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_certificate_is_streamed_with_ranges(self):
+        content = os.urandom(200_000)
+        url = f'/api/async/certificate/{self.member.membership_number}/'
+
+        with self.settings(MEDIA_ROOT=self.media_root):
+            certificate_storage().save(certificate_name(self.member.membership_number), ContentFile(content))
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Length'], str(len(content)))
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), content)
+
+            response = await self.async_client.get(url, headers={'range': 'bytes=100-199'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), content[100:200])
+
+            response = await self.async_client.get('/api/async/certificate/NPV/XX-001/')
+            self.assertEqual(response.status_code, 404)
+
+    async def test_lazy_download_resolves_the_file_off_the_event_loop(self):
+        threads = []
+
+        def serve(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return serve_storage_file(*args, **kwargs)
+
+        url = f'/api/async/certificate/{self.member.membership_number}/'
+        with self.settings(MEDIA_ROOT=self.media_root, CERTIFICATE_RENDER_MODE='lazy'), \
+                mock.patch('membership.async_views.serve_storage_file', serve):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(b''.join([chunk async for chunk in response.streaming_content]).startswith(b'%PDF'))
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+
+class MemberListTests(TestCase):
+    def setUp(self):
+        for i in range(1, 6):
+            make_member(i, county='Nairobi' if i % 2 else 'Mombasa').save()
+        self.newest_first = list(Member.objects.order_by('-registration_date', '-pk')
+                                 .values_list('membership_number', flat=True))
+
+    def numbers(self, response):
+        return [row['membership_number'] for row in response.json()['results']]
+
+    def test_cursor_walks_forward_and_back(self):
+        seen = []
+        url = '/api/members/?page_size=2'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append(response.json())
+            seen += self.numbers(response)
+            url = response.json()['next']
+        self.assertEqual(seen, self.newest_first)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[-1]['previous'])
+        self.assertEqual(self.numbers(previous), self.newest_first[2:4])
+
+    def test_filters(self):
+        response = self.client.get('/api/members/?county=Mombasa')
+        self.assertEqual(len(response.json()['results']), 2)
+
+        self.assertEqual(self.client.get('/api/members/?category=LM').json()['results'], [])
+        self.assertEqual(self.client.get('/api/members/?category=Nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/members/?date_from=2020-13-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/members/?cursor=bogus').status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+    """Fail if a hot Member query stops using an index.
+
+    On Postgres sequential scans are disabled for the test so the planner
+    picks an index whenever one applies, even on a nearly empty table.
+    """
+    since = timezone.make_aware(datetime(2025, 1, 1))
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan on membership_member', plan)
+        elif connection.vendor == 'sqlite':
+            self.assertIsNone(re.search(r'SCAN membership_member(?! USING (COVERING )?INDEX)', plan), plan)
+
+    def test_duplicate_email_check(self):
+        self.assertUsesIndex(Member.objects.filter(email='member@example.com').order_by())
+
+    def test_location_lookup(self):
+        self.assertUsesIndex(Member.objects.filter(county='Nairobi', constituency='Westlands', ward='Parklands'))
+
+    def test_category_by_date(self):
+        self.assertUsesIndex(Member.objects.filter(membership_category='Life Membership',
+                                                   registration_date__gte=self.since))
+        self.assertUsesIndex(Member.objects.filter(membership_category='Life Membership')[:100])
+
+    def test_county_by_date(self):
+        self.assertUsesIndex(Member.objects.filter(county='Nairobi')[:100])
+
+    def test_list_pages(self):
+        self.assertUsesIndex(Member.objects.order_by('-registration_date', '-id')[:50])
+        self.assertUsesIndex(Member.objects.filter(registration_date__lte=self.since).order_by('-registration_date', '-id')[:50])
+
+    def test_name_and_phone_prefix(self):
+        for column in ('surname', 'other_names', 'phone'):
+            with self.subTest(column=column):
+                self.assertUsesIndex(Member.objects.filter(**{f'{column}__istartswith': 'abc'}).order_by())
+
+    def test_admin_search(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Substring search is only indexed with pg_trgm')
+        admin = site._registry[Member]
+        request = RequestFactory().get('/admin/membership/member/')
+        queryset, _ = admin.get_search_results(request, Member.objects.order_by(), 'wanjiku')
+        self.assertUsesIndex(queryset)
+
+
+class MemberSearchTests(TestCase):
+    def setUp(self):
+        make_member(1, surname='Wanjiku', other_names='Grace Akinyi').save()
+        make_member(2, surname='Otieno', other_names='Wanjiru').save()
+        make_member(3, surname='Kamau', other_names='Peter').save()
+
+    def search(self, q, **params):
+        return self.client.get('/api/members/search/', {'q': q, **params})
+
+    def test_prefix_match_ranks_surnames_first(self):
+        names = [row['full_name'] for row in self.search('wanj').json()['results']]
+        self.assertEqual(names, ['Wanjiku Grace Akinyi', 'Otieno Wanjiru'])
+
+    def test_identifier_match(self):
+        results = self.search('NPV/OM-003').json()['results']
+        self.assertEqual([row['membership_number'] for row in results], ['NPV/OM-003'])
+
+    def test_paginates_by_rank(self):
+        first = self.search('wanj', page_size=1).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(first['results'][0]['full_name'], 'Wanjiku Grace Akinyi')
+        self.assertEqual(second['results'][0]['full_name'], 'Otieno Wanjiru')
+        self.assertIsNone(second['next'])
+
+    def test_requires_a_term(self):
+        self.assertEqual(self.search('w').status_code, 400)
+
+    def test_admin_uses_member_search(self):
+        admin = site._registry[Member]
+        request = RequestFactory().get('/admin/membership/member/')
+        queryset, duplicates = admin.get_search_results(request, Member.objects.all(), 'kam')
+        self.assertEqual([m.surname for m in queryset], ['Kamau'])
+        self.assertFalse(duplicates)
+
+
+class MemberExportTests(TestCase):
+    def setUp(self):
+        for i in range(1, 4):
+            make_member(i, county='Nairobi' if i % 2 else 'Mombasa').save()
+        self.staff = User.objects.create_user('staff', password='x', is_staff=True)
+
+    def export(self, export_format, **params):
+        return self.client.get(f'/api/members/export/{export_format}/', params)
+
+    def test_staff_only(self):
+        self.assertEqual(self.export('csv').status_code, 403)
+
+    def test_csv_projection_and_filters(self):
+        self.client.force_login(self.staff)
+        response = self.export('csv', fields='membership_number,county', county='Nairobi')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows, [['membership_number', 'county'],
+                                ['NPV/OM-001', 'Nairobi'], ['NPV/OM-003', 'Nairobi']])
+
+    def test_jsonl(self):
+        self.client.force_login(self.staff)
+        response = self.export('jsonl', fields='id,dob')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['dob'], '1990-01-01')
+
+    def test_rejects_unknown_fields_and_formats(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.export('csv', fields='search_vector').status_code, 400)
+        self.assertEqual(self.export('xlsx').status_code, 400)
+
+
+class MemberStatTests(TestCase):
+    def setUp(self):
+        cache.delete(stats.CACHE_KEY)
+
+    def counts(self, dimension):
+        return get_stats([dimension])[dimension]
+
+    def test_signals_keep_rollup_current(self):
+        member = make_member(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+            make_member(2, county='Mombasa').save()
+        self.assertEqual(self.counts('county'), {'Nairobi': 1, 'Mombasa': 1})
+
+        member.county = 'Mombasa'
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+        self.assertEqual(self.counts('county'), {'Mombasa': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            member.delete()
+        self.assertEqual(self.counts('county'), {'Mombasa': 1})
+        self.assertEqual(get_stats()['total'], 1)
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_deltas_apply_in_one_statement(self):
+        MemberStat.objects.create(dimension='county', value='Nairobi', count=3)
+        MemberStat.objects.create(dimension='gender', value='Female', count=1)
+        deltas = {
+            ('county', 'Nairobi'): -1, ('county', 'Mombasa'): 1,
+            ('gender', 'Female'): 2, ('gender', 'Male'): 0,
+        }
+        with self.assertNumQueries(1):
+            stats.apply_deltas(deltas)
+        self.assertEqual(self.counts('county'), {'Nairobi': 2, 'Mombasa': 1})
+        self.assertEqual(self.counts('gender'), {'Female': 3})
+
+    def test_counts_move_after_commit_without_reading_the_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_member(1).save()
+        member = Member.objects.get()
+        member.county = 'Mombasa'
+        member.gender = 'Male'
+
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(1):
+            # Only the county is written; the unsaved gender is not counted
+            member.save(update_fields=['county'])
+        self.assertEqual(self.counts('county'), {'Nairobi': 1})
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.counts('county'), {'Mombasa': 1})
+        self.assertEqual(self.counts('gender'), {'Female': 1})
+
+    def test_certificate_saves_skip_the_lookup(self):
+        member = make_member(1)
+        member.save()
+        with self.assertNumQueries(1):
+            member.save(update_fields=['certificate', 'qr_code'])
+
+    def test_reconcile_fixes_bulk_updates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_member(1).save()
+        Member.objects.update(gender='Male')
+        self.assertEqual(self.counts('gender'), {'Female': 1})
+
+        self.assertEqual(stats.reconcile(dry_run=True), {
+            ('gender', 'Female'): (1, 0), ('gender', 'Male'): (0, 1),
+        })
+        stats.reconcile()
+        self.assertEqual(self.counts('gender'), {'Male': 1})
+
+    def test_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_member(1).save()
+        response = self.client.get('/api/stats/', {'dimension': 'category'})
+        self.assertEqual(response.json(), {'total': 1, 'category': {'Ordinary Membership': 1}})
+        self.assertEqual(self.client.get('/api/stats/', {'dimension': 'nope'}).status_code, 400)
+
+
+class RejectingBackend(locmem.EmailBackend):
+    """locmem backend that refuses mail for @bounce.test recipients"""
+
+    def send_messages(self, messages):
+        # Sends each message as it is taken, like the SMTP backend
+        sent = 0
+        for message in messages:
+            if message.to[0].endswith('@bounce.test'):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+            sent += super().send_messages([message])
+        return sent
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.member = make_member(1, email='member1@example.com')
+        self.member.save()
+
+    def test_certificate_email_is_queued_with_the_pdf(self):
+        queue_certificate_email(self.member, b'%PDF-1.4 test')
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_outbox('test'), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments[0][1], b'%PDF-1.4 test')
+
+        row = EmailOutbox.objects.get()
+        self.assertEqual(row.status, EmailOutbox.STATUS_SENT)
+        self.assertIsNone(row.attachment)
+        self.assertEqual(send_outbox('test'), (0, 0))
+
+    def test_failures_back_off_then_give_up(self):
+        self.member.email = 'someone@bounce.test'
+        queue_certificate_email(self.member, b'pdf')
+        connection = RejectingBackend()
+
+        with override_settings(EMAIL_OUTBOX_RETRY_DELAY=60):
+            self.assertEqual(send_outbox('test', connection=connection), (0, 1))
+        row = EmailOutbox.objects.get()
+        self.assertEqual((row.status, row.attempts), (EmailOutbox.STATUS_PENDING, 1))
+        self.assertGreater(row.run_after, timezone.now())
+        self.assertEqual(send_outbox('test', connection=connection), (0, 0))
+
+        EmailOutbox.objects.update(run_after=timezone.now(), attempts=row.max_attempts - 1)
+        send_outbox('test', connection=connection)
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_FAILED)
+
+    def test_batch_is_one_send_marking_each_message(self):
+        for address in ('a@example.com', 'b@bounce.test', 'c@example.com', 'd@example.com'):
+            self.member.email = address
+            queue_certificate_email(self.member, b'pdf')
+        calls = []
+        statuses = []
+
+        class RecordingBackend(RejectingBackend):
+            def send_messages(self, messages):
+                calls.append(1)
+                return super().send_messages(message for message in messages
+                                             if not statuses.append(self.sent_so_far()))
+
+            def sent_so_far(self):
+                return set(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENT).values_list('to', flat=True))
+
+        with self.assertLogs('membership.outbox', 'ERROR'):
+            self.assertEqual(send_outbox('test', connection=RecordingBackend()), (3, 1))
+
+        # One call for the batch, and one more after the bounce closed the connection
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(statuses, [set(), {'a@example.com'}, {'a@example.com'},
+                                    {'a@example.com', 'c@example.com'}])
+        self.assertEqual(dict(EmailOutbox.objects.values_list('to', 'status')), {
+            'a@example.com': 'sent', 'b@bounce.test': 'pending', 'c@example.com': 'sent', 'd@example.com': 'sent',
+        })
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter({'example.com': 50})
+        started = time.monotonic()
+        for _ in range(55):
+            limiter.wait('example.com')
+        limiter.wait('other.test')
+        self.assertGreater(time.monotonic() - started, 0.08)
+
+
+@override_settings(CERTIFICATE_ASYNC=True)
+class IdempotencyTests(TestCase):
+    url = '/api/register/'
+
+    def register(self, key, i=1, **extra):
+        return self.client.post(self.url, member_payload(i), content_type='application/json',
+                                headers={'idempotency-key': key, **extra.pop('headers', {})}, **extra)
+
+    def test_retries_replay_the_original_response(self):
+        first = self.register('retry-1')
+        with self.assertNumQueries(1):
+            second = self.register('retry-1')
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Member.objects.count(), 1)
+
+    def test_key_reused_for_another_request(self):
+        self.register('reused')
+        self.assertEqual(self.register('reused', i=2).status_code, 422)
+        self.assertEqual(Member.objects.count(), 1)
+
+    def test_request_in_flight(self):
+        now = timezone.now()
+        self.register('busy')
+        IdempotencyRecord.objects.filter(key='busy').update(
+            status=IdempotencyRecord.STATUS_PROCESSING, created_at=now,
+        )
+        with self.settings(IDEMPOTENCY_WAIT_TIMEOUT=0):
+            response = self.register('busy')
+        self.assertEqual(response.status_code, 409)
+
+    def test_keys_are_per_client(self):
+        first = self.register('shared', REMOTE_ADDR='10.0.0.1')
+        other = self.register('shared', i=2, REMOTE_ADDR='10.0.0.2')
+
+        self.assertEqual(other.status_code, 202)
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertNotEqual(other.json(), first.json())
+        self.assertEqual(Member.objects.count(), 2)
+        self.assertEqual(set(IdempotencyRecord.objects.values_list('caller', flat=True)),
+                         {'ip:10.0.0.1', 'ip:10.0.0.2'})
+
+    @override_settings(IDEMPOTENCY_CLIENT_HEADER='X-Real-IP')
+    def test_client_address_from_proxy_header(self):
+        first = self.register('proxied', REMOTE_ADDR='10.0.0.254', headers={'x-real-ip': '192.0.2.7'})
+        retry = self.register('proxied', REMOTE_ADDR='10.0.0.253', headers={'x-real-ip': '192.0.2.7'})
+        other = self.register('proxied', i=2, REMOTE_ADDR='10.0.0.254', headers={'x-real-ip': '192.0.2.8'})
+
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(other.status_code, 202)
+        self.assertEqual(Member.objects.count(), 2)
+
+    def test_expired_keys_run_again(self):
+        self.register('old')
+        IdempotencyRecord.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.register('old', i=2).status_code, 202)
+        self.assertEqual(Member.objects.count(), 2)
+
+
+@override_settings(CERTIFICATE_ASYNC=True)
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('In-memory SQLite cannot be written from several threads')
+
+    def test_concurrent_duplicates_are_coalesced(self):
+        def register(i):
+            try:
+                return self.client_class().post('/api/register/', member_payload(1), content_type='application/json',
+                                                headers={'idempotency-key': 'field-drive-1'})
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            responses = list(pool.map(register, range(self.threads)))
+
+        self.assertEqual({response.status_code for response in responses}, {202})
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(Member.objects.count(), 1)
+
+
+class InjectedFault(Exception):
+    pass
+
+
+def fail_marked_members(sender, instance, **kwargs):
+    """pre_save fault: runs after the membership number is allocated"""
+    if instance.pk is None and instance.surname.startswith('Fail'):
+        raise InjectedFault(instance.membership_number)
+
+
+class RegistrationFaultMixin:
+    """Registrations that fail after number allocation, with a private MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = self.settings(
+            MEDIA_ROOT=media_root,
+            CERTIFICATE_ASYNC=False,
+            CERTIFICATE_RENDER_MODE='eager',
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        pre_save.connect(fail_marked_members, sender=Member, dispatch_uid='registration-fault')
+        self.addCleanup(pre_save.disconnect, sender=Member, dispatch_uid='registration-fault')
+        MembershipCounter.objects.update_or_create(category='OM', defaults={'last_number': 0})
+
+    def register(self, i, fail=False, client=None):
+        payload = member_payload(i)
+        payload['membership_category'] = 'Ordinary Membership'
+        if fail:
+            payload['surname'] = f'Fail{i}'
+        return (client or self.client).post('/api/register/', payload, content_type='application/json')
+
+    def media_files(self):
+        from django.conf import settings
+
+        return {
+            os.path.relpath(os.path.join(root, name), settings.MEDIA_ROOT)
+            for root, dirs, files in os.walk(settings.MEDIA_ROOT) for name in files
+        }
+
+    def assertNoOrphans(self):
+        expected = set()
+        for number in Member.objects.values_list('membership_number', flat=True):
+            expected |= {shard_name(certificate_name(number)), shard_name(qr_code_name(number))}
+        self.assertEqual(self.media_files(), expected)
+
+
+class RegistrationFaultTests(RegistrationFaultMixin, TransactionTestCase):
+    # Not TestCase: on_commit callbacks must run when registration commits
+
+    def test_failed_insert_burns_no_number(self):
+        self.assertEqual(self.register(1).status_code, 201)
+        with self.assertLogs('membership.views', 'ERROR'):
+            self.assertEqual(self.register(2, fail=True).status_code, 500)
+        response = self.register(3)
+
+        self.assertEqual(response.json()['data']['membership_number'], 'NPV/OM-002')
+        self.assertEqual(MembershipCounter.objects.get(category='OM').last_number, 2)
+        self.assertEqual(Member.objects.count(), 2)
+        self.assertNoOrphans()
+
+    def test_registration_is_a_single_insert(self):
+        self.register(1)
+        member = Member.objects.get()
+        self.assertEqual(member.certificate.name, certificate_name(member.membership_number))
+        self.assertEqual(member.qr_code.name, qr_code_name(member.membership_number))
+        self.assertEqual(len(mail.outbox) + EmailOutbox.objects.count(), 1)
+        self.assertNoOrphans()
+
+    def test_render_failure_after_commit_queues_a_job(self):
+        with mock.patch.object(CertificateGenerator, 'render', side_effect=InjectedFault('render')), \
+                self.assertLogs('membership.registration', 'ERROR'):
+            response = self.register(1)
+
+        self.assertEqual(response.status_code, 202)
+        job = CertificateJob.objects.get()
+        self.assertEqual(job.status, CertificateJob.STATUS_PENDING)
+        self.assertEqual(job.member.membership_number, 'NPV/OM-001')
+        self.assertEqual(self.media_files(), set())
+
+
+class RegistrationFaultConcurrencyTests(RegistrationFaultMixin, TransactionTestCase):
+    threads = 8
+    per_thread = 4
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('In-memory SQLite cannot be written from several threads')
+        super().setUp()
+
+    def test_concurrent_failures_leave_no_gaps_or_orphans(self):
+        def register(t):
+            client = self.client_class()
+            try:
+                return [
+                    self.register(i, fail=i % 2 == 1, client=client).status_code
+                    for i in range(t * self.per_thread, (t + 1) * self.per_thread)
+                ]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool, self.assertLogs('membership.views', 'ERROR'):
+            codes = [code for chunk in pool.map(register, range(self.threads)) for code in chunk]
+
+        registered = len(codes) // 2
+        self.assertEqual(sorted(codes), [201] * registered + [500] * registered)
+        numbers = Member.objects.values_list('membership_number', flat=True)
+        self.assertEqual(sorted(parse_membership_number(n)[1] for n in numbers), list(range(1, registered + 1)))
+        self.assertEqual(MembershipCounter.objects.get(category='OM').last_number, registered)
+        self.assertFalse(CertificateJob.objects.exists())
+        self.assertNoOrphans()
+
+
+class CertificateStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.storage = ShardedFileSystemStorage(location=self.media_root)
+        self.name = certificate_name('NPV/OM-001')
+
+    def write_legacy(self, content=b'legacy'):
+        path = os.path.join(self.media_root, self.name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_files_are_sharded_and_overwritten(self):
+        self.storage.save(self.name, ContentFile(b'one'))
+        self.assertEqual(self.storage.save(self.name, ContentFile(b'two')), self.name)
+
+        path = self.storage.path(self.name)
+        self.assertEqual(os.path.relpath(path, self.media_root), shard_name(self.name))
+        self.assertRegex(shard_name(self.name), r'^certificates/[0-9a-f]{2}/[0-9a-f]{2}/certificate_NPV/OM-001\.pdf$')
+        with self.storage.open(self.name) as f:
+            self.assertEqual(f.read(), b'two')
+        # No temporary files left behind
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_legacy_files_are_found_until_rewritten(self):
+        legacy = self.write_legacy()
+        self.assertEqual(self.storage.path(self.name), legacy)
+        self.assertTrue(self.storage.exists(self.name))
+
+        self.storage.save(self.name, ContentFile(b'new'))
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(self.storage.path(self.name), self.storage.sharded_path(self.name))
+
+    def test_reshard_moves_legacy_files(self):
+        self.write_legacy()
+        names = [self.name, certificate_name('NPV/OM-002')]
+
+        self.assertEqual(reshard(names, self.media_root, self.storage, dry_run=True),
+                         {'moved': 1, 'missing': 1})
+        self.assertEqual(reshard(names, self.media_root, self.storage), {'moved': 1, 'missing': 1})
+        self.assertTrue(os.path.isfile(self.storage.sharded_path(self.name)))
+        self.assertEqual(reshard(names, self.media_root, self.storage), {'present': 1, 'missing': 1})
+
+    def test_download_reads_through_storage(self):
+        member = make_member(1)
+        member.save()
+        with self.settings(MEDIA_ROOT=self.media_root, CERTIFICATE_RENDER_MODE='eager'):
+            certificate_storage().save(certificate_name(member.membership_number), ContentFile(b'%PDF-1.4'))
+            response = self.client.get(f'/api/certificate/{member.membership_number}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+
+
+
+
+class CertificateArchiveTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=media_root, CERTIFICATE_RENDER_MODE='eager',
+                                  CERTIFICATE_ARCHIVE_PACK_SIZE=2000)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.contents = {}
+        for i in range(1, 4):
+            member = make_member(i)
+            member.save()
+            name = certificate_name(member.membership_number)
+            self.contents[member.membership_number] = os.urandom(900)
+            certificate_storage().save(name, ContentFile(self.contents[member.membership_number]))
+            Member.objects.filter(pk=member.pk).update(certificate=name)
+
+    def archive(self):
+        call_command('archive_certificates', older_than=0, stdout=io.StringIO())
+
+    def download(self, number, **headers):
+        response = self.client.get(f'/api/certificate/{number}/', headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_archived_certificates_are_served_from_packs(self):
+        self.archive()
+
+        self.assertEqual(ArchivedFile.objects.count(), 3)
+        self.assertEqual(len(archive.list_packs()), 2)
+        for number, content in self.contents.items():
+            self.assertFalse(certificate_storage().exists(certificate_name(number)))
+            response, body = self.download(number)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(body, content)
+
+        response, body = self.download('NPV/OM-002', range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.contents['NPV/OM-002'][100:200])
+
+        response, body = self.download('NPV/OM-002', if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_regenerated_certificate_takes_precedence(self):
+        self.archive()
+        name = certificate_name('NPV/OM-001')
+        certificate_storage().save(name, ContentFile(b'%PDF-new'))
+        self.assertEqual(self.download('NPV/OM-001')[1], b'%PDF-new')
+
+        # Archiving it again appends the new copy and repoints the index
+        self.archive()
+        self.assertFalse(certificate_storage().exists(name))
+        self.assertEqual(ArchivedFile.objects.count(), 3)
+        self.assertEqual(self.download('NPV/OM-001')[1], b'%PDF-new')
+
+    async def test_async_download_from_pack(self):
+        await sync_to_async(self.archive)()
+        response = await self.async_client.get('/api/async/certificate/NPV/OM-003/', headers={'range': 'bytes=-10'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]),
+                         self.contents['NPV/OM-003'][-10:])
+
+
+@skipUnless(storage_module.boto3 and mock_aws, 'boto3 and moto are not installed')
+class S3CertificateStorageTests(TestCase):
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.storage = S3CertificateStorage(bucket='certificates', prefix='npv/', region_name='us-east-1',
+                                            access_key='testing', secret_key='testing')
+        self.storage.client.create_bucket(Bucket='certificates')
+        self.name = certificate_name('NPV/OM-001')
+
+    def test_round_trip(self):
+        self.assertFalse(self.storage.exists(self.name))
+        self.assertEqual(self.storage.save(self.name, ContentFile(b'%PDF-1.4')), self.name)
+        self.assertEqual(self.storage.save(self.name, ContentFile(b'%PDF-1.7')), self.name)
+
+        self.assertTrue(self.storage.exists(self.name))
+        self.assertEqual(self.storage.size(self.name), 8)
+        with self.storage.open(self.name) as f:
+            self.assertEqual(f.size, 8)
+            self.assertEqual(f.read(5), b'%PDF-')
+            self.assertEqual(f.read(), b'1.7')
+        head = self.storage.client.head_object(Bucket='certificates', Key='npv/' + shard_name(self.name))
+        self.assertEqual(head['ContentType'], 'application/pdf')
+        self.assertIn('/npv/certificates/', self.storage.url(self.name))
+
+        self.storage.delete(self.name)
+        self.assertFalse(self.storage.exists(self.name))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open(self.name)
+
+    def test_download_redirects_to_presigned_url(self):
+        member = make_member(1)
+        member.save()
+        self.storage.save(certificate_name(member.membership_number), ContentFile(b'%PDF-1.4'))
+        with mock.patch('membership.views.certificate_storage', return_value=self.storage), \
+                self.settings(CERTIFICATE_RENDER_MODE='eager'):
+            response = self.client.get(f'/api/certificate/{member.membership_number}/')
+        self.assertEqual(response.status_code, 302)
+        location = response['Location']
+        self.assertIn(f'/npv/{shard_name(certificate_name(member.membership_number))}?', location)
+        self.assertIn('Signature=', location)
+
+
+class ImportMembersTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, 'members.csv')
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(member_payload(1)))
+            writer.writeheader()
+            for i in range(1, 6):
+                writer.writerow(member_payload(i))
+
+    def run_import(self, **options):
+        out = io.StringIO()
+        with mock.patch('membership.management.commands.import_members.CertificateRenderPool') as pool:
+            call_command('import_members', self.path, chunk_size=2, stdout=out, **options)
+        return out.getvalue(), pool
+
+    def test_resumes_after_the_checkpoint(self):
+        checkpoint = Checkpoint(f'{self.path}.checkpoint.json', self.path)
+        checkpoint.line, checkpoint.imported = 3, 3
+        checkpoint.save()
+
+        output, pool = self.run_import(certificates='none')
+
+        self.assertIn('Resuming after line 3', output)
+        self.assertEqual(sorted(Member.objects.values_list('id_passport', flat=True)), ['ID00000004', 'ID00000005'])
+        saved = Checkpoint(checkpoint.path, self.path)
+        self.assertTrue(saved.load())
+        self.assertEqual((saved.line, saved.imported, saved.failed), (5, 5, 0))
+        pool.assert_not_called()
+
+        # A finished import resumes with nothing left to do
+        self.run_import(certificates='none')
+        self.assertEqual(Member.objects.count(), 2)
+
+    def test_conflicting_chunk_falls_back_to_single_inserts(self):
+        make_member(1, id_passport='ID00000002').save()
+        importer = MemberImporter(certificates='none')
+        result = ImportResult()
+        valid = [(line, Member(**{**member_payload(i), 'dob': date(1990, 1, 1)}))
+                 for line, i in ((1, 1), (2, 2), (3, 3))]
+
+        # Row 2 was registered after the chunk was checked for duplicates
+        importer.insert(valid, result)
+
+        self.assertEqual([member.id_passport for member in result.created], ['ID00000001', 'ID00000003'])
+        self.assertEqual([(line, id_passport) for line, id_passport, errors in result.errors], [(2, 'ID00000002')])
+        self.assertTrue(all(member.pk and member.membership_number for member in result.created))
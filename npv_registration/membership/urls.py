@@ -1,11 +1,22 @@
 # membership/urls.py
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('register/', views.register_member, name='register'),
-    path('verify/<str:membership_number>/', views.verify_member, name='verify'),
-    path('certificate/<str:membership_number>/', views.download_certificate, name='download_certificate'),
+    path('verify/batch/', views.verify_members, name='verify_batch'),
+    path('verify/<path:membership_number>/', views.verify_member, name='verify'),
+    path('jobs/<uuid:token>/', views.certificate_job_status, name='certificate_job_status'),
+    path('certificate/<path:membership_number>/', views.download_certificate, name='download_certificate'),
     path('members/', views.MemberListView.as_view(), name='member_list'),
-    path('members/<str:membership_number>/', views.MemberDetailView.as_view(), name='member_detail'),
+    path('stats/', views.membership_stats, name='membership_stats'),
+    path('members/export/<str:export_format>/', views.export_members, name='member_export'),
+    path('members/search/', views.MemberSearchView.as_view(), name='member_search'),
+    path('members/<path:membership_number>/', views.MemberDetailView.as_view(), name='member_detail'),
+
+    # Async read endpoints for ASGI servers (see membership/async_views.py)
+    path('async/verify/<path:membership_number>/', async_views.verify_member, name='verify_async'),
+    path('async/certificate/<path:membership_number>/', async_views.download_certificate,
+         name='download_certificate_async'),
+    path('async/members/<path:membership_number>/', async_views.member_detail, name='member_detail_async'),
 ]
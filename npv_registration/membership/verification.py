@@ -0,0 +1,138 @@
+# membership/verification.py
+"""
+Read-through cache for the public ``verify_member`` endpoint.
+
+Verification payloads are cached already serialized to JSON, so a cache hit
+costs one cache lookup and no database query or datetime formatting. Unknown
+membership numbers are cached too (for a shorter time) so repeated scans of
+a bad QR code do not reach the database. Entries are dropped by the
+``Member`` save/delete signals in ``membership.signals`` once the change commits.
+
+``get_verifications`` answers a batch of numbers (``/api/verify/batch/``)
+with one ``get_many`` and one ``membership_number__in`` query for the misses.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Member
+
+# Columns needed to build the payload
+VERIFY_FIELDS = ('surname', 'other_names', 'membership_number', 'membership_category',
+                 'registration_date', 'county', 'constituency')
+
+NOT_FOUND = {
+    'success': False,
+    'verified': False,
+    'message': 'Membership number not found'
+}
+
+
+def get_cache():
+    return caches[getattr(settings, 'VERIFY_CACHE_ALIAS', 'default')]
+
+
+def cache_key(membership_number):
+    # Membership numbers come from the URL; hash them into a safe key
+    return 'verify:' + hashlib.md5(membership_number.encode()).hexdigest()
+
+
+def dump(payload):
+    """Serialize like DRF's JSONRenderer"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def build_payload(row):
+    return {
+        'success': True,
+        'verified': True,
+        'data': {
+            'full_name': f"{row['surname']} {row['other_names']}",
+            'membership_number': row['membership_number'],
+            'category': row['membership_category'],
+            'registration_date': row['registration_date'].strftime('%B %d, %Y'),
+            'county': row['county'],
+            'constituency': row['constituency']
+        }
+    }
+
+
+def _result(row):
+    """``((status_code, json_bytes), cache_timeout)`` for a looked up row"""
+    if row is None:
+        return (404, dump(NOT_FOUND)), getattr(settings, 'VERIFY_NEGATIVE_CACHE_TIMEOUT', 60)
+    return (200, dump(build_payload(row))), getattr(settings, 'VERIFY_CACHE_TIMEOUT', 3600)
+
+
+def _lookup(membership_number):
+    return Member.objects.filter(membership_number=membership_number).values(*VERIFY_FIELDS)
+
+
+def get_verification(membership_number):
+    """Return ``(status_code, json_bytes)`` for a membership number"""
+    cache = get_cache()
+    key = cache_key(membership_number)
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    result, timeout = _result(_lookup(membership_number).first())
+    cache.set(key, result, timeout)
+    return result
+
+
+async def aget_verification(membership_number):
+    """Async ``get_verification`` for ASGI views"""
+    cache = get_cache()
+    key = cache_key(membership_number)
+
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached
+
+    result, timeout = _result(await _lookup(membership_number).afirst())
+    await cache.aset(key, result, timeout)
+    return result
+
+
+def batch_max_size():
+    return getattr(settings, 'VERIFY_BATCH_MAX_SIZE', 500)
+
+
+def get_verifications(membership_numbers):
+    """``(status_code, json_bytes)`` for each membership number, in input order"""
+    cache = get_cache()
+    keys = {number: cache_key(number) for number in membership_numbers}
+    cached = cache.get_many(keys.values())
+    results = {number: cached[key] for number, key in keys.items() if key in cached}
+
+    missing = [number for number in keys if number not in results]
+    if missing:
+        rows = Member.objects.filter(membership_number__in=missing).values(*VERIFY_FIELDS)
+        rows = {row['membership_number']: row for row in rows}
+        fresh = {}
+        for number in missing:
+            results[number], timeout = _result(rows.get(number))
+            fresh.setdefault(timeout, {})[keys[number]] = results[number]
+        for timeout, entries in fresh.items():
+            cache.set_many(entries, timeout)
+
+    return [results[number] for number in membership_numbers]
+
+
+def dump_batch(results):
+    """Response body for ``get_verifications`` results, built from the cached bytes"""
+    verified = sum(status_code == 200 for status_code, _ in results)
+    return b''.join([
+        b'{"success":true,"count":%d,"verified":%d,"results":[' % (len(results), verified),
+        b','.join(body for _, body in results),
+        b']}',
+    ])
+
+
+def invalidate(membership_number):
+    if membership_number:
+        get_cache().delete(cache_key(membership_number))
@@ -1,68 +1,101 @@
 # membership/views.py
 from rest_framework import status, generics
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from django.core.mail import EmailMessage
-from django.conf import settings
-from django.http import HttpResponse
-from .models import Member
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from . import archive, exporters
+from .filters import LIST_FIELDS, filter_members
+from .idempotency import idempotent
+from .metrics import stage
+from .models import Member, CertificateJob
 from .serializers import MemberSerializer, MemberListSerializer
-from .certificate_generator import CertificateGenerator
-import os
+from .certificate_cache import CERTIFICATE_FIELDS, get_certificate_name, lazy_certificates
+from .certificate_generator import certificate_name
+from .fileserving import serve_storage_file
+from .pagination import KeysetPagination, SearchPagination
+from .query_budget import query_budget
+from .registration import register
+from .offline_verifier import TOKEN_PARAM
+from .search import MIN_TERM_LENGTH, search_members
+from .signing import get_signed_verification
+from .stats import DIMENSIONS, cached_stats
+from .storage import certificate_storage
+from .verification import batch_max_size, dump_batch, get_verification, get_verifications
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 @api_view(['POST'])
+@idempotent
+@query_budget('register')
 def register_member(request):
     """
     Register a new member, generate certificate, and send email
+
+    With ``CERTIFICATE_ASYNC`` enabled the certificate and email are handled
+    by the ``certificate_worker`` command and the response is a 202 pointing
+    at the job status URL, as it is when the certificate could not be
+    rendered straight away and was queued for a retry. Retries sent with the
+    same ``Idempotency-Key`` header get the original response back (see
+    ``membership.idempotency``).
     """
     serializer = MemberSerializer(data=request.data)
+    with stage('validate'):
+        valid = serializer.is_valid()
 
-    if serializer.is_valid():
+    if valid:
         try:
-            # Save member
-            member = serializer.save()
-
-            # Generate certificate
-            cert_generator = CertificateGenerator(member)
-            pdf_buffer, qr_path = cert_generator.save_certificate()
-
-            # Save certificate file
-            cert_filename = f'certificate_{member.membership_number}.pdf'
-            cert_path = os.path.join(settings.MEDIA_ROOT, 'certificates', cert_filename)
-
-            os.makedirs(os.path.dirname(cert_path), exist_ok=True)
-            with open(cert_path, 'wb') as f:
-                f.write(pdf_buffer.read())
-
-            member.certificate = f'certificates/{cert_filename}'
-            member.qr_code = qr_path
-            member.save()
-
-            # Send email if email is provided
-            if member.email:
-                send_certificate_email(member, cert_path)
+            registration = register(serializer)
+        except IntegrityError:
+            # Raced with another registration of the same ID/passport number
+            return Response({
+                'success': False,
+                'message': 'Validation failed',
+                'errors': {'id_passport': ['This ID/Passport number is already registered.']}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            # Nothing to clean up: the transaction was rolled back
+            logger.exception('Registration failed')
+            return Response({
+                'success': False,
+                'message': f'Registration failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        member = registration.member
+        job = registration.job
+        if job is not None:
             return Response({
                 'success': True,
-                'message': 'Registration successful! Certificate has been generated.',
+                'message': 'Registration successful! Your certificate is being generated.',
                 'data': {
                     'membership_number': member.membership_number,
                     'full_name': member.get_full_name(),
-                    'certificate_url': request.build_absolute_uri(member.certificate.url),
-                    'email_sent': bool(member.email)
+                    'status_url': request.build_absolute_uri(
+                        reverse('certificate_job_status', args=[job.token])
+                    ),
+                    'email_queued': job.send_email
                 }
-            }, status=status.HTTP_201_CREATED)
-
-        except Exception as e:
-            # If member was created but certificate generation failed, delete the member
-            if 'member' in locals():
-                member.delete()
+            }, status=status.HTTP_202_ACCEPTED)
 
-            return Response({
-                'success': False,
-                'message': f'Registration failed: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({
+            'success': True,
+            'message': 'Registration successful! Certificate has been generated.',
+            'data': {
+                'membership_number': member.membership_number,
+                'full_name': member.get_full_name(),
+                'certificate_url': certificate_url(request, member),
+                'email_sent': bool(member.email)
+            }
+        }, status=status.HTTP_201_CREATED)
 
     return Response({
         'success': False,
@@ -71,121 +104,216 @@ def register_member(request):
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
-def send_certificate_email(member, cert_path):
-    """Send certificate via email"""
-    subject = f'NPV Membership Certificate - {member.membership_number}'
+def certificate_url(request, member):
+    """Absolute URL a member's certificate can be downloaded from"""
+    if member.certificate:
+        return request.build_absolute_uri(member.certificate.url)
+    return request.build_absolute_uri(reverse('download_certificate', args=[member.membership_number]))
 
-    message = f"""
-    Dear {member.get_full_name()},
 
-    Welcome to the National People's Voice Party!
+@api_view(['GET'])
+def certificate_job_status(request, token):
+    """Report the state of a queued certificate job, looked up by its token"""
+    try:
+        job = CertificateJob.objects.select_related('member').get(token=token)
+    except CertificateJob.DoesNotExist:
+        return Response({
+            'success': False,
+            'message': 'Job not found'
+        }, status=status.HTTP_404_NOT_FOUND)
 
-    Your membership registration has been successfully completed.
+    member = job.member
+    data = {
+        'membership_number': member.membership_number,
+        'status': job.status,
+        'attempts': job.attempts,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == CertificateJob.STATUS_DONE:
+        data['certificate_url'] = certificate_url(request, member)
+        data['email_sent'] = job.send_email
 
-    Membership Details:
-    - Membership Number: {member.membership_number}
-    - Category: {member.membership_category}
-    - Registration Date: {member.registration_date.strftime('%B %d, %Y')}
+    return Response({'success': True, 'data': data})
 
-    Please find your membership certificate attached to this email.
 
-    You can verify your membership at any time by scanning the QR code on your certificate
-    or visiting: https://npv.co.ke/verify/{member.membership_number}
+@api_view(['GET'])
+@query_budget('verify')
+def verify_member(request, membership_number):
+    """Verify membership by membership number, or offline from a signed QR token (``?t=``)"""
+    token = request.GET.get(TOKEN_PARAM)
+    signed = get_signed_verification(membership_number, token) if token else None
+    status_code, body = signed or get_verification(membership_number)
 
-    Thank you for joining us in building a better Kenya!
+    if request.accepted_renderer.format == 'json':
+        # Cached payloads are already serialized
+        return HttpResponse(body, status=status_code, content_type='application/json')
 
-    "Our Voice, Our Strength"
+    return Response(json.loads(body), status=status_code)
 
-    Best regards,
-    National People's Voice Party
 
-    ---
-    Contact Us:
-    Email: nationalpeoplesvoice@gmail.com
-    Phone: +254-771-847-219
-    Website: www.npv.co.ke
+@api_view(['POST'])
+def verify_members(request):
     """
+    Verify a batch of membership numbers, e.g. from a scanning station
 
-    email = EmailMessage(
-        subject=subject,
-        body=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[member.email],
-    )
-
-    # Attach certificate
-    with open(cert_path, 'rb') as f:
-        email.attach(
-            f'NPV_Certificate_{member.membership_number}.pdf',
-            f.read(),
-            'application/pdf'
-        )
-
-    email.send(fail_silently=False)
-
-
-@api_view(['GET'])
-def verify_member(request, membership_number):
-    """Verify membership by membership number"""
-    try:
-        member = Member.objects.get(membership_number=membership_number)
+    Body: ``{"membership_numbers": [...]}`` with at most
+    ``VERIFY_BATCH_MAX_SIZE`` numbers. ``results`` holds what
+    ``verify_member`` returns for each number, in the same order.
+    """
+    numbers = request.data.get('membership_numbers') if isinstance(request.data, dict) else None
+    if not isinstance(numbers, list) or not numbers or not all(isinstance(n, str) for n in numbers):
         return Response({
-            'success': True,
-            'verified': True,
-            'data': {
-                'full_name': member.get_full_name(),
-                'membership_number': member.membership_number,
-                'category': member.membership_category,
-                'registration_date': member.registration_date.strftime('%B %d, %Y'),
-                'county': member.county,
-                'constituency': member.constituency
-            }
-        })
-    except Member.DoesNotExist:
+            'success': False,
+            'message': 'membership_numbers must be a non-empty list of strings'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    limit = batch_max_size()
+    if len(numbers) > limit:
         return Response({
             'success': False,
-            'verified': False,
-            'message': 'Membership number not found'
-        }, status=status.HTTP_404_NOT_FOUND)
+            'message': f'At most {limit} membership numbers per request'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    body = dump_batch(get_verifications(numbers))
+    if request.accepted_renderer.format == 'json':
+        return HttpResponse(body, content_type='application/json')
+    return Response(json.loads(body))
 
 
 @api_view(['GET'])
+@query_budget('download_certificate')
 def download_certificate(request, membership_number):
     """Download certificate PDF"""
-    try:
-        member = Member.objects.get(membership_number=membership_number)
+    filename = f'NPV_Certificate_{membership_number}.pdf'
+
+    if lazy_certificates():
+        member = Member.objects.filter(
+            membership_number=membership_number
+        ).only(*CERTIFICATE_FIELDS).first()
 
-        if not member.certificate:
+        if member is None:
             return Response({
                 'success': False,
-                'message': 'Certificate not found'
+                'message': 'Member not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        cert_path = member.certificate.path
+        return serve_storage_file(request, certificate_storage(), get_certificate_name(member), filename,
+                                  content_type='application/pdf')
 
-        with open(cert_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="NPV_Certificate_{membership_number}.pdf"'
-            return response
+    # Certificates are stored under a name derived from the membership
+    # number, so the common case needs no database query
+    storage = certificate_storage()
+    name = certificate_name(membership_number)
+    try:
+        found = storage.exists(name)
+    except SuspiciousFileOperation:
+        found = False
 
-    except Member.DoesNotExist:
-        return Response({
-            'success': False,
-            'message': 'Member not found'
-        }, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-        return Response({
-            'success': False,
-            'message': str(e)
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if not found:
+        entry = archive.find(name)
+        if entry is not None:
+            return archive.serve_archived(request, entry, filename, content_type='application/pdf')
 
+        member = Member.objects.filter(
+            membership_number=membership_number
+        ).only('certificate').first()
 
+        if member is None:
+            return Response({
+                'success': False,
+                'message': 'Member not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        # The stored name can differ from the derived one on older rows
+        stored = member.certificate.name if member.certificate else None
+        if not stored or stored == name or not storage.exists(stored):
+            entry = archive.find(stored) if stored and stored != name else None
+            if entry is None:
+                return Response({
+                    'success': False,
+                    'message': 'Certificate not found'
+                }, status=status.HTTP_404_NOT_FOUND)
+            return archive.serve_archived(request, entry, filename, content_type='application/pdf')
+        name = stored
+
+    return serve_storage_file(request, storage, name, filename, content_type='application/pdf')
+
+
+@method_decorator(query_budget('member_list'), name='get')
 class MemberListView(generics.ListAPIView):
-    """List all members"""
-    queryset = Member.objects.all()
+    """List members, newest first, with keyset pagination.
+
+    Filters: ``category`` (name or prefix, e.g. LM), ``county``, and
+    ``date_from``/``date_to`` (YYYY-MM-DD, inclusive).
+    """
+    queryset = Member.objects.only(*LIST_FIELDS)
     serializer_class = MemberListSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return filter_members(super().get_queryset(), self.request.query_params)
+
+
+class MemberSearchView(generics.ListAPIView):
+    """Search members by name, phone, ID/passport, membership number or email.
+
+    ``q`` is the search string; results are ranked best match first and
+    accept the same filters as the member list.
+    """
+    serializer_class = MemberListSerializer
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        term = self.request.query_params.get('q', '').strip()
+        if len(term) < MIN_TERM_LENGTH:
+            raise ValidationError({'q': f'Enter at least {MIN_TERM_LENGTH} characters.'})
+        members = filter_members(Member.objects.only(*LIST_FIELDS), self.request.query_params)
+        return search_members(members, term)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_members(request, export_format):
+    """Stream members as CSV, JSON Lines or Parquet (staff only).
+
+    ``fields`` selects columns (comma separated); the member list filters
+    apply.
+    """
+    try:
+        fields = exporters.parse_fields(request.query_params.get('fields'))
+        chunks = exporters.export_members(
+            filter_members(Member.objects.all(), request.query_params), export_format, fields
+        )
+    except exporters.ExportError as e:
+        return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type, extension = exporters.FORMATS[export_format]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    filename = f'members-{timezone.now():%Y%m%d-%H%M%S}.{extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['GET'])
+def membership_stats(request):
+    """Member counts by county, constituency, ward, category, gender,
+    special interest and registration day"""
+    data = cached_stats()
+    dimensions = request.query_params.get('dimension')
+    if dimensions:
+        names = dimensions.split(',')
+        unknown = [name for name in names if name not in DIMENSIONS]
+        if unknown:
+            return Response({
+                'success': False,
+                'message': f'Unknown dimension(s): {", ".join(unknown)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        data = {'total': data['total'], **{name: data[name] for name in names}}
+    return Response(data)
 
 
+@method_decorator(query_budget('member_detail'), name='get')
 class MemberDetailView(generics.RetrieveAPIView):
     """Get member details"""
     queryset = Member.objects.all()
@@ -25,6 +25,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from membership.metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="NPV Membership API",
@@ -41,6 +43,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('membership.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
     # Swagger/OpenAPI URLs
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name="schema-json"),